@@ -0,0 +1,70 @@
+import gzip
+import pytest
+from waifuset.classes import Dataset, ImageInfo
+from waifuset.classes.dataset.journal import journal_path, dump_as_jsonl, compact_journal
+from waifuset.utils.file_utils import open_file
+
+
+def make_dataset(n=5, caption='solo'):
+    return Dataset({f'img_{i}': ImageInfo(f'images/img_{i}.png', caption=f'{caption}, tag_{i}', aesthetic_score=float(i)) for i in range(n)})
+
+
+def records(dataset):
+    return {image_key: (str(image_info.caption), image_info.aesthetic_score) for image_key, image_info in dataset.items()}
+
+
+@pytest.mark.parametrize('name', ['db.json.gz', 'db.json.zst', 'db.csv.gz', 'db.csv.zst'])
+def test_compressed_snapshot_round_trip(tmp_path, name):
+    fp = tmp_path / name
+    dataset = make_dataset()
+    if '.csv' in name:
+        dataset.to_csv(fp)
+    else:
+        dataset.to_json(fp)
+    with open(fp, 'rb') as f:
+        assert f.read(1) not in b'{i'  # not written as plain text
+    assert records(Dataset(fp)) == records(dataset)
+
+
+@pytest.mark.parametrize('name', ['db.jsonl.gz', 'db.jsonl.zst'])
+def test_compressed_journal_round_trip(tmp_path, name):
+    fp = tmp_path / name
+    dump_as_jsonl(make_dataset(3), fp)
+    dump_as_jsonl(Dataset({'img_1': ImageInfo('images/img_1.png', caption='smile')}), fp, deleted=['img_2'])  # appended as a new frame
+    assert records(Dataset(fp)) == {'img_0': ('solo, tag_0', 0.0), 'img_1': ('smile', None)}
+
+
+def test_truncated_compressed_journal_keeps_complete_records(tmp_path):
+    fp = tmp_path / 'db.jsonl.gz'
+    dump_as_jsonl(make_dataset(3), fp)
+    data = fp.read_bytes()
+    dump_as_jsonl(make_dataset(5, caption='smile'), fp)
+    fp.write_bytes(fp.read_bytes()[:len(data) + 20])  # crash in the middle of the second append
+    assert records(Dataset(fp)) == records(make_dataset(3))
+
+
+def test_journal_of_compressed_snapshot_is_replayed_and_compacted(tmp_path):
+    fp = tmp_path / 'db.json.zst'
+    make_dataset(3).to_json(fp)
+    jnl_fp = journal_path(fp)
+    assert jnl_fp == tmp_path / 'db.jsonl'
+    dump_as_jsonl(Dataset({'img_1': ImageInfo('images/img_1.png', caption='smile')}), jnl_fp, deleted=['img_2'])
+    expected = {'img_0': ('solo, tag_0', 0.0), 'img_1': ('smile', None)}
+    assert records(Dataset(fp)) == expected
+    compact_journal(fp)
+    assert not jnl_fp.exists()
+    assert records(Dataset(fp)) == expected
+    with open_file(fp) as f:
+        assert 'smile' in f.read()
+
+
+def test_open_file_reads_gzip_written_elsewhere(tmp_path):
+    fp = tmp_path / 'captions.txt.gz'
+    with gzip.open(fp, 'wt', encoding='utf-8') as f:
+        f.write('solo, smile\n')
+    with open_file(fp) as f:
+        assert f.read() == 'solo, smile\n'
+    with open_file(fp, 'a') as f:
+        f.write('1girl\n')
+    with gzip.open(fp, 'rt', encoding='utf-8') as f:
+        assert f.read() == 'solo, smile\n1girl\n'
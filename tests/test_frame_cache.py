@@ -0,0 +1,35 @@
+import warnings
+import pandas as pd
+from waifuset.classes import Dataset, ImageInfo
+
+
+def make_dataset():
+    return Dataset({
+        f'k{i}': ImageInfo(f'/data/cat/k{i}.png', caption='solo, 1girl', aesthetic_score=score, original_size=(64, 32))
+        for i, score in enumerate([None, 3.0, 1.0, None])
+    })
+
+
+def test_patched_frame_equals_rebuilt_frame_after_numeric_field_set_to_none():
+    dataset = make_dataset()
+    dataset.df()  # build the cached frame
+    image_info = dataset['k1'].copy()
+    image_info.aesthetic_score = None
+    dataset['k1'] = image_info
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        patched = dataset.df()
+    rebuilt = Dataset(dict(dataset.items())).df()
+    assert patched['aesthetic_score'].dtype == 'float64'
+    pd.testing.assert_frame_equal(patched, rebuilt)
+
+
+def test_patched_frame_keeps_tuples_of_object_columns():
+    dataset = make_dataset()
+    dataset.df()
+    image_info = dataset['k2'].copy()
+    image_info.original_size = (128, 256)
+    image_info.aesthetic_score = 7.5
+    dataset['k2'] = image_info
+    pd.testing.assert_frame_equal(dataset.df(), Dataset(dict(dataset.items())).df())
+    assert dataset.df().loc[2, 'original_size'] == (128, 256)
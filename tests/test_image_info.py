@@ -0,0 +1,36 @@
+import os
+import pickle
+from pathlib import Path
+from waifuset.classes import ImageInfo
+
+
+def test_dict_keeps_the_given_path_form():
+    relative = os.path.join('images', 'cat', 'img.png')
+    image_info = ImageInfo(relative)
+    assert image_info.dict()['image_path'] == relative
+    assert image_info.image_path == Path(os.path.abspath(relative))
+    assert image_info.category == 'cat'
+    assert image_info.copy().dict()['image_path'] == relative
+    assert pickle.loads(pickle.dumps(image_info)).dict()['image_path'] == relative
+    absolute = os.path.abspath(relative)
+    assert ImageInfo(absolute).dict()['image_path'] == absolute
+    assert ImageInfo(Path(relative)).dict()['image_path'] == relative
+
+
+def test_image_path_is_cached_until_changed():
+    image_info = ImageInfo(os.path.join('images', 'cat', 'img.png'))
+    assert image_info.image_path is image_info.image_path
+    image_info.image_path = os.path.join('images', 'dog', 'img.jpg')
+    assert image_info.image_path.name == 'img.jpg'
+    assert image_info.category == 'dog'
+    assert image_info.dict()['image_path'] == os.path.join('images', 'dog', 'img.jpg')
+
+
+def test_pickled_unread_caption_is_read_on_access(tmp_path):
+    from waifuset.classes import Dataset
+    (tmp_path / 'img.png').write_bytes(b'')
+    (tmp_path / 'img.txt').write_text('solo, 1girl')
+    image_info = next(iter(Dataset(tmp_path, read_attrs=True).values()))
+    restored = pickle.loads(pickle.dumps(image_info))
+    assert str(restored.caption) == 'solo, 1girl'
+    assert str(image_info.caption) == 'solo, 1girl'
@@ -0,0 +1,57 @@
+from waifuset.classes import Dataset, ImageInfo
+from waifuset.classes.dataset.journal import journal_path, dump_as_jsonl, compact_journal
+
+
+def make_dataset(n=3, caption='solo'):
+    return Dataset({f'img_{i}': ImageInfo(f'images/img_{i}.png', caption=caption) for i in range(n)})
+
+
+def write(dataset, fp):
+    if fp.suffix == '.csv':
+        dataset.to_csv(fp)
+    else:
+        dataset.to_json(fp)
+
+
+def captions(fp):
+    return {image_key: str(image_info.caption) for image_key, image_info in Dataset(fp).items()}
+
+
+def test_journal_is_replayed_on_top_of_snapshot(tmp_path):
+    fp = tmp_path / 'db.json'
+    make_dataset().to_json(fp)
+    edits = Dataset({'img_1': ImageInfo('images/img_1.png', caption='smile')})
+    dump_as_jsonl(edits, journal_path(fp), deleted=['img_2'])
+    assert captions(fp) == {'img_0': 'solo', 'img_1': 'smile'}
+    compact_journal(fp)
+    assert not journal_path(fp).exists()
+    assert captions(fp) == {'img_0': 'solo', 'img_1': 'smile'}
+
+
+def test_full_write_supersedes_journal(tmp_path):
+    for name in ('db.json', 'db.csv'):
+        fp = tmp_path / name
+        write(make_dataset(), fp)
+        dump_as_jsonl(Dataset({'img_0': ImageInfo('images/img_0.png', caption='old')}), journal_path(fp))
+        write(make_dataset(caption='new'), fp)
+        assert not journal_path(fp).exists()
+        assert captions(fp) == {f'img_{i}': 'new' for i in range(3)}
+
+
+def test_append_write_folds_journal(tmp_path):
+    fp = tmp_path / 'db.json'
+    make_dataset().to_json(fp)
+    dump_as_jsonl(Dataset({'img_0': ImageInfo('images/img_0.png', caption='smile')}), journal_path(fp))
+    Dataset({'img_3': ImageInfo('images/img_3.png', caption='new')}).to_json(fp, mode='a')
+    assert not journal_path(fp).exists()
+    assert captions(fp) == {'img_0': 'smile', 'img_1': 'solo', 'img_2': 'solo', 'img_3': 'new'}
+
+
+def test_truncated_last_record_is_ignored(tmp_path):
+    fp = tmp_path / 'db.jsonl'
+    make_dataset().to_jsonl(fp)
+    with open(fp, 'a', encoding='utf-8') as f:
+        f.write('{"image_key": "img_0", "capt')
+    assert captions(fp) == {f'img_{i}': 'solo' for i in range(3)}
+    dump_as_jsonl(Dataset({'img_0': ImageInfo('images/img_0.png', caption='smile')}), fp)
+    assert captions(fp)['img_0'] == 'smile'
@@ -0,0 +1,35 @@
+from waifuset.classes import Dataset, ImageInfo, LazyDataset
+from waifuset.classes.dataset.journal import dump_as_jsonl
+from waifuset.classes.dataset.jsonl_index import index_path
+
+
+def make_dataset(n, caption):
+    return Dataset({f'k{i}': ImageInfo(f'/data/cat/k{i}.png', caption=f'{caption}, tag{i}') for i in range(n)})
+
+
+def test_rewritten_database_is_indexed_again(tmp_path):
+    fp = tmp_path / 'db.jsonl'
+    dump_as_jsonl(make_dataset(3, 'solo'), fp)
+    dataset = LazyDataset(fp)
+    assert str(dataset['k0'].caption) == 'solo, tag0'
+    dataset.close()
+    assert index_path(fp).is_file()
+
+    fp.unlink()  # rewrite with different offsets that grow past the indexed size
+    dump_as_jsonl(make_dataset(5, 'multiple girls, long hair'), fp)
+    dataset = LazyDataset(fp)
+    assert len(dataset) == 5
+    assert str(dataset['k0'].caption) == 'multiple girls, long hair, tag0'
+    assert str(dataset['k4'].caption) == 'multiple girls, long hair, tag4'
+    dataset.close()
+
+
+def test_appended_records_reuse_the_index(tmp_path):
+    fp = tmp_path / 'db.jsonl'
+    dump_as_jsonl(make_dataset(3, 'solo'), fp)
+    LazyDataset(fp).close()
+    dump_as_jsonl(Dataset({'k1': ImageInfo('/data/cat/k1.png', caption='edited')}), fp)
+    dataset = LazyDataset(fp)
+    assert str(dataset['k1'].caption) == 'edited'
+    assert str(dataset['k2'].caption) == 'solo, tag2'
+    dataset.close()
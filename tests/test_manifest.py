@@ -0,0 +1,64 @@
+import os
+from waifuset.classes import Dataset
+from waifuset.classes.dataset.manifest import ScanManifest, MANIFEST_NAME
+
+
+def make_tree(root):
+    for category in ('cat_a', 'cat_b'):
+        directory = root / category
+        directory.mkdir()
+        for i in range(3):
+            (directory / f'{category}_{i}.png').write_bytes(b'')
+            (directory / f'{category}_{i}.txt').write_text('solo, 1girl')
+
+
+def manifest_stat(root):
+    fp = root / MANIFEST_NAME
+    if not fp.is_file():
+        return None
+    st = os.stat(fp)
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def scan(root):
+    r"""
+    Scan `root` through its manifest, and return the results and whether the manifest was saved.
+    """
+    before = manifest_stat(root)
+    manifest = ScanManifest(root)
+    results = manifest.scan()
+    manifest.save()
+    return results, manifest_stat(root) != before
+
+
+def test_unchanged_tree_does_not_save_manifest_again(tmp_path):
+    make_tree(tmp_path)
+    first, saved = scan(tmp_path)
+    assert saved and (tmp_path / MANIFEST_NAME).is_file()
+    for _ in range(3):
+        results, saved = scan(tmp_path)
+        assert not saved
+        assert results == first
+    assert all(MANIFEST_NAME not in path for path, _ in first)
+
+
+def test_modified_sidecar_is_a_change(tmp_path):
+    make_tree(tmp_path)
+    scan(tmp_path)
+    (tmp_path / 'cat_a' / 'cat_a_0.txt').write_text('solo, 1girl, smile')
+    _, saved = scan(tmp_path)
+    assert saved
+
+
+def test_manifest_keeps_lazy_reading(tmp_path):
+    make_tree(tmp_path)
+    txt = tmp_path / 'cat_a' / 'cat_a_0.txt'
+    for _ in range(2):  # without and with a manifest on disk
+        dataset = Dataset(tmp_path, read_attrs=True, manifest=True)
+        txt.write_text('solo, 1girl, lazy')  # captions are read on first access
+        assert str(dataset['cat_a_0'].caption) == 'solo, 1girl, lazy'
+        txt.write_text('solo, 1girl')
+    dataset = Dataset(tmp_path, read_attrs=True, lazy_reading=False, manifest=True)
+    txt.write_text('solo, 1girl, eager')
+    assert str(dataset['cat_a_0'].caption) == 'solo, 1girl'
+    assert str(dataset['cat_b_0'].caption) == 'solo, 1girl'
@@ -0,0 +1,30 @@
+from waifuset.classes import Dataset
+
+
+def make_dir(root, n=6):
+    for i in range(n):
+        (root / f'img_{i}.png').write_bytes(b'')
+        (root / f'img_{i}.txt').write_text(f'solo, tag_{i}')
+
+
+def append_tag(image_info):
+    image_info.caption = str(image_info.caption) + ', smile'
+    return image_info
+
+
+def test_process_executor_on_lazily_read_dataset(tmp_path):
+    make_dir(tmp_path)
+    dataset = Dataset(tmp_path, read_attrs=True)
+    result = dataset.with_map(append_tag, max_workers=2, executor='process', chunk_size=2)
+    assert {image_key: str(image_info.caption) for image_key, image_info in result.items()} == {f'img_{i}': f'solo, tag_{i}, smile' for i in range(6)}
+    dataset.apply_map(append_tag, max_workers=2, executor='process', chunk_size=2)
+    assert sorted(dataset.keys()) == [f'img_{i}' for i in range(6)]
+    assert all(str(dataset[f'img_{i}'].caption) == f'solo, tag_{i}, smile' for i in range(6))
+
+
+def test_thread_executor_keeps_inputs_when_copying(tmp_path):
+    make_dir(tmp_path)
+    dataset = Dataset(tmp_path, read_attrs=True)
+    result = dataset.with_map(append_tag, max_workers=2)
+    assert str(dataset['img_0'].caption) == 'solo, tag_0'
+    assert str(result['img_0'].caption) == 'solo, tag_0, smile'
@@ -0,0 +1,41 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from waifuset.classes import Dataset, ImageInfo
+from waifuset.classes.dataset.parquet import read_parquet
+
+CAPTIONS = {
+    'img0': 'character: hatsune miku, character: kagamine rin, solo',
+    'img1': 'character: hatsune miku, solo',
+    'img2': 'solo, smile',
+}
+
+
+def make_dataset():
+    return Dataset({image_key: ImageInfo(f'images/cat/{image_key}.png', caption=caption, aesthetic_score=float(i)) for i, (image_key, caption) in enumerate(CAPTIONS.items())})
+
+
+def test_characters_are_list_columns(tmp_path):
+    fp = tmp_path / 'db.parquet'
+    make_dataset().to_parquet(fp)
+    table = read_parquet(fp, columns=['image_key', 'characters'])
+    assert pa.types.is_list(table.schema.field('characters').type)
+    assert table.column('characters').to_pylist() == [['hatsune miku', 'kagamine rin'], ['hatsune miku'], None]
+    assert pc.list_value_length(table.column('characters')).to_pylist() == [2, 1, None]
+
+
+def test_round_trip_and_where(tmp_path):
+    fp = tmp_path / 'db.parquet'
+    make_dataset().to_parquet(fp)
+    dataset = Dataset(fp)
+    assert {image_key: image_info.characters for image_key, image_info in dataset.items()} == {'img0': ['hatsune miku', 'kagamine rin'], 'img1': ['hatsune miku'], 'img2': None}
+    assert list(Dataset(fp, where={'characters': 'hatsune miku'}).keys()) == ['img1']
+    assert list(Dataset(fp, where={'characters': None}).keys()) == ['img2']
+    assert list(Dataset(fp, where={'characters': ('!=', 'hatsune miku'), 'aesthetic_score': ('<', 2)}).keys()) == ['img0']
+
+
+def test_reads_files_with_string_columns(tmp_path):
+    fp = tmp_path / 'old.parquet'
+    pq.write_table(pa.table({'image_key': ['img0'], 'image_path': ['images/cat/img0.png'], 'caption': [CAPTIONS['img0']], 'characters': ['hatsune miku, kagamine rin']}), fp)
+    assert Dataset(fp)['img0'].characters == ['hatsune miku', 'kagamine rin']
+    assert list(Dataset(fp, where={'characters': 'hatsune miku, kagamine rin'}).keys()) == ['img0']
@@ -0,0 +1,53 @@
+from PIL import Image
+from waifuset.classes import Dataset, ImageInfo
+from waifuset.classes.dataset import sorting
+from waifuset.classes.dataset.selection import heap_top_k
+
+SIZES = [(64, 32), (16, 16), (128, 64), (32, 48)]
+
+
+def make_image_dir(root):
+    directory = root / 'cat'
+    directory.mkdir()
+    for i, size in enumerate(SIZES):
+        Image.new('RGB', size).save(directory / f'img{i}.png')
+    return directory
+
+
+def test_sort_by_original_size_reads_unread_sizes(tmp_path):
+    dataset = Dataset(make_image_dir(tmp_path))
+    expected = sorted(dataset.keys(), key=lambda image_key: SIZES[int(image_key[3:])][0] * SIZES[int(image_key[3:])][1])
+    dataset.sort_by(sorting.original_size)
+    assert dataset.keys() == expected
+
+
+def test_column_and_heap_paths_agree_on_sizes(tmp_path):
+    directory = make_image_dir(tmp_path)
+    for method in (sorting.original_size, sorting.original_width, sorting.original_height, sorting.original_aspect_ratio):
+        columnar = Dataset(directory).top_k(method, 3).keys()
+        streamed = heap_top_k(Dataset(directory).items(), [method], 3)
+        assert columnar == streamed
+
+
+def make_tagged_dataset():
+    qualities = ['best', 'low', None, 'amazing']
+    return Dataset({
+        f'img{i:02d}': ImageInfo(f'images/img{i:02d}.png', caption='solo' + (f', {qualities[i % 4]} quality' if qualities[i % 4] else ''), aesthetic_score=(i * 7) % 5 if i % 3 else None)
+        for i in range(24)
+    })
+
+
+def test_fresh_subset_and_cached_columns_sort_alike():
+    methods = (sorting.quality, sorting.aesthetic_score)
+    dataset = make_tagged_dataset()
+    for reverse in (False, True):
+        expected = [image_key for image_key, _ in sorted(dataset.items(), key=lambda item: tuple(method(item[1]) for method in methods), reverse=reverse)]
+        fresh = dataset.make_subset(lambda image_info: True)
+        fresh.sort_by(*methods, reverse=reverse)
+        assert fresh.keys() == expected
+        cached = dataset.make_subset(lambda image_info: True)
+        cached.query('caption_length > 0')
+        cached.sort_by(*methods, reverse=reverse)
+        assert cached.keys() == expected
+        cached.sort_by(sorting.key)  # re-sorting a sorted dataset follows its new order
+        assert cached.keys() == sorted(expected)
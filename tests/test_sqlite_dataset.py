@@ -0,0 +1,67 @@
+import sqlite3
+from waifuset.classes import Dataset, ImageInfo, SQLiteDataset
+
+
+def make_source(n):
+    return Dataset({f'k{i}': ImageInfo(f'/data/cat/k{i}.png', caption=f'solo, tag{i}', aesthetic_score=float(i)) for i in range(n)})
+
+
+def stored_score(fp, image_key):
+    with sqlite3.connect(fp) as conn:
+        return conn.execute("SELECT aesthetic_score FROM metadata WHERE image_key=?", (image_key,)).fetchone()[0]
+
+
+def set_stored_score(fp, image_key, score):
+    with sqlite3.connect(fp) as conn:
+        conn.execute("UPDATE metadata SET aesthetic_score=? WHERE image_key=?", (score, image_key))
+
+
+def test_commit_only_writes_edited_rows(tmp_path):
+    fp = tmp_path / 'db.sqlite'
+    dataset = SQLiteDataset(fp, source=make_source(20), cache_size=8)
+    for image_key in ('k0', 'k1', 'k2', 'k3'):
+        dataset[image_key]
+    dataset['k1'].aesthetic_score = 9.5  # edited in place
+    set_stored_score(fp, 'k2', 4.5)  # written by another connection after k2 was fetched
+    dataset.commit()
+    dataset.close()
+    assert stored_score(fp, 'k1') == 9.5
+    assert stored_score(fp, 'k2') == 4.5  # unedited rows are not rewritten
+
+
+def test_evicted_edits_are_written_before_commit(tmp_path):
+    fp = tmp_path / 'db.sqlite'
+    dataset = SQLiteDataset(fp, source=make_source(20), cache_size=2)
+    dataset['k0'].aesthetic_score = 7.5
+    dataset['k1']
+    assert stored_score(fp, 'k0') == 0.0
+    dataset['k2']  # evicts k0
+    assert stored_score(fp, 'k0') == 7.5
+    assert dataset['k0'].aesthetic_score == 7.5
+    assert dataset['k3'].aesthetic_score == 3.0
+    dataset.close()
+
+
+def test_edits_while_iterating_are_committed(tmp_path):
+    fp = tmp_path / 'db.sqlite'
+    dataset = SQLiteDataset(fp, source=make_source(20), cache_size=4)
+    for image_key, image_info in dataset.items():
+        image_info.caption = f'{image_key}, edited'
+    for image_info in dataset.values():
+        image_info.aesthetic_score += 100
+    dataset.commit()
+    dataset.close()
+    reopened = SQLiteDataset(fp)
+    assert {image_key: (str(image_info.caption), image_info.aesthetic_score) for image_key, image_info in reopened.items()} == {f'k{i}': (f'k{i}, edited', i + 100.0) for i in range(20)}
+    reopened.close()
+
+
+def test_subset_of_sqlite_dataset(tmp_path):
+    dataset = SQLiteDataset(tmp_path / 'db.sqlite', source=make_source(2000), cache_size=16)
+    subset = dataset.make_subset(lambda image_info: image_info.aesthetic_score % 2 == 0)
+    assert len(subset) == 1000
+    del dataset['k0']
+    assert len(subset) == 999
+    assert list(subset.keys()) == [f'k{i}' for i in range(2, 2000, 2)]
+    assert all(image_info.aesthetic_score == float(image_key[1:]) for image_key, image_info in subset.items())
+    dataset.close()
@@ -0,0 +1,35 @@
+import pytest
+from waifuset.classes import Dataset, ImageInfo
+
+
+def make_dataset(n=10):
+    return Dataset({f'img{i}': ImageInfo(f'images/img{i}.png', caption=f'solo, tag{i}', aesthetic_score=float(i)) for i in range(n)})
+
+
+def add_smile(image_info):
+    image_info.caption = str(image_info.caption) + ', smile'
+    return image_info
+
+
+@pytest.mark.parametrize('name', ['out.jsonl', 'out.jsonl.gz', 'out.jsonl.zst'])
+def test_sink_to_jsonl(tmp_path, name):
+    fp = tmp_path / name
+    make_dataset().stream(lambda image_info: image_info.aesthetic_score >= 5).map(add_smile).batch(2).sink(fp)
+    make_dataset().stream(lambda image_info: image_info.aesthetic_score < 2).sink(fp)  # appended
+    result = Dataset(fp)
+    assert sorted(result.keys()) == sorted(['img0', 'img1'] + [f'img{i}' for i in range(5, 10)])
+    assert str(result['img7'].caption) == 'solo, tag7, smile'
+    assert str(result['img0'].caption) == 'solo, tag0'
+
+
+def test_stream_keeps_inputs_and_drops_none_results():
+    dataset = make_dataset()
+    collected = dataset.stream().map(lambda image_info: add_smile(image_info) if image_info.aesthetic_score % 2 else None).collect()
+    assert list(collected.keys()) == [f'img{i}' for i in range(1, 10, 2)]
+    assert str(dataset['img1'].caption) == 'solo, tag1'
+    assert [len(batch) for batch in dataset.stream().batch(4)] == [4, 4, 2]
+
+
+def test_sink_rejects_unknown_targets(tmp_path):
+    with pytest.raises(ValueError):
+        make_dataset().stream().sink(tmp_path / 'out.json')
@@ -0,0 +1,19 @@
+from waifuset.ui.ui_dataset import UIDataset
+
+
+def test_copy_does_not_share_edit_state(tmp_path):
+    for i in range(3):
+        (tmp_path / f'img{i}.png').write_bytes(b'')
+        (tmp_path / f'img{i}.txt').write_text(f'solo, tag{i}')
+    dataset = UIDataset([tmp_path], read_attrs=True, verbose=False)
+    dataset.edit_history.init('img0', dataset['img0'])
+    copied = dataset.copy()
+    assert copied.subset is copied
+    image_info = copied['img0']
+    image_info.caption = 'smile'
+    copied.edit_history.record('img0', image_info)
+    copied.buffer['img0'] = image_info
+    assert 'img0' not in dataset.buffer
+    assert dataset.edit_history.undo('img0') == -1  # nothing to undo in the original
+    assert str(dataset['img0'].caption) == 'solo, tag0'
+    assert str(copied.edit_history.undo('img0').caption) == 'solo, tag0'
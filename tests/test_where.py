@@ -0,0 +1,71 @@
+import pytest
+from waifuset.classes import Dataset, ImageInfo
+from waifuset.classes.dataset.journal import journal_path, dump_as_jsonl
+from waifuset.classes.dataset.predicate import Where
+
+QUALITIES = ['best', 'low', None]
+
+
+def make_dataset():
+    return Dataset({
+        f'img{i}': ImageInfo(
+            f"images/{'cat_a' if i % 2 else 'cat_b'}/img{i}.png",
+            caption='solo' + (f', {QUALITIES[i % 3]} quality' if QUALITIES[i % 3] else ''),
+            aesthetic_score=float(i) if i % 4 else None,
+            original_size=(64 * (i + 1), 64) if i % 5 else None,
+            safe_level='g' if i < 6 else 'e',
+        )
+        for i in range(12)
+    })
+
+
+WHERES = [
+    {'aesthetic_score': ('>=', 5)},
+    {'aesthetic_score': None},
+    {'aesthetic_score': ('!=', 5.0)},
+    {'category': 'cat_a', 'safe_level': ['g']},
+    {'quality': ['best', None]},
+    {'quality': ('not in', ['best'])},
+    {'original_width': ('>', 300)},
+    {'image_key': ['img1', 'img2', 'missing']},
+]
+
+
+def write(dataset, fp):
+    if fp.suffix == '.csv':
+        dataset.to_csv(fp)
+    elif fp.suffix == '.jsonl':
+        dataset.to_jsonl(fp)
+    elif fp.suffix == '.parquet':
+        dataset.to_parquet(fp)
+    elif fp.suffix == '.sqlite':
+        dataset.to_sqlite(fp)
+    else:
+        dataset.to_json(fp)
+
+
+@pytest.mark.parametrize('name', ['db.json', 'db.jsonl', 'db.csv', 'db.parquet', 'db.sqlite'])
+def test_pushdown_matches_filtering_loaded_infos(tmp_path, name):
+    fp = tmp_path / name
+    dataset = make_dataset()
+    write(dataset, fp)
+    for where in WHERES:
+        expected = [image_key for image_key, image_info in Dataset(fp).items() if Where(where).match_info(image_key, image_info)]
+        assert sorted(Dataset(fp, where=where).keys()) == sorted(expected), where
+    assert sorted(Dataset(fp, where={'aesthetic_score': ('>=', 5)}).keys()) == ['img10', 'img11', 'img5', 'img6', 'img7', 'img9']
+
+
+def test_where_applies_to_journal_records(tmp_path):
+    fp = tmp_path / 'db.json'
+    make_dataset().to_json(fp)
+    edits = Dataset({
+        'img0': ImageInfo('images/cat_b/img0.png', aesthetic_score=9.0),  # now matches
+        'img5': ImageInfo('images/cat_a/img5.png', aesthetic_score=1.0),  # no longer matches
+    })
+    dump_as_jsonl(edits, journal_path(fp), deleted=['img6'])
+    assert sorted(Dataset(fp, where={'aesthetic_score': ('>=', 5)}).keys()) == ['img0', 'img10', 'img11', 'img7', 'img9']
+
+
+def test_unknown_field_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        Dataset(make_dataset(), where={'tags': 'solo'})
@@ -1,3 +1,6 @@
 from .caption.caption import Caption
 from .data.data import ImageInfo
+from .data.path_table import PATH_TABLE
 from .dataset.dataset import Dataset
+from .dataset.sqlite_dataset import SQLiteDataset
+from .dataset.lazy_dataset import LazyDataset
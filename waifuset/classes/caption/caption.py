@@ -17,6 +17,8 @@ class Caption:
     characters: list
     styles: list
 
+    __slots__ = ('_sep', '_tags', '_artist', '_quality', '_characters', '_styles')
+
     # if caption_or_tags is a Caption object, return caption_or_tags itself
     def __new__(cls, caption_or_tags=None, sep=', ', fix_typos: bool = True):
         if isinstance(caption_or_tags, Caption):
@@ -64,8 +66,17 @@ class Caption:
             setattr(self, f"_{attr}", LAZY_LOADING)
 
     def copy(self):
-        from copy import deepcopy
-        return deepcopy(self)
+        r"""
+        Copy the tag list and the cached attribute lists, and share the immutable strings.
+        """
+        caption = object.__new__(type(self))
+        caption._sep = self._sep
+        caption._tags = self._tags.copy()
+        caption._artist = self._artist
+        caption._quality = self._quality
+        caption._characters = self._characters.copy() if isinstance(self._characters, list) else self._characters
+        caption._styles = self._styles.copy() if isinstance(self._styles, list) else self._styles
+        return caption
 
     @property
     def tags(self):
@@ -1 +1,2 @@
 from .data import ImageInfo
+from .path_table import PathTable, PATH_TABLE
@@ -0,0 +1,222 @@
+import os
+import threading
+from typing import Dict, Iterable, Optional
+from ...utils import json_utils
+
+PACK_NAME = '.waifuset_captions.pack'
+INDEX_NAME = '.waifuset_captions.idx'
+
+
+class CaptionPack:
+    r"""
+    Packed caption store of a directory, which replaces one `.txt` sidecar per image with a single append-only file.
+    Each record is a json line `[image_key, caption]`, and later records override earlier ones, so updates only append.
+    An offset index `{image_key: (offset, length)}` gives random access by key. It is kept in an index file and only
+    the records appended after the indexed size are scanned when the pack is opened.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.fp = os.path.join(self.directory, PACK_NAME)
+        self.index_fp = os.path.join(self.directory, INDEX_NAME)
+        self._index: Dict[str, tuple] = {}
+        self._size = 0  # end of the last complete record
+        self._garbage = 0  # number of overridden records
+        self._reader = None
+        self._lock = threading.RLock()
+        self._load_index()
+
+    def _load_index(self):
+        if os.path.isfile(self.index_fp):
+            try:
+                data = json_utils.load(self.index_fp)
+                if data['size'] <= os.path.getsize(self.fp):
+                    self._index = {key: tuple(loc) for key, loc in data['index'].items()}
+                    self._size = data['size']
+                    self._garbage = data.get('garbage', 0)
+            except (OSError, ValueError, KeyError):
+                self._index, self._size, self._garbage = {}, 0, 0
+        if os.path.isfile(self.fp) and os.path.getsize(self.fp) > self._size:
+            self._scan(self._size)
+
+    def _scan(self, start):
+        r"""
+        Index the records from byte `start` to the end of the pack. A truncated last record, e.g. left by a crash, is ignored.
+        """
+        with open(self.fp, 'rb') as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    key, caption = json_utils.loads(line)
+                except ValueError:
+                    offset += len(line)
+                    continue
+                if key in self._index:
+                    self._garbage += 1
+                if caption is None:
+                    self._index.pop(key, None)
+                else:
+                    self._index[key] = (offset, len(line))
+                offset += len(line)
+        self._size = offset
+
+    def save_index(self):
+        with self._lock:
+            tmp_fp = self.index_fp + '.tmp'
+            json_utils.dump({'size': self._size, 'garbage': self._garbage, 'index': self._index}, tmp_fp)
+            os.replace(tmp_fp, self.index_fp)
+
+    def get(self, image_key, default=None) -> Optional[str]:
+        loc = self._index.get(image_key)
+        if loc is None:
+            return default
+        with self._lock:
+            if self._reader is None:
+                self._reader = open(self.fp, 'rb')
+            self._reader.seek(loc[0])
+            line = self._reader.read(loc[1])
+        return json_utils.loads(line)[1]
+
+    def __getitem__(self, image_key) -> str:
+        if image_key not in self._index:
+            raise KeyError(image_key)
+        return self.get(image_key)
+
+    def __contains__(self, image_key):
+        return image_key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(list(self._index))
+
+    def keys(self):
+        return list(self._index)
+
+    def items(self):
+        for image_key in self.keys():
+            yield image_key, self.get(image_key)
+
+    def update(self, captions: Dict[str, Optional[str]]):
+        r"""
+        Append captions to the pack in a single write. A None caption deletes the key.
+        """
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.fp, 'ab') as f:
+                if f.tell() != self._size:  # drop a truncated last record
+                    f.truncate(self._size)
+                    f.seek(self._size)
+                offset = self._size
+                for image_key, caption in captions.items():
+                    line = (json_utils.dumps([image_key, str(caption) if caption is not None else None]) + '\n').encode('utf-8')
+                    f.write(line)
+                    if image_key in self._index:
+                        self._garbage += 1
+                    if caption is None:
+                        self._index.pop(image_key, None)
+                    else:
+                        self._index[image_key] = (offset, len(line))
+                    offset += len(line)
+            self._size = offset
+            self.save_index()
+            if self._garbage > max(len(self._index), 1024):
+                self.compact()
+
+    def __setitem__(self, image_key, caption):
+        self.update({image_key: caption})
+
+    def __delitem__(self, image_key):
+        self.update({image_key: None})
+
+    def compact(self):
+        r"""
+        Rewrite the pack with only the live records.
+        """
+        with self._lock:
+            captions = dict(self.items())
+            self.close()
+            tmp_fp = self.fp + '.tmp'
+            index, offset = {}, 0
+            with open(tmp_fp, 'wb') as f:
+                for image_key, caption in captions.items():
+                    line = (json_utils.dumps([image_key, caption]) + '\n').encode('utf-8')
+                    f.write(line)
+                    index[image_key] = (offset, len(line))
+                    offset += len(line)
+            os.replace(tmp_fp, self.fp)
+            self._index, self._size, self._garbage = index, offset, 0
+            self.save_index()
+
+    def export_txts(self, keys: Iterable[str] = None) -> int:
+        r"""
+        Write the captions of the pack to `{image_key}.txt` sidecars in its directory, e.g. for trainers that read txt captions.
+        Returns the number of written files.
+        """
+        count = 0
+        for image_key in (self.keys() if keys is None else keys):
+            caption = self.get(image_key)
+            if caption is None:
+                continue
+            with open(os.path.join(self.directory, image_key + '.txt'), 'w', encoding='utf-8') as f:
+                f.write(caption)
+            count += 1
+        return count
+
+    def close(self):
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+
+_packs: Dict[str, Optional[CaptionPack]] = {}
+_packs_lock = threading.Lock()
+
+
+def get_pack(directory, create=False) -> Optional[CaptionPack]:
+    r"""
+    Get the shared caption pack of a directory. Returns None if the directory has no pack and `create` is False.
+    Whether a directory has a pack is only checked once per process, packs created with `create=True` are registered.
+    """
+    pack = _packs.get(directory)
+    if pack is None and (create or directory not in _packs):
+        directory = os.path.abspath(directory)
+        with _packs_lock:
+            pack = _packs.get(directory)
+            if pack is None and (create or directory not in _packs):
+                pack = CaptionPack(directory) if create or os.path.isfile(os.path.join(directory, PACK_NAME)) else None
+                _packs[directory] = pack
+    return pack
+
+
+def dump_as_packs(source, verbose=False):
+    r"""
+    Write the captions of a dataset into the caption packs of their image directories, one append per directory.
+    """
+    from tqdm import tqdm
+    from .path_table import PATH_TABLE
+    from ..dataset import Dataset
+    dataset = Dataset(source) if not isinstance(source, Dataset) else source
+    groups = {}
+    for image_key, image_info in dataset.items():
+        if image_info.caption is not None:
+            groups.setdefault(image_info.dir_id, {})[image_key] = image_info.caption
+    for dir_id, captions in tqdm(groups.items(), desc='dumping to caption packs', smoothing=1, disable=not verbose):
+        get_pack(PATH_TABLE.dir(dir_id), create=True).update(captions)
+
+
+def export_packs_to_txts(directories: Iterable, verbose=False) -> int:
+    r"""
+    Regenerate the `.txt` sidecars from the caption packs of `directories`. Directories without a pack are skipped.
+    """
+    from tqdm import tqdm
+    count = 0
+    for directory in tqdm(list(directories), desc='exporting caption packs', smoothing=1, disable=not verbose):
+        if (pack := get_pack(directory)) is not None:
+            count += pack.export_txts()
+    return count
@@ -1,4 +1,5 @@
-import json
+import os
+import re
 import time
 from PIL import Image
 from pathlib import Path
@@ -6,6 +7,10 @@ from typing import Tuple, Literal, Iterable
 from collections import OrderedDict
 from ..caption import Caption, captionize
 from ...const import IMAGE_EXTS
+from .path_table import PATH_TABLE, split_path
+from .caption_pack import PACK_NAME, get_pack
+from ...utils.file_utils import write_bytes_atomic
+from ...utils import json_utils
 
 LAZY_READING = 999
 LAZY_LOADING = 998
@@ -50,6 +55,23 @@ class ImageInfo:
         'quality': str,
     }
 
+    # compact layout: the image path is a directory id of `PATH_TABLE` plus a stem and a suffix, numbers are kept in primitive slots
+    __slots__ = (
+        '_dir_id',
+        '_given_dir_id',  # directory in the form it was given, see `split_path`, which is the form saved by `dict`
+        '_stem',
+        '_suffix',
+        '_image_path',  # cached `Path` of the image, None if not built yet
+        '_caption',  # None, raw value, `Caption` or `LAZY_READING`
+        '_description',
+        '_width',
+        '_height',
+        '_aesthetic_score',
+        '_safe_level',
+        '_safe_rating',
+        '_perceptual_hash',
+    )
+
     def __init__(
         self,
         image_path,
@@ -62,48 +84,49 @@ class ImageInfo:
         perceptual_hash=None,
         **kwargs,
     ):
-        # main structure
-        self._dict = {
-            'image_path': auto_convert(image_path, str),
-            'caption': auto_convert(caption, str),
-            'description': auto_convert(description, str),
-            'original_size': auto_convert(original_size, tuple),
-            'aesthetic_score': auto_convert(aesthetic_score, float),
-            'safe_level': auto_convert(safe_level, str),
-            'safe_rating': auto_convert(safe_rating, float),
-            'perceptual_hash': auto_convert(perceptual_hash, str),
-        }
-
-        # attr caches
-        self._image_path = image_path if isinstance(image_path, Path) else LAZY_LOADING
-        self._caption = caption if isinstance(caption, Caption) else LAZY_LOADING
-
-        self._description = description if isinstance(description, str) else LAZY_LOADING
-        self._original_size = original_size if isinstance(original_size, tuple) else LAZY_LOADING
-        self._aesthetic_score = aesthetic_score if isinstance(aesthetic_score, float) else LAZY_LOADING
-        self._safe_level = safe_level if isinstance(safe_level, str) else LAZY_LOADING
-        self._safe_rating = safe_rating if isinstance(safe_rating, float) else LAZY_LOADING
-        self._perceptual_hash = perceptual_hash if isinstance(perceptual_hash, str) else LAZY_LOADING
+        self._dir_id, self._given_dir_id, self._stem, self._suffix = split_path(image_path)
+        self._image_path = None
+        self._caption = caption if isinstance(caption, Caption) or is_lazy_reading(caption) else auto_convert(caption, str)
+        self._description = auto_convert(description, str)
+        self._width, self._height = to_size(original_size)
+        self._aesthetic_score = auto_convert(aesthetic_score, float)
+        self._safe_level = auto_convert(safe_level, str)
+        self._safe_rating = auto_convert(safe_rating, float)
+        self._perceptual_hash = auto_convert(perceptual_hash, str)
 
         # load caption caches
         if caption is not None and kwargs:
             self.caption.load_cache(**kwargs)
 
     def clean_cache(self, *attrs):
-        for attr in attrs:
-            setattr(self, f'_{attr}', None)
+        r"""
+        Drop values cached from the slots, which is only the `Path` of `image_path`, so that it is built again on next access.
+        """
+        if not attrs or 'image_path' in attrs:
+            self._image_path = None
+
+    def _path_str(self):
+        return os.path.join(PATH_TABLE.dir(self._dir_id), self._stem + self._suffix)
+
+    def _given_path_str(self):
+        r"""
+        The image path in the form it was given, e.g. relative, which is how it is saved.
+        """
+        if self._given_dir_id < 0:
+            return self._path_str()
+        return os.path.join(PATH_TABLE.given_dir(self._given_dir_id), self._stem + self._suffix)
 
     @property
     def image_path(self):
-        if self._image_path is LAZY_LOADING:
-            self._image_path = auto_convert(self._dict['image_path'], Path)
-        return self._image_path
+        image_path = self._image_path
+        if image_path is None:
+            image_path = self._image_path = Path(self._path_str())
+        return image_path
 
     @image_path.setter
     def image_path(self, value):
-        self._dict['image_path'] = value  # set main dict
-        self._image_path = LAZY_LOADING  # clean cache
-        self.clean_cache('suffix', 'stem', 'category', 'source')
+        self._dir_id, self._given_dir_id, self._stem, self._suffix = split_path(value)
+        self._image_path = None
 
     @property
     def label_path(self):
@@ -111,98 +134,70 @@ class ImageInfo:
 
     @property
     def caption(self):
-        if self._caption is LAZY_LOADING:
-            self._caption = auto_convert(self._dict['caption'], Caption)
-        if self._caption is LAZY_READING:
-            self._caption = auto_convert(read_txt_caption(self.image_path.with_suffix('.txt')), Caption)
-            # if self._caption is not None:
-            #     self._caption.load_cache(artist=self._dict.get('artist'), characters=self._dict.get('characters'), styles=self._dict.get('styles'), quality=self._dict.get('quality'))
-            self._dict['caption'] = self._caption
-        return self._caption
+        caption = self._caption
+        if caption is LAZY_READING:
+            caption = self._caption = auto_convert(self._read_caption(), Caption)
+        elif caption is not None and not isinstance(caption, Caption):
+            caption = self._caption = auto_convert(caption, Caption)
+        return caption
 
     @caption.setter
     def caption(self, value):
-        if value == LAZY_READING:
-            self._caption = LAZY_READING
-            return
-        self._dict['caption'] = value
-        self._dict['artist'] = LAZY_LOADING
-        self._dict['characters'] = LAZY_LOADING
-        self._dict['styles'] = LAZY_LOADING
-        self._dict['quality'] = LAZY_LOADING
-        self._caption = LAZY_LOADING
+        self._caption = LAZY_READING if is_lazy_reading(value) else value
 
     @property
     def description(self):
-        if self._description is LAZY_LOADING:
-            self._description = auto_convert(self._dict['description'], str)
         return self._description
 
     @description.setter
     def description(self, value):
-        self._dict['description'] = value
-        self._description = LAZY_LOADING
+        self._description = auto_convert(value, str)
 
     @property
     def original_size(self):
-        if self._original_size is LAZY_LOADING:
-            self._original_size = auto_convert(self._dict['original_size'], tuple)
-        if self._original_size is None:
+        if self._width is None:
             try:
                 with Image.open(self.image_path) as image:
-                    self._original_size = auto_convert(image.size, tuple)
+                    self._width, self._height = image.size
             except Exception as e:
                 return None
-        return self._original_size
+        return (self._width, self._height)
 
     @original_size.setter
     def original_size(self, value):
-        self._dict['original_size'] = value
-        self._original_size = LAZY_LOADING
+        self._width, self._height = to_size(value)
 
     @property
     def aesthetic_score(self):
-        if self._aesthetic_score is LAZY_LOADING:
-            self._aesthetic_score = auto_convert(self._dict['aesthetic_score'], float)
         return self._aesthetic_score
 
     @aesthetic_score.setter
     def aesthetic_score(self, value):
-        self._dict['aesthetic_score'] = value
-        self._aesthetic_score = LAZY_LOADING
+        self._aesthetic_score = auto_convert(value, float)
 
     @property
     def safe_level(self):
-        if self._safe_level is LAZY_LOADING:
-            self._safe_level = auto_convert(self._dict['safe_level'], str)
         return self._safe_level
 
     @safe_level.setter
     def safe_level(self, value):
-        self._dict['safe_level'] = value
-        self._safe_level = LAZY_LOADING
+        self._safe_level = auto_convert(value, str)
 
     @property
     def safe_rating(self):
-        if self._safe_rating is LAZY_LOADING:
-            self._safe_rating = auto_convert(self._dict['safe_rating'], float)
         return self._safe_rating
 
     @safe_rating.setter
     def safe_rating(self, value):
-        self._dict['safe_rating'] = value
-        self._safe_rating = LAZY_LOADING
+        self._safe_rating = auto_convert(value, float)
 
     @property
     def perceptual_hash(self):
-        if self._perceptual_hash is LAZY_LOADING:
-            self._perceptual_hash = auto_convert(self._dict['perceptual_hash'], str)
         return self._perceptual_hash
 
     @perceptual_hash.setter
     def perceptual_hash(self, value):
-        self._dict['perceptual_hash'] = value
-        self._perceptual_hash = LAZY_LOADING
+        self._perceptual_hash = auto_convert(value, str)
 
     @property
     def copyrights(self):
@@ -210,27 +205,34 @@ class ImageInfo:
 
     @property
     def stem(self):
-        return self.image_path.stem
+        return self._stem
 
     @property
     def key(self):
-        return self.stem
+        return self._stem
 
     @property
     def suffix(self):
-        return self.image_path.suffix
+        return self._suffix
 
     @property
     def category(self):
-        return self.image_path.parent.name
+        return PATH_TABLE.category(self._dir_id)
+
+    @property
+    def dir_id(self):
+        r"""
+        Id of the image directory in `PATH_TABLE`. Images of the same directory share the same id.
+        """
+        return self._dir_id
 
     @property
     def source(self):
-        return self.image_path.parent.parent
+        return PATH_TABLE.path(PATH_TABLE.parent(self._dir_id))
 
     @property
     def root(self):
-        return self.image_path.parent.parent.parent
+        return PATH_TABLE.path(PATH_TABLE.parent(PATH_TABLE.parent(self._dir_id)))
 
     @property
     def artist(self):
@@ -265,9 +267,19 @@ class ImageInfo:
         self.caption.quality = value
 
     def dict(self, attrs: Tuple[str] = None):
-        self._dict = {k: auto_convert(v, self.__dicttype__[k]) for k, v in self._dict.items()}
-        self._dict.update(self.caption.attr_dict() if self.caption is not None else {'artist': None, 'characters': None, 'styles': None, 'quality': None})
-        return self._dict if attrs is None else {attr: self._dict[attr] for attr in attrs}
+        caption = self.caption
+        dic = {
+            'image_path': self._given_path_str(),
+            'caption': str(caption) if caption is not None else None,
+            'description': self._description,
+            'original_size': (self._width, self._height) if self._width is not None else None,
+            'aesthetic_score': self._aesthetic_score,
+            'safe_level': self._safe_level,
+            'safe_rating': self._safe_rating,
+            'perceptual_hash': self._perceptual_hash,
+        }
+        dic.update(caption.attr_dict() if caption is not None else {'artist': None, 'characters': None, 'styles': None, 'quality': None})
+        return dic if attrs is None else {attr: dic[attr] for attr in attrs}
 
     def __eq__(self, other):
         if not isinstance(other, ImageInfo):
@@ -297,6 +309,15 @@ class ImageInfo:
         from ...utils.image_utils import parse_gen_info
         return parse_gen_info(self.metadata)
 
+    def _read_caption(self):
+        r"""
+        Read the caption from the caption pack of the image directory if it has one, otherwise from the txt sidecar.
+        """
+        pack = get_pack(PATH_TABLE.dir(self._dir_id))
+        if pack is not None and self._stem in pack:
+            return pack.get(self._stem)
+        return read_txt_caption(self.label_path)
+
     def read_txt_caption(self, label_path=None):
         self.caption = read_txt_caption(label_path or self.image_path.with_suffix('.txt'))
 
@@ -304,7 +325,10 @@ class ImageInfo:
         if not self.caption:
             return
         label_path = Path(label_path or self.image_path.with_suffix('.txt'))
-        label_path.write_text(str(self.caption) if self.caption else '', encoding='utf-8')
+        write_bytes_atomic(label_path, str(self.caption).encode('utf-8'))
+        pack = get_pack(PATH_TABLE.dir(self._dir_id))
+        if pack is not None and self._stem in pack and label_path.parent == Path(pack.directory):  # keep the pack, which shadows the txt, up to date
+            pack[self._stem] = self.caption
 
     def read_attrs(self, types: Literal['txt', 'danbooru'] = None, lazy=True):
         try:
@@ -319,8 +343,38 @@ class ImageInfo:
                 setattr(self, attr, value)
 
     def copy(self):
-        from copy import deepcopy
-        return deepcopy(self)
+        r"""
+        Copy the caption and share all other attributes, which are immutable.
+        """
+        image_info = object.__new__(type(self))
+        image_info._dir_id = self._dir_id
+        image_info._given_dir_id = self._given_dir_id
+        image_info._stem = self._stem
+        image_info._suffix = self._suffix
+        image_info._image_path = self._image_path
+        image_info._caption = self._caption.copy() if isinstance(self._caption, Caption) else self._caption
+        image_info._description = self._description
+        image_info._width = self._width
+        image_info._height = self._height
+        image_info._aesthetic_score = self._aesthetic_score
+        image_info._safe_level = self._safe_level
+        image_info._safe_rating = self._safe_rating
+        image_info._perceptual_hash = self._perceptual_hash
+        return image_info
+
+    def __getstate__(self):  # directory ids are local to the process
+        state = {attr: getattr(self, attr) for attr in self.__slots__ if attr not in ('_dir_id', '_given_dir_id', '_stem', '_suffix', '_image_path')}
+        state['image_path'] = self._given_path_str()
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        self._dir_id, self._given_dir_id, self._stem, self._suffix = split_path(state.pop('image_path'))
+        self._image_path = None
+        for attr, value in state.items():
+            setattr(self, attr, value)
+        if is_lazy_reading(self._caption):  # unpickled ints are not the sentinel itself
+            self._caption = LAZY_READING
 
     def __getitem__(self, key):
         return getattr(self, key)
@@ -331,6 +385,25 @@ ImageInfo._caption_attrs = Caption.__annotations__
 ImageInfo._all_attrs = {**ImageInfo._self_attrs, **ImageInfo._caption_attrs}
 
 
+def is_lazy_reading(value):
+    r"""
+    Whether `value` marks a caption that hasn't been read yet. Compared by value since `LAZY_READING` loses its identity when pickled.
+    """
+    return type(value) is int and value == LAZY_READING
+
+
+def to_size(value):
+    r"""
+    Convert an original size, e.g. `(w, h)`, `[w, h]` or the string `'(w, h)'` from a csv database, to a `(width, height)` pair of ints.
+    """
+    if value is None:
+        return None, None
+    if isinstance(value, str):
+        value = re.findall(r'\d+', value)
+    width, height = value
+    return int(width), int(height)
+
+
 def read_txt_caption(fp):
     if (fp := auto_convert(fp, Path)).is_file():
         caption = fp.read_text(encoding='utf-8')
@@ -389,6 +462,11 @@ def read_attrs(img_info: ImageInfo, types: Literal['txt', 'danbooru'] = None, la
     img_path = img_info.image_path
 
     txt_path = img_path.with_suffix('.txt')
+    if 'txt' in types and (pack := get_pack(PATH_TABLE.dir(img_info.dir_id))) is not None and img_info.key in pack:
+        return {
+            'image_path': img_path,
+            'caption': pack.get(img_info.key) if not lazy else LAZY_READING,
+        }
     if 'txt' in types and txt_path.is_file():
         caption = txt_path.read_text(encoding='utf-8') if not lazy else LAZY_READING
         attrs = {
@@ -399,14 +477,73 @@ def read_attrs(img_info: ImageInfo, types: Literal['txt', 'danbooru'] = None, la
 
     if 'danbooru' in types:
         if (waifuc_md_path := img_path.with_name(f".{img_path.stem}_meta.json")).is_file():  # waifuc naming format
-            with open(waifuc_md_path, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
+            metadata = json_utils.load(waifuc_md_path)
             attrs = parse_danbooru_metadata(metadata['danbooru'])
             return attrs
         elif (gallery_dl_md_path := img_path.with_name(f"{img_path.name}.json")).is_file():
-            with open(gallery_dl_md_path, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
+            metadata = json_utils.load(gallery_dl_md_path)
             attrs = parse_danbooru_metadata(metadata)
             return attrs
 
     return None
+
+
+def read_attrs_batch(img_infos: Iterable[ImageInfo], types: Literal['txt', 'danbooru'] = None, lazy=False, max_workers=1, pbar=None):
+    r"""
+    Read attributes of many images in place, the same as calling `ImageInfo.read_attrs` on each of them.
+    Existence of sidecar files is looked up in a single listing per directory instead of probing every sidecar path,
+    and directories are read and parsed in a thread pool.
+    :param pbar: Optional progress bar updated with the number of images of each finished directory.
+    """
+    import concurrent.futures as cf
+    if isinstance(types, str):
+        types = [types]
+    types = types or ('txt', 'danbooru')
+
+    groups = {}
+    for img_info in img_infos:
+        groups.setdefault(img_info.dir_id, []).append(img_info)
+
+    def list_dir(dir_id):
+        try:
+            return set(os.listdir(PATH_TABLE.dir(dir_id)))
+        except OSError:
+            return set()
+
+    def read_chunk(dir_id, names, chunk):
+        directory = PATH_TABLE.dir(dir_id)
+        pack = get_pack(directory, create=True) if PACK_NAME in names else None
+        for img_info in chunk:
+            stem, filename = img_info.stem, img_info.stem + img_info.suffix
+            try:
+                attrs = None
+                if 'txt' in types and pack is not None and stem in pack:
+                    attrs = {'caption': LAZY_READING if lazy else pack.get(stem)}
+                elif 'txt' in types and stem + '.txt' in names:
+                    if lazy:
+                        attrs = {'caption': LAZY_READING}
+                    else:
+                        with open(os.path.join(directory, stem + '.txt'), 'r', encoding='utf-8') as f:
+                            attrs = {'caption': f.read()}
+                elif 'danbooru' in types:
+                    if (waifuc_md_name := f".{stem}_meta.json") in names:  # waifuc naming format
+                        attrs = parse_danbooru_metadata(json_utils.load(os.path.join(directory, waifuc_md_name))['danbooru'])
+                    elif (gallery_dl_md_name := f"{filename}.json") in names:
+                        attrs = parse_danbooru_metadata(json_utils.load(os.path.join(directory, gallery_dl_md_name)))
+            except Exception as e:
+                print(f"failed to read attrs for {img_info.image_path}: {e}")
+                continue
+            if not attrs:
+                continue
+            for attr, value in attrs.items():
+                if attr in ImageInfo._self_attrs:
+                    setattr(img_info, attr, value)
+        if pbar is not None:
+            pbar.update(len(chunk))
+
+    chunk_size = 256
+    with cf.ThreadPoolExecutor(max_workers=max(max_workers or 1, 1)) as executor:
+        listings = dict(zip(groups, executor.map(list_dir, groups)))
+        chunks = ((dir_id, listings[dir_id], group[i:i + chunk_size]) for dir_id, group in groups.items() for i in range(0, len(group), chunk_size))
+        for _ in executor.map(lambda task: read_chunk(*task), chunks):
+            pass
@@ -0,0 +1,110 @@
+import os
+import threading
+from pathlib import Path
+from typing import List, Dict
+
+
+class PathTable:
+    r"""
+    Interning table of directories shared by all `ImageInfo` objects, so that each image only stores a directory id plus its stem and suffix.
+    Per-directory values, e.g. the category name and the parent directory, are computed once per directory instead of once per image.
+    """
+
+    def __init__(self):
+        self._dirs: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._categories: List[str] = []
+        self._parents: List[int] = []  # parent directory ids, -1 if not interned yet
+        self._paths: List[Path] = []  # `Path` objects, None if not built yet
+        self._given_dirs: List[str] = []  # directories in the form they were given, when it differs from the absolute one
+        self._given_ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def intern(self, directory: str) -> int:
+        r"""
+        Get the id of an absolute directory path, adding it to the table if needed.
+        """
+        dir_id = self._ids.get(directory)
+        if dir_id is None:
+            with self._lock:
+                dir_id = self._ids.get(directory)
+                if dir_id is None:
+                    dir_id = len(self._dirs)
+                    self._dirs.append(directory)
+                    self._categories.append(os.path.basename(directory))
+                    self._parents.append(-1)
+                    self._paths.append(None)
+                    self._ids[directory] = dir_id
+        return dir_id
+
+    def intern_given(self, directory: str) -> int:
+        r"""
+        Get the id of a directory in the form it was given, e.g. a relative path, adding it to the table of given forms if needed.
+        """
+        given_id = self._given_ids.get(directory)
+        if given_id is None:
+            with self._lock:
+                given_id = self._given_ids.get(directory)
+                if given_id is None:
+                    given_id = self._given_ids[directory] = len(self._given_dirs)
+                    self._given_dirs.append(directory)
+        return given_id
+
+    def dir(self, dir_id: int) -> str:
+        return self._dirs[dir_id]
+
+    def given_dir(self, given_id: int) -> str:
+        return self._given_dirs[given_id]
+
+    def path(self, dir_id: int) -> Path:
+        path = self._paths[dir_id]
+        if path is None:
+            path = self._paths[dir_id] = Path(self._dirs[dir_id])
+        return path
+
+    def category(self, dir_id: int) -> str:
+        r"""
+        Name of the directory, i.e. the category of the images in it.
+        """
+        return self._categories[dir_id]
+
+    def parent(self, dir_id: int) -> int:
+        r"""
+        Id of the parent directory, i.e. the source of the images in the directory.
+        """
+        parent_id = self._parents[dir_id]
+        if parent_id < 0:
+            parent_id = self._parents[dir_id] = self.intern(os.path.dirname(self._dirs[dir_id]))
+        return parent_id
+
+    def find(self, directory) -> int:
+        r"""
+        Get the id of a directory without adding it to the table. Returns None if it is not interned.
+        """
+        return self._ids.get(os.path.abspath(directory))
+
+    def ids_of_category(self, *categories: str) -> List[int]:
+        r"""
+        Ids of all interned directories whose name is one of `categories`.
+        """
+        categories = set(categories)
+        return [dir_id for dir_id, category in enumerate(self._categories) if category in categories]
+
+    def __len__(self):
+        return len(self._dirs)
+
+
+PATH_TABLE = PathTable()
+
+
+def split_path(path) -> tuple:
+    r"""
+    Split a path into `(dir_id, given_id, stem, suffix)` with its absolute directory interned in `PATH_TABLE`.
+    `given_id` is the id of the directory in the form it was given, see `PathTable.intern_given`, or -1 if it was given as the absolute directory.
+    """
+    path = os.fspath(path)
+    given_directory, filename = os.path.split(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    stem, suffix = os.path.splitext(filename)
+    given_id = -1 if given_directory == directory else PATH_TABLE.intern_given(given_directory)
+    return PATH_TABLE.intern(directory), given_id, stem, suffix
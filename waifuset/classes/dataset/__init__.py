@@ -1 +1,4 @@
 from .dataset import Dataset
+from .sqlite_dataset import SQLiteDataset
+from .lazy_dataset import LazyDataset
+from .stream import Stream
@@ -0,0 +1,404 @@
+import re
+import ast
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Union
+from ..data import ImageInfo
+from .predicate import OPERATORS, parse_condition, test_value
+
+# column name -> function of (image_key, image_info) that extracts a number or None
+NUMERIC_COLUMNS: Dict[str, Callable[[str, ImageInfo], Optional[float]]] = {
+    'aesthetic_score': lambda image_key, image_info: image_info.aesthetic_score,
+    'safe_rating': lambda image_key, image_info: image_info.safe_rating,
+    'original_width': lambda image_key, image_info: (image_info.original_size or (None, None))[0],  # sizes that haven't been read are read from the image once
+    'original_height': lambda image_key, image_info: (image_info.original_size or (None, None))[1],
+    'caption_length': lambda image_key, image_info: len(image_info.caption) if image_info.caption is not None else None,
+}
+
+# column name -> function of (image_key, image_info) that extracts a hashable value or None, stored as integer codes
+CATEGORICAL_COLUMNS: Dict[str, Callable[[str, ImageInfo], Any]] = {
+    'image_key': lambda image_key, image_info: image_key,
+    'stem': lambda image_key, image_info: image_info.stem,
+    'suffix': lambda image_key, image_info: image_info.suffix,
+    'category': lambda image_key, image_info: image_info.category,
+    'description': lambda image_key, image_info: image_info.description,
+    'safe_level': lambda image_key, image_info: image_info.safe_level,
+    'perceptual_hash': lambda image_key, image_info: image_info.perceptual_hash,
+    'artist': lambda image_key, image_info: image_info.artist,
+    'quality': lambda image_key, image_info: image_info.quality,
+}
+
+# index name -> function of image_info that extracts several values, stored as an inverted index
+INDEXES: Dict[str, Callable[[ImageInfo], Any]] = {
+    'tags': lambda image_info: image_info.caption.tags if image_info.caption is not None else (),
+    'characters': lambda image_info: image_info.characters if image_info.caption is not None else (),
+    'styles': lambda image_info: image_info.styles if image_info.caption is not None else (),
+}
+
+# query function -> index
+QUERY_FUNCTIONS = {
+    'has_tag': 'tags',
+    'has_character': 'characters',
+    'has_style': 'styles',
+}
+
+# columns whose values may have to be read from the images
+SIZE_COLUMNS = ('original_width', 'original_height')
+
+MAX_EDIT_LOG = 65536
+
+
+def read_sizes(image_infos, max_workers=8):
+    r"""
+    Read the sizes of images whose sizes haven't been read yet in a thread pool, which caches them in the image infos.
+    """
+    import concurrent.futures as cf
+    image_infos = [image_info for image_info in image_infos if image_info._width is None]
+    if len(image_infos) < 2 * max_workers:
+        for image_info in image_infos:
+            image_info.original_size
+        return
+    with cf.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in executor.map(lambda image_info: image_info.original_size, image_infos, chunksize=64):
+            pass
+
+
+class Categorical:
+    r"""
+    Column of hashable values stored as integer codes into `categories`, where -1 is a missing value.
+    """
+
+    def __init__(self, values):
+        self.categories: List = []
+        self.lookup: Dict[Any, int] = {}
+        self.codes = np.fromiter((self.code(value) for value in values), dtype=np.int32)
+
+    def code(self, value) -> int:
+        if value is None:
+            return -1
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.categories)
+            self.categories.append(value)
+        return code
+
+    def test(self, op, target) -> np.ndarray:
+        r"""
+        Evaluate `value <op> target` once per category and broadcast the results to rows.
+        """
+        table = np.fromiter((test_value(value, op, target) for value in self.categories), dtype=bool, count=len(self.categories))
+        table = np.append(table, test_value(None, op, target))  # code -1 picks the result of missing values
+        return table[self.codes]
+
+    def take(self, rows: np.ndarray) -> 'Categorical':
+        r"""
+        Column of the values at `rows`, sharing the categories.
+        """
+        column = object.__new__(Categorical)
+        column.categories, column.lookup, column.codes = self.categories, self.lookup, self.codes[rows]
+        return column
+
+    def map(self, func: Callable[[Any], float], default: float) -> np.ndarray:
+        r"""
+        Map values to numbers once per category and broadcast them to rows, where missing values map to `default`.
+        """
+        table = np.fromiter((func(value) for value in self.categories), dtype=np.float64, count=len(self.categories))
+        return np.append(table, default)[self.codes]
+
+    def ranks(self) -> np.ndarray:
+        r"""
+        Rank of the value of every row in the sorted categories, where missing values rank first.
+        """
+        table = np.empty(len(self.categories) + 1, dtype=np.int64)
+        table[sorted(range(len(self.categories)), key=self.categories.__getitem__)] = np.arange(len(self.categories))
+        table[-1] = -1
+        return table[self.codes]
+
+
+class Index:
+    r"""
+    Inverted index from values to the positions of rows containing them, for multi-valued attributes such as tags.
+    """
+
+    def __init__(self, values):
+        self.rows: List[tuple] = []
+        self.positions: Dict[Any, set] = {}
+        for i, row_values in enumerate(values):
+            row_values = tuple(row_values or ())
+            self.rows.append(row_values)
+            for value in row_values:
+                self.positions.setdefault(value, set()).add(i)
+
+    def set_row(self, i, row_values):
+        for value in self.rows[i]:
+            self.positions[value].discard(i)
+        row_values = tuple(row_values or ())
+        self.rows[i] = row_values
+        for value in row_values:
+            self.positions.setdefault(value, set()).add(i)
+
+    def contains(self, value, size) -> np.ndarray:
+        mask = np.zeros(size, dtype=bool)
+        positions = self.positions.get(value)
+        if positions:
+            mask[np.fromiter(positions, dtype=np.int64, count=len(positions))] = True
+        return mask
+
+
+class ColumnCache:
+    r"""
+    Columnar projection of a dataset: numeric attributes as float arrays with NaN for missing values, categorical attributes as codes,
+    and multi-valued attributes as inverted indexes. Columns are extracted on first use, which is the only pass that touches the image infos.
+    Columns are stored by row, i.e. in the order of the dataset when the cache was built, and `order` maps the current order of the dataset to rows,
+    so reordering the dataset only permutes `order`.
+    The cache follows the version of its dataset: rows of replaced image infos are updated in place, and other changes rebuild it.
+    In-place edits of image infos are not tracked, assign them back to the dataset to keep the cache in sync.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.version = dataset._version
+        self.row_keys: List[str] = list(dataset.keys())
+        self.rows = {image_key: i for i, image_key in enumerate(self.row_keys)}
+        self.order: Optional[np.ndarray] = None  # None for the order of rows
+        self.numeric: Dict[str, np.ndarray] = {}
+        self.categorical: Dict[str, Categorical] = {}
+        self.indexes: Dict[str, Index] = {}
+        self._keys = None
+
+    def __len__(self):
+        return len(self.row_keys)
+
+    @property
+    def keys(self) -> List[str]:
+        r"""
+        Keys in the current order of the dataset.
+        """
+        if self._keys is None:
+            self._keys = self.row_keys if self.order is None else self.keys_at(np.arange(len(self)))
+        return self._keys
+
+    def keys_at(self, indices: np.ndarray) -> List[str]:
+        r"""
+        Keys at `indices` of the current order of the dataset.
+        """
+        rows = indices if self.order is None else self.order[indices]
+        row_keys = self.row_keys
+        return [row_keys[i] for i in rows.tolist()]
+
+    def sync(self) -> bool:
+        r"""
+        Apply the edits of the dataset since the cache was built. Returns False if the cache is stale and must be rebuilt.
+        """
+        dataset = self.dataset
+        if self.version == dataset._version:
+            return True
+        if self.version < dataset._layout_version or self.version < dataset._edit_log_start:
+            return False
+        for image_key in set(dataset._edit_log[self.version - dataset._edit_log_start:]):
+            self._set_row(self.rows[image_key], image_key, dataset[image_key])
+        self.version = dataset._version
+        return True
+
+    def _set_row(self, i, image_key, image_info):
+        for name, column in self.numeric.items():
+            value = NUMERIC_COLUMNS[name](image_key, image_info)
+            column[i] = np.nan if value is None else value
+        for name, column in self.categorical.items():
+            column.codes[i] = column.code(CATEGORICAL_COLUMNS[name](image_key, image_info))
+        for name, index in self.indexes.items():
+            index.set_row(i, INDEXES[name](image_info))
+
+    def permute(self, order: np.ndarray):
+        r"""
+        Follow the dataset after it was reordered by `order`, i.e. its i-th key is now its `order[i]`-th key before, and mark the cache as up to date.
+        """
+        self.order = order if self.order is None else self.order[order]
+        self._keys = None
+        self.version = self.dataset._version
+
+    def _to_order(self, values: np.ndarray) -> np.ndarray:
+        return values if self.order is None else values[self.order]
+
+    def column(self, name, by_row=False) -> Union[np.ndarray, Categorical]:
+        r"""
+        Get a column in the current order of the dataset.
+        :param by_row: Get the column in the order of rows instead, which is the order of the positions of `Index`.
+        """
+        if name in NUMERIC_COLUMNS:
+            if name not in self.numeric:
+                func = NUMERIC_COLUMNS[name]
+                data = self.dataset._data
+                if name in SIZE_COLUMNS:
+                    read_sizes(data[image_key] for image_key in self.row_keys)
+                self.numeric[name] = np.array([func(image_key, data[image_key]) for image_key in self.row_keys], dtype=np.float64)
+            return self.numeric[name] if by_row else self._to_order(self.numeric[name])
+        elif name in CATEGORICAL_COLUMNS:
+            if name not in self.categorical:
+                func = CATEGORICAL_COLUMNS[name]
+                data = self.dataset._data
+                self.categorical[name] = Categorical(func(image_key, data[image_key]) for image_key in self.row_keys)
+            column = self.categorical[name]
+            return column if by_row or self.order is None else column.take(self.order)
+        raise KeyError(f"unknown column `{name}`, expected one of {list(NUMERIC_COLUMNS) + list(CATEGORICAL_COLUMNS)}")
+
+    def index(self, name) -> Index:
+        if name not in self.indexes:
+            func = INDEXES[name]
+            data = self.dataset._data
+            self.indexes[name] = Index(func(data[image_key]) for image_key in self.row_keys)
+        return self.indexes[name]
+
+    def compare(self, name, op, target) -> np.ndarray:
+        r"""
+        Evaluate `column <op> target` for every row with the semantics of `Where`.
+        """
+        column = self.column(name)
+        if isinstance(column, Categorical):
+            return column.test(op, target)
+        isnull = np.isnan(column)
+        if op in ('in', 'not in'):
+            values = [value for value in target if value is not None]
+            matched = np.isin(column, values)
+            if len(values) < len(target):
+                matched |= isnull
+            return matched if op == 'in' else ~matched
+        if target is None:
+            if op not in ('==', '!='):
+                return np.zeros(len(column), dtype=bool)
+            return isnull if op == '==' else ~isnull
+        return OPERATORS[op](column, target)  # comparisons with NaN are False, except for !=
+
+    def evaluate(self, expr) -> np.ndarray:
+        r"""
+        Evaluate a query into a boolean mask over the rows. See `Dataset.query`.
+        """
+        if isinstance(expr, dict):
+            mask = np.ones(len(self), dtype=bool)
+            for name, condition in expr.items():
+                mask &= self.compare(name, *parse_condition(condition))
+            return mask
+        return self._evaluate(parse_query(expr) if isinstance(expr, str) else expr)
+
+    def _evaluate(self, node) -> np.ndarray:
+        kind = node[0]
+        if kind == 'and':
+            return self._evaluate(node[1]) & self._evaluate(node[2])
+        elif kind == 'or':
+            return self._evaluate(node[1]) | self._evaluate(node[2])
+        elif kind == 'not':
+            return ~self._evaluate(node[1])
+        elif kind == 'compare':
+            return self.compare(*node[1:])
+        elif kind == 'contains':
+            return self._to_order(self.index(node[1]).contains(node[2], len(self)))
+        raise ValueError(f"invalid query node: {node}")
+
+
+_TOKEN_PATTERN = re.compile(r"""\s*(?:
+    (?P<number>-?(?:inf\b|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?))
+    |(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    |(?P<op>==|!=|<=|>=|<|>|&&|\|\||&|\||~|\(|\)|\[|\]|,)
+    |(?P<name>[A-Za-z_][A-Za-z_0-9]*)
+)""", re.VERBOSE)
+
+_CONSTANTS = {'None': None, 'null': None, 'True': True, 'False': False}
+
+
+def _tokenize(expr: str):
+    tokens, pos = [], 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        match = _TOKEN_PATTERN.match(expr, pos)
+        if match is None or match.end() == pos:
+            raise ValueError(f"invalid query at position {pos}: `{expr[pos:]}`")
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'number':
+            tokens.append(('value', float(text) if not re.fullmatch(r'-?\d+', text) else int(text)))
+        elif kind == 'string':
+            tokens.append(('value', ast.literal_eval(text)))
+        elif kind == 'name' and text in _CONSTANTS:
+            tokens.append(('value', _CONSTANTS[text]))
+        elif kind == 'name' and text in ('and', 'or', 'not', 'in'):
+            tokens.append(('op', text))
+        else:
+            tokens.append((kind, {'&&': '&', '||': '|'}.get(text, text)))
+        pos = match.end()
+    return tokens
+
+
+def parse_query(expr: str) -> tuple:
+    r"""
+    Parse a query string into a tree of `('and', a, b)`, `('or', a, b)`, `('not', a)`, `('compare', column, op, value)` and `('contains', index, value)` nodes.
+    The grammar is
+        query := term (('|' | 'or') term)*
+        term := factor (('&' | 'and') factor)*
+        factor := ('~' | 'not') factor | '(' query ')' | column op value | column ['not'] 'in' '[' value, ... ']' | function '(' value ')'
+    where `&` and `|` bind looser than comparisons, unlike in python, and functions are `has_tag`, `has_character` and `has_style`.
+    """
+    tokens = _tokenize(expr)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else (None, None)
+
+    def take(kind=None, text=None):
+        nonlocal pos
+        token = peek()
+        if token[0] is None or (kind is not None and token[0] != kind) or (text is not None and token[1] != text):
+            raise ValueError(f"invalid query `{expr}`: expected {text or kind} at token {pos}, got `{token[1]}`")
+        pos += 1
+        return token
+
+    def parse_or():
+        node = parse_and()
+        while peek() in (('op', '|'), ('op', 'or')):
+            take()
+            node = ('or', node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_not()
+        while peek() in (('op', '&'), ('op', 'and')):
+            take()
+            node = ('and', node, parse_not())
+        return node
+
+    def parse_not():
+        if peek() in (('op', '~'), ('op', 'not')):
+            take()
+            return ('not', parse_not())
+        if peek() == ('op', '('):
+            take()
+            node = parse_or()
+            take('op', ')')
+            return node
+        name = take('name')[1]
+        if peek() == ('op', '('):  # function call
+            if name not in QUERY_FUNCTIONS:
+                raise ValueError(f"unknown query function `{name}`, expected one of {list(QUERY_FUNCTIONS)}")
+            take()
+            value = take('value')[1]
+            take('op', ')')
+            return ('contains', QUERY_FUNCTIONS[name], value)
+        op = take('op')[1]
+        if op == 'not':
+            take('op', 'in')
+            op = 'not in'
+        if op in ('in', 'not in'):
+            take('op', '[')
+            values = []
+            while peek() != ('op', ']'):
+                values.append(take('value')[1])
+                if peek() == ('op', ','):
+                    take()
+            take('op', ']')
+            return ('compare', name, op, values)
+        if op not in OPERATORS:
+            raise ValueError(f"invalid operator `{op}` in query `{expr}`")
+        return ('compare', name, op, take('value')[1])
+
+    node = parse_or()
+    if pos != len(tokens):
+        raise ValueError(f"invalid query `{expr}`: unexpected `{tokens[pos][1]}`")
+    return node
@@ -1,28 +1,58 @@
+import os
 import time
 import math
+import itertools
+import numpy as np
 import pandas as pd
 import concurrent.futures as cf
 from tqdm import tqdm
 from pathlib import Path
-from typing import List, Callable, Literal
+from typing import List, Dict, Callable, Literal, Optional
 from ..data import ImageInfo
-from ...utils.file_utils import listdir, smart_name
+from ..data.data import read_attrs_batch
+from ..data.caption_pack import dump_as_packs, get_pack
+from ..data.path_table import PATH_TABLE
+from ...utils.file_utils import listdir, scandir, smart_name, write_bytes_atomic, open_file, split_compression_suffix
+from ...utils import json_utils
+from ...utils.json_utils import iter_json_items
+from .journal import journal_path, read_journal, remove_journal
+from .view import DatasetView
+from .jsonl_index import LazyStorage
+from .predicate import Where
+from .columns import ColumnCache, MAX_EDIT_LOG
+from .groupby import GroupBy
+from .frame import FrameCache
+from .parallel import iter_map
+from .stream import Stream
+from .selection import reservoir_sample, method_kwargs
 from ...const import IMAGE_EXTS
 from ...utils import log_utils as logu
 
 LAZY_LOADING = 999
 
+# sources that evaluate `where` filters while reading
+WHERE_SUFFIXES = ('.json', '.jsonl', '.csv', '.parquet', '.db', '.sqlite', '.sqlite3')
+
 
 class Dataset(logu.Logger):
 
     verbose: bool
     exts: set
 
-    def __init__(self, source=None, key_condition: Callable[[str], bool] = None, read_attrs=False, read_types: Literal['txt', 'danbooru'] = None, lazy_loading=True, lazy_reading=True, formalize_caption=False, recur=True, cacheset=None, exts=IMAGE_EXTS, verbose=False, **kwargs):
+    # change tracking for caches, see `_changed`
+    _version = 0
+    _layout_version = 0
+    _edit_log_start = 0
+
+    def __init__(self, source=None, key_condition: Callable[[str], bool] = None, read_attrs=False, read_types: Literal['txt', 'danbooru'] = None, lazy_loading=True, lazy_reading=True, formalize_caption=False, recur=True, cacheset=None, exts=IMAGE_EXTS, max_workers=1, manifest=False, columns=None, filters=None, where=None, verbose=False, **kwargs):
         self.init_logger(prefix_color=logu.ANSI.BRIGHT_MAGENTA)
         self.verbose = verbose
         self.exts = exts
+        if isinstance(source, (DatasetView, LazyStorage)) and key_condition is None and not cacheset and not formalize_caption and where is None:  # 0. view or lazy storage, share storage
+            self._data = source
+            return
         key_condition = key_condition or (lambda x: True)
+        where = Where(where) if where is not None else None
         if not isinstance(source, (list, tuple)):
             source = [source]
         # if self.verbose:
@@ -31,11 +61,16 @@ class Dataset(logu.Logger):
 
         dic = {}
         for src in source:
+            if where is not None and not (isinstance(src, (str, Path)) and Path(src).is_file() and split_compression_suffix(src)[0] in WHERE_SUFFIXES):  # no pushdown, filter after loading
+                for image_key, image_info in Dataset(src, key_condition=key_condition, read_attrs=read_attrs, read_types=read_types, lazy_reading=lazy_reading, recur=recur, cacheset=cacheset, exts=exts, max_workers=max_workers, manifest=manifest, verbose=verbose).items():
+                    if image_key not in dic and where.match_info(image_key, image_info):
+                        dic[image_key] = image_info
+                continue
             if isinstance(src, (str, Path)):
                 src = Path(src)
                 if src.is_file():
-                    suffix = src.suffix
-                    if suffix in exts:  # 1. image file
+                    suffix, compression = split_compression_suffix(src)
+                    if suffix in exts and not compression:  # 1. image file
                         image_key = src.stem
                         if image_key in dic or not key_condition(image_key):
                             continue
@@ -49,39 +84,99 @@ class Dataset(logu.Logger):
 
                     elif suffix == '.json':  # 2. json file
                         import json
-                        try:
-                            with open(src, 'r', encoding='utf-8') as f:
-                                json_data = json.load(f)
+                        entries = {}
+                        try:  # stream entries so that the whole json object is never held in memory
+                            for image_key, image_info in self.pbar(iter_json_items(src), desc=f"reading `{src.name}`", smoothing=1, disable=not verbose):
+                                if image_key in dic or image_key in entries or not key_condition(image_key):
+                                    continue
+                                if cacheset and image_key in cacheset:
+                                    if where is None or where.match_info(image_key, cacheset[image_key]):
+                                        entries[image_key] = cacheset[image_key]
+                                    continue
+                                if where is not None and not where.match_record(image_key, image_info):
+                                    continue
+                                entries[image_key] = ImageInfo(**image_info)
                         except json.JSONDecodeError:
                             self.log(f'invalid json file {src}.')
                             continue
-                        for image_key, image_info in self.pbar(json_data.items(), desc=f"reading `{src.name}`", smoothing=1, disable=not verbose):
-                            if image_key in dic or not key_condition(image_key):
+                        if (jnl_fp := journal_path(src)).is_file():
+                            self._replay_journal(jnl_fp, entries, dic, key_condition=key_condition, cacheset=cacheset, where=where, verbose=verbose)
+                        dic.update(entries)  # update dictionary
+
+                    elif suffix == '.jsonl':  # 3. jsonl journal
+                        entries = {}
+                        self._replay_journal(src, entries, dic, key_condition=key_condition, cacheset=cacheset, where=where, verbose=verbose)
+                        dic.update(entries)  # update dictionary
+
+                    elif suffix == '.csv':  # 4. csv file
+                        usecols = None if columns is None else {'image_key', 'image_path', *columns}
+                        readcols = usecols if usecols is None or where is None else usecols | where.csv_columns()
+                        df = pd.read_csv(src, usecols=None if readcols is None else readcols.__contains__, dtype={'image_key': str})
+                        if where is not None:  # drop failed rows before any value is converted
+                            df = df[where.pandas_mask(df)]
+                        attrs = [name for name in df.columns if name in ImageInfo._all_attrs and (usecols is None or name in usecols)]
+                        # convert NaN to None column-wise and build infos from plain lists
+                        values = [df[name].astype(object).where(df[name].notna(), None).tolist() for name in attrs]
+                        image_keys = df['image_key'].tolist()
+                        del df
+                        entries = {}
+                        for image_key, *row in self.pbar(zip(image_keys, *values), total=len(image_keys), desc=f"reading `{src.name}`", smoothing=1, disable=not verbose):
+                            if image_key in dic or image_key in entries or not key_condition(image_key):
                                 continue
                             if cacheset and image_key in cacheset:
-                                dic[image_key] = cacheset[image_key]
+                                if where is None or where.match_info(image_key, cacheset[image_key]):
+                                    entries[image_key] = cacheset[image_key]
                                 continue
-                            dic[image_key] = ImageInfo(**image_info)  # update dictionary
-
-                    elif suffix == '.csv':  # 3. csv file
-                        df = pd.read_csv(src)
-                        df = df.applymap(lambda x: None if pd.isna(x) else x)
-                        for _, row in self.pbar(df.iterrows(), desc=f"reading `{src.name}`", smoothing=1, disable=not verbose):
-                            image_key = row['image_key']
+                            entries[image_key] = ImageInfo(**dict(zip(attrs, row)))
+                        if (jnl_fp := journal_path(src)).is_file():
+                            self._replay_journal(jnl_fp, entries, dic, key_condition=key_condition, cacheset=cacheset, where=where, verbose=verbose)
+                        dic.update(entries)  # update dictionary
+
+                    elif suffix == '.parquet':  # 5. parquet file
+                        from .parquet import iter_parquet_batches, record2info
+                        parquet_columns = None if columns is None else list({'image_key': None, 'image_path': None, **dict.fromkeys(columns)})
+                        pbar = self.pbar(desc=f"reading `{src.name}`", smoothing=1, disable=not verbose)
+                        for batch in iter_parquet_batches(src, columns=parquet_columns, filters=filters, where=where):
+                            names = batch.schema.names
+                            for row in zip(*(batch.column(name).to_pylist() for name in names)):
+                                record = dict(zip(names, row))
+                                image_key = record['image_key']
+                                if image_key in dic or not key_condition(image_key):
+                                    continue
+                                if cacheset and image_key in cacheset:
+                                    if where is None or where.match_info(image_key, cacheset[image_key]):
+                                        dic[image_key] = cacheset[image_key]
+                                    continue
+                                dic[image_key] = record2info(record)  # update dictionary
+                            pbar.update(batch.num_rows)
+                        pbar.close()
+
+                    elif suffix in ('.db', '.sqlite', '.sqlite3'):  # 6. sqlite file
+                        from .sqlite_dataset import SQLiteStorage
+                        storage = SQLiteStorage(src)
+                        items = storage.items() if where is None else storage.select(where)
+                        for image_key, image_info in self.pbar(items, desc=f"reading `{src.name}`", smoothing=1, disable=not verbose):
                             if image_key in dic or not key_condition(image_key):
                                 continue
                             if cacheset and image_key in cacheset:
-                                dic[image_key] = cacheset[image_key]
+                                if where is None or where.match_info(image_key, cacheset[image_key]):
+                                    dic[image_key] = cacheset[image_key]
                                 continue
-                            info_kwargs = {name: row[name] for name in ImageInfo._all_attrs if name in row}
-                            image_info = ImageInfo(**info_kwargs)
                             dic[image_key] = image_info  # update dictionary
+                        storage.close()
 
                     else:
                         raise ValueError(f'Invalid file source {src}.')
 
-                elif src.is_dir():  # 4. directory
+                elif src.is_dir():  # 7. directory
+                    if manifest:
+                        self._read_dir_manifest(src, dic, key_condition=key_condition, read_attrs=read_attrs, read_types=read_types, lazy_reading=lazy_reading, recur=recur, cacheset=cacheset, exts=exts, max_workers=max_workers, verbose=verbose)
+                        continue
+                    if max_workers is not None and max_workers > 1:
+                        self._read_dir_parallel(src, dic, key_condition=key_condition, read_attrs=read_attrs, read_types=read_types, lazy_reading=lazy_reading, recur=recur, cacheset=cacheset, exts=exts, max_workers=max_workers, verbose=verbose)
+                        continue
                     files = listdir(src, exts=exts, return_path=True, return_type=Path, recur=recur)
+                    to_read = []
                     for file in self.pbar(files, desc=f"reading `{src.name}`", smoothing=1, disable=not verbose):
                         image_key = file.stem
                         if image_key in dic or not key_condition(image_key):
@@ -92,13 +187,15 @@ class Dataset(logu.Logger):
                             continue
                         image_info = ImageInfo(file)
                         if read_attrs:
-                            image_info.read_attrs(types=read_types, lazy=lazy_reading)
+                            to_read.append(image_info)
                         dic[image_key] = image_info  # update dictionary
+                    if to_read:
+                        self._read_attrs_batch(to_read, read_types=read_types, lazy_reading=lazy_reading, max_workers=max_workers, verbose=verbose)
 
                 else:
                     raise FileNotFoundError(f'File {src} not found.')
 
-            elif isinstance(src, ImageInfo):  # 5. ImageInfo object
+            elif isinstance(src, ImageInfo):  # 8. ImageInfo object
                 image_key = src.key
                 if image_key in dic or not key_condition(image_key):
                     continue
@@ -107,7 +204,7 @@ class Dataset(logu.Logger):
                     continue
                 dic[image_key] = src
 
-            elif isinstance(src, Dataset):  # 6. Dataset object
+            elif isinstance(src, Dataset):  # 9. Dataset object
                 for image_key, image_info in tqdm(src.items(), desc='loading Dataset', smoothing=1, disable=not verbose):
                     if image_key in dic or not key_condition(image_key):
                         continue
@@ -117,7 +214,7 @@ class Dataset(logu.Logger):
                     dic[image_key] = image_info
 
             elif isinstance(src, dict):  # dict
-                if src.get('image_path'):  # 7. metadata dict
+                if src.get('image_path'):  # 10. metadata dict
                     image_info = ImageInfo(**src)
                     image_key = image_info.key
                     if image_key in dic or not key_condition(image_key):
@@ -127,7 +224,7 @@ class Dataset(logu.Logger):
                         continue
                     dic[image_key] = image_info
 
-                else:  # 8. img_key: img_info dict
+                else:  # 11. img_key: img_info dict
                     for image_key, image_info in tqdm(src.items(), desc='loading dict', smoothing=1, disable=not verbose):
                         if image_key in dic or not key_condition(image_key):
                             continue
@@ -140,7 +237,7 @@ class Dataset(logu.Logger):
                             pass
                         dic[image_key] = image_info
 
-            elif src is None:  # 9. None
+            elif src is None:  # 12. None
                 continue
             else:
                 raise TypeError(f'Invalid type {type(src)} for Dataset.')
@@ -158,28 +255,158 @@ class Dataset(logu.Logger):
 
         # end init
 
+    def _replay_journal(self, fp, entries, dic, key_condition, cacheset, where, verbose):
+        r"""
+        Apply records of a jsonl journal on top of `entries` read from the same source. Later records override earlier ones.
+        Records that fail the `where` filter remove their keys like deletions.
+        """
+        for image_key, record in self.pbar(read_journal(fp).items(), desc=f"replaying `{fp.name}`", smoothing=1, disable=not verbose):
+            if image_key in dic or not key_condition(image_key):
+                continue
+            if record is None:  # deletion
+                entries.pop(image_key, None)
+            elif cacheset and image_key in cacheset:
+                if where is None or where.match_info(image_key, cacheset[image_key]):
+                    entries[image_key] = cacheset[image_key]
+                else:
+                    entries.pop(image_key, None)
+            elif where is not None and not where.match_record(image_key, record):
+                entries.pop(image_key, None)
+            else:
+                entries[image_key] = ImageInfo(**record)
+
+    def _read_dir_parallel(self, src, dic, key_condition, read_attrs, read_types, lazy_reading, recur, cacheset, exts, max_workers, verbose):
+        r"""
+        Read a directory source into `dic`, scanning subdirectories and building `ImageInfo` objects in worker threads.
+        """
+        files = scandir(src, exts=exts, recur=recur, max_workers=max_workers)
+
+        # resolve keys in scanning order so that deduplication is the same as the serial way
+        to_build = []
+        for file in files:
+            image_key = os.path.splitext(os.path.basename(file))[0]
+            if image_key in dic or not key_condition(image_key):
+                continue
+            if cacheset and image_key in cacheset:
+                dic[image_key] = cacheset[image_key]
+                continue
+            dic[image_key] = None  # placeholder to keep order and dedup
+            to_build.append((image_key, file))
+
+        pbar = self.pbar(total=len(to_build), desc=f"reading `{src.name}`", unit='file', smoothing=1, disable=not verbose)
+
+        def build(batch):
+            image_infos = []
+            for image_key, file in batch:
+                image_infos.append((image_key, ImageInfo(file)))
+            pbar.update(len(batch))
+            return image_infos
+
+        batch_size = 256
+        batches = (to_build[i:i + batch_size] for i in range(0, len(to_build), batch_size))
+        with cf.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for image_infos in executor.map(build, batches):
+                for image_key, image_info in image_infos:
+                    dic[image_key] = image_info
+        pbar.close()
+        if read_attrs:
+            self._read_attrs_batch([dic[image_key] for image_key, _ in to_build], read_types=read_types, lazy_reading=lazy_reading, max_workers=max_workers, verbose=verbose)
+
+    def _read_attrs_batch(self, image_infos, read_types, lazy_reading, max_workers, verbose):
+        r"""
+        Read attributes of `image_infos` in place with one directory listing per folder, see `read_attrs_batch`.
+        """
+        pbar = self.pbar(total=len(image_infos), desc='reading attrs', unit='file', smoothing=1, disable=not verbose)
+        read_attrs_batch(image_infos, types=read_types, lazy=lazy_reading, max_workers=max_workers, pbar=pbar)
+        pbar.close()
+
+    def _read_dir_manifest(self, src, dic, key_condition, read_attrs, read_types, lazy_reading, recur, cacheset, exts, max_workers, verbose):
+        r"""
+        Read a directory source into `dic` through its scan manifest, which only rescans changed directories and sidecars.
+        With `lazy_reading`, captions that the manifest doesn't hold yet are read on first access, see `ScanManifest.scan`.
+        """
+        from .manifest import ScanManifest
+        scan_manifest = ScanManifest(src, exts=exts, recur=recur, read_types=read_types, max_workers=max_workers if max_workers and max_workers > 1 else None, verbose=verbose)
+        entries = scan_manifest.scan(read_attrs=read_attrs, lazy=lazy_reading)
+        scan_manifest.save()
+        for file, attrs in self.pbar(entries, desc=f"reading `{src.name}`", unit='file', smoothing=1, disable=not verbose):
+            image_key = os.path.splitext(os.path.basename(file))[0]
+            if image_key in dic or not key_condition(image_key):
+                continue
+            if cacheset and image_key in cacheset:
+                dic[image_key] = cacheset[image_key]
+                continue
+            image_info = ImageInfo(file)
+            if attrs:
+                for attr, value in attrs.items():
+                    setattr(image_info, attr, value)
+            dic[image_key] = image_info
+
     def make_subset(self, condition: Callable[[ImageInfo], bool] = None, cls=None, *args, **kwargs):
+        verbose = kwargs.get('verbose', self.verbose)
+        keys = [image_key for image_key, image_info in tqdm(self.items(), desc='making subset', smoothing=1, disable=not verbose) if condition is None or condition(image_info)]
+        return self._subset_of_keys(keys, cls, *args, **kwargs)
+
+    def _subset_of_keys(self, keys, cls=None, *args, **kwargs):
         import inspect
         cls = cls or self.__class__
-        verbose = kwargs.get('verbose', self.verbose)
         init_params = inspect.signature(cls.__init__).parameters.keys()
         attrs_kwargs = {k: getattr(self, k) for k in cls.__annotations__ if k in init_params and k not in kwargs}
-        data = {}
-        for image_key, image_info in tqdm(self.items(), desc='making subset', smoothing=1, disable=not verbose):
-            if condition(image_info):
-                data[image_key] = image_info
-        return cls(data, *args, **kwargs, **attrs_kwargs)
+        return cls(DatasetView([self._data], keys), *args, **kwargs, **attrs_kwargs)
+
+    def group_by_dir(self) -> Dict[int, List[str]]:
+        r"""
+        Group image keys by the directory id of their images, see `PATH_TABLE`. Use `PATH_TABLE.category(dir_id)` to get the category of a group.
+        """
+        if hasattr(self._data, 'group_by_dir'):  # storages that know the directories without loading the image infos
+            return self._data.group_by_dir()
+        groups = {}
+        for image_key, image_info in self.items():
+            dir_id = image_info.dir_id
+            if dir_id in groups:
+                groups[dir_id].append(image_key)
+            else:
+                groups[dir_id] = [image_key]
+        return groups
+
+    def filter_by_dir(self, dir_ids, cls=None, *args, **kwargs) -> 'Dataset':
+        r"""
+        Make a subset of images whose directory ids are in `dir_ids`, e.g. `dataset.filter_by_dir(PATH_TABLE.ids_of_category('cat_a', 'cat_b'))`.
+        :param dir_ids: Directory ids, or a function of a directory id which is called once per directory.
+        """
+        if callable(dir_ids):
+            matches = {}
+
+            def condition(image_info):
+                dir_id = image_info.dir_id
+                if dir_id not in matches:
+                    matches[dir_id] = bool(dir_ids(dir_id))
+                return matches[dir_id]
+        else:
+            dir_ids = set(dir_ids)
+            if hasattr(self._data, 'group_by_dir'):
+                groups = self._data.group_by_dir()
+                keys = set(itertools.chain.from_iterable(groups[dir_id] for dir_id in dir_ids if dir_id in groups))
+                return self._subset_of_keys([image_key for image_key in self._data if image_key in keys], cls, *args, **kwargs)
+
+            def condition(image_info):
+                return image_info.dir_id in dir_ids
+        return self.make_subset(condition=condition, cls=cls, *args, **kwargs)
 
     def update(self, other, recur=False):
         other = Dataset(other, recur=recur)
         self._data.update(other._data)
+        self._changed()
         return self
 
     def pop(self, image_key, default=None):
-        return self._data.pop(image_key, default)
+        image_info = self._data.pop(image_key, default)
+        self._changed()
+        return image_info
 
     def clear(self):
         self._data.clear()
+        self._changed()
 
     def __getitem__(self, image_key):
         return self._data[image_key]
@@ -187,7 +414,52 @@ class Dataset(logu.Logger):
     def __setitem__(self, image_key, image_info):
         if not isinstance(image_info, ImageInfo):
             raise TypeError('Dataset can only contain ImageInfo objects.')
+        is_new = image_key not in self._data
         self._data[image_key] = image_info
+        self._changed(None if is_new else image_key)
+
+    def _changed(self, image_key=None):
+        r"""
+        Record a change of the dataset for its caches, e.g. `ColumnCache`.
+        :param image_key: The key whose image info was replaced, or None if keys were added, removed or reordered, after which caches are rebuilt.
+        """
+        self._version += 1
+        edit_log = self.__dict__.get('_edit_log')
+        if image_key is None or edit_log is None or len(edit_log) >= MAX_EDIT_LOG:
+            if image_key is None:
+                self._layout_version = self._version
+                self._edit_log_start, self._edit_log = self._version, []
+            elif edit_log is None:
+                self._edit_log_start, self._edit_log = self._version - 1, [image_key]
+            else:  # too many edits to replay, rebuild caches instead
+                self._edit_log_start, self._edit_log = self._version, []
+        else:
+            edit_log.append(image_key)
+
+    def columns(self) -> ColumnCache:
+        r"""
+        Get the columnar projection of the dataset, see `ColumnCache`. It is cached and kept in sync with edits made through the dataset.
+        """
+        cache = self.__dict__.get('_column_cache')
+        if cache is None or not cache.sync():
+            cache = self._column_cache = ColumnCache(self)
+        return cache
+
+    def query(self, expr, cls=None, *args, **kwargs) -> 'Dataset':
+        r"""
+        Make a subset of images matching `expr`, which is evaluated vectorized over the cached columns of the dataset instead of calling a function per image, e.g.
+        `dataset.query("aesthetic_score > 6 & category in ['cat_a', 'cat_b'] & has_tag('solo')")`.
+        :param expr: A query string, see `parse_query`, or a dict of conditions in the format of `Dataset(src, where=...)`, e.g. `{'quality': ['best', 'amazing']}`.
+        """
+        columns = self.columns()
+        return self._subset_of_keys(columns.keys_at(np.flatnonzero(columns.evaluate(expr))), cls, *args, **kwargs)
+
+    def groupby(self, by: str) -> GroupBy:
+        r"""
+        Group the images by an attribute to aggregate statistics over the cached columns of the dataset, e.g.
+        `dataset.groupby('category').count()`, `dataset.groupby('characters').agg('count', score=('aesthetic_score', 'mean'))`. See `GroupBy`.
+        """
+        return GroupBy(self.columns(), by)
 
     def __delitem__(self, image_key):
         self.pop(image_key)
@@ -204,17 +476,21 @@ class Dataset(logu.Logger):
     def items(self):
         return self._data.items()
 
-    def df(self):
-        headers = ['image_key'] + [name for name in ImageInfo._all_attrs]
-        data = []
-        for image_key, image_info in self.pbar(self.items(), desc='converting DataFrame', smoothing=1, disable=not self.verbose):
-            row = dict(
-                image_key=image_key,
-                **image_info.dict()
-            )
-            data.append(row)
-        df = pd.DataFrame(data, columns=headers)
-        return df
+    def df(self, columns: List[str] = None, keys: List[str] = None) -> pd.DataFrame:
+        r"""
+        Convert the dataset to a DataFrame with an `image_key` column and a column per attribute of `ImageInfo.dict`.
+        Converted rows are cached and kept in sync with edits made through the dataset, see `FrameCache`, so converting it again only converts the edited images.
+        :param columns: Only keep these columns, e.g. `['image_key', 'caption']`.
+        :param keys: Only convert the images of these keys, in this order, e.g. the keys of a page.
+        """
+        cache = self.__dict__.get('_frame_cache')
+        if cache is None or not cache.sync():
+            cache = self._frame_cache = FrameCache(self)
+        return cache.df(columns=columns, image_keys=keys)
+
+    def _synced_frame_cache(self) -> Optional[FrameCache]:
+        cache = self.__dict__.get('_frame_cache')
+        return cache if cache is not None and cache.sync() else None
 
     def __str__(self):
         return str(self.df())
@@ -223,27 +499,40 @@ class Dataset(logu.Logger):
         return repr(self._data)
 
     def copy(self):
-        from copy import deepcopy
-        return deepcopy(self)
-
-    def apply_map(self, func, *args, max_workers=1, verbose=None, **kwargs):
+        r"""
+        Copy the dataset with a copy of every image info. Other attributes of the dataset are shared.
+        """
+        dataset = object.__new__(type(self))
+        dataset.__dict__.update(self.__dict__)
+        dataset.__dict__.pop('_edit_log', None)
+        dataset.__dict__.pop('_column_cache', None)
+        dataset.__dict__.pop('_frame_cache', None)
+        dataset._data = {image_key: image_info.copy() for image_key, image_info in self.items()}
+        return dataset
+
+    def apply_map(self, func, *args, max_workers=1, executor: Literal['thread', 'process'] = 'thread', chunk_size=None, copy=True, verbose=None, **kwargs):
+        r"""
+        Apply `func` to every image info and store the returned image info in place.
+        :param executor: 'thread' or 'process'. The process executor ships chunks of pickled image infos to worker processes, which avoids the GIL for CPU-bound functions, e.g. caption transforms; `func` must then be picklable. Captions that are not read yet are read by the workers.
+        :param chunk_size: Number of image infos per task, see `iter_map`.
+        :param copy: Whether to pass a copy of each image info to `func`. Set to False to skip the copy if `func` is known not to modify its input in place. Ignored by the process executor, whose inputs are always copies.
+        """
         verbose = verbose if verbose is not None else self.verbose
         if verbose:
             tic = time.time()
             self.log(f'apply map `{logu.yellow(func.__name__)}`...')
 
         pbar = self.pbar(self.items(), desc=f'applying map `{logu.yellow(func.__name__)}`', smoothing=1, disable=not verbose)
-        func_ = logu.track_tqdm(pbar)(func)
-        if max_workers == 1:
+        if max_workers == 1 and executor == 'thread':
+            func_ = logu.track_tqdm(pbar)(func)
             for image_key, image_info in self.items():
-                self[image_key] = func_(image_info.copy(), *args, **kwargs)
+                self[image_key] = func_(image_info.copy() if copy else image_info, *args, **kwargs)
         else:
-            with cf.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = [executor.submit(func_, image_info.copy(), *args, **kwargs) for image_info in self.values()]
-
-                for future in cf.as_completed(futures):
-                    image_info = future.result()
-                    self[image_info.key] = image_info
+            image_keys = list(self.keys())
+            image_infos = (image_info.copy() if copy and executor == 'thread' else image_info for image_info in self.values())
+            results = iter_map(func, image_infos, args=args, kwargs=kwargs, executor=executor, max_workers=max_workers, chunk_size=chunk_size, callback=pbar.update)
+            for image_key, image_info in zip(image_keys, results):
+                self[image_key] = image_info
 
         pbar.close()
         if verbose:
@@ -252,20 +541,22 @@ class Dataset(logu.Logger):
 
         return self
 
-    def with_map(self, func, *args, max_workers=1, condition: Callable[[ImageInfo], bool] = None, read_attrs=False, read_types: Literal['txt', 'waifuc'] = None, lazy_reading=True, formalize_caption=False, recur=True, verbose=None, **kwargs):
+    def with_map(self, func, *args, max_workers=1, executor: Literal['thread', 'process'] = 'thread', chunk_size=None, copy=True, condition: Callable[[ImageInfo], bool] = None, read_attrs=False, read_types: Literal['txt', 'waifuc'] = None, lazy_reading=True, formalize_caption=False, recur=True, verbose=None, **kwargs):
+        r"""
+        Apply `func` to every image info and make a new dataset of the returned image infos. See `apply_map` for the execution arguments.
+        """
         verbose = verbose if verbose is not None else self.verbose
         if verbose:
             tic = time.time()
             self.log(f'With map `{logu.yellow(func.__name__)}`...')
 
         pbar = self.pbar(self.items(), desc=f'with map `{logu.yellow(func.__name__)}`', smoothing=1, disable=not verbose)
-        func_ = logu.track_tqdm(pbar)(func)
-        if max_workers == 1:
-            result = [func_(image_info.copy(), *args, **kwargs) for image_info in self.values()]
+        if max_workers == 1 and executor == 'thread':
+            func_ = logu.track_tqdm(pbar)(func)
+            result = [func_(image_info.copy() if copy else image_info, *args, **kwargs) for image_info in self.values()]
         else:
-            with cf.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = [executor.submit(func_, image_info.copy(), *args, **kwargs) for image_info in self.values()]
-                result = [future.result() for future in cf.as_completed(futures)]
+            image_infos = (image_info.copy() if copy and executor == 'thread' else image_info for image_info in self.values())
+            result = list(iter_map(func, image_infos, args=args, kwargs=kwargs, executor=executor, max_workers=max_workers, chunk_size=chunk_size, callback=pbar.update))
 
         pbar.close()
         if verbose:
@@ -274,8 +565,19 @@ class Dataset(logu.Logger):
 
         return Dataset(result, key_condition=condition, read_attrs=read_attrs, read_types=read_types, lazy_reading=lazy_reading, formalize_caption=formalize_caption, recur=recur, verbose=verbose)
 
+    def stream(self, condition: Callable[[ImageInfo], bool] = None) -> Stream:
+        r"""
+        Make a lazy pipeline over the items of the dataset, e.g. `dataset.stream().map(func, max_workers=8).batch(1000).sink('out.jsonl')`. See `Stream`.
+        """
+        stream = Stream(self.items(), total=len(self))
+        return stream.filter(condition) if condition is not None else stream
+
     def sort_keys(self):
+        frame_cache = self._synced_frame_cache()
         self._data = dict(sorted(self._data.items(), key=lambda x: x[0]))
+        self._changed()
+        if frame_cache is not None:
+            frame_cache.reordered()
 
     def stat(self):
         counter = {
@@ -293,17 +595,101 @@ class Dataset(logu.Logger):
         return counter
 
     def sample(self, condition=None, n=1, randomly=False, random_seed=None) -> 'Dataset':
+        r"""
+        Sample `n` images matching `condition`. Random samples are drawn by reservoir sampling in a single pass, so the matching keys are never collected into a list.
+        """
+        candidates = (image_key for image_key, image_info in self.items() if condition(image_info)) if condition else iter(self._data)
         if randomly:
             import random
             if random_seed is not None:
                 random.seed(random_seed)
-            samples = random.sample([image_info for image_info in self.values() if not condition or condition(image_info)], min(n, len(self)))
+            keys = reservoir_sample(candidates, n)
         else:
-            samples = [image_info for image_info in self.values() if not condition or condition(image_info)][:n]
-        return Dataset(samples)
+            keys = list(itertools.islice(candidates, n))
+        return Dataset(DatasetView([self._data], keys))
+
+    def top_k(self, key, k, reverse=True, **kwargs) -> 'Dataset':
+        r"""
+        Get the first `k` images of the dataset sorted by `key` without sorting the whole dataset, e.g. `dataset.top_k(sorting.aesthetic_score, 100)`.
+        It is the same as the first `k` images of `sort_by(key, reverse=reverse)`, where the sort keys of all images are partitioned by `numpy.argpartition` and only the selected images are sorted.
+        :param key: A method of `sorting`, or a list of them, where earlier methods take precedence.
+        :param reverse: Select the largest keys, which is the default.
+        :param kwargs: Extra arguments passed to the methods that accept them, see `sort_by`.
+        """
+        methods = list(key) if isinstance(key, (list, tuple)) else [key]
+        k = max(0, min(k, len(self)))
+        keys = self._top_k_keys(methods, k, reverse, kwargs) if k > 0 else []
+        return Dataset(DatasetView([self._data], keys))
+
+    def _top_k_keys(self, methods, k, reverse, kwargs) -> List[str]:
+        columns = self.columns()
+        sort_keys = self._sort_keys(methods, reverse, kwargs, columns)
+        if k < len(columns):
+            first = sort_keys[0]
+            kth = first[np.argpartition(first, k - 1)[k - 1]]
+            candidates = np.flatnonzero(~(first > kth))  # ties with the k-th key are resolved by the other keys and the dataset order
+        else:
+            candidates = np.arange(len(columns))
+        order = candidates[np.lexsort([values[candidates] for values in sort_keys[::-1]])[:k]]
+        return columns.keys_at(order)
 
     def sort(self, key, reverse=False):
+        frame_cache = self._synced_frame_cache()
         self._data = dict(sorted(self._data.items(), key=key, reverse=reverse))
+        self._changed()
+        if frame_cache is not None:
+            frame_cache.reordered()
+
+    def sort_by(self, *methods, reverse=False, **kwargs):
+        r"""
+        Sort the dataset by several methods of `sorting` at once, e.g. `dataset.sort_by(sorting.quality, sorting.aesthetic_score, reverse=True)`, where earlier methods take precedence.
+        If the dataset has cached columns, e.g. after `query`, `groupby` or `top_k`, methods with a column extractor read them and other methods are called once per image.
+        Otherwise, e.g. on a fresh subset, every method is called once per image, since building the columns costs more than a single sort. All keys are sorted by a single `numpy.lexsort`.
+        The order of ties is kept, as in `sort`.
+        :param kwargs: Extra arguments passed to the methods that accept them, e.g. `target` of `sorting.perceptual_hash`.
+        """
+        if not methods:
+            return
+        columns = self.__dict__.get('_column_cache')
+        if columns is not None and columns.sync():
+            order = np.lexsort(self._sort_keys(methods, reverse, kwargs, columns)[::-1])
+            keys = columns.keys_at(order)
+        else:
+            columns = None
+            items = [item for item in self._data.items()]  # without `len`, which counts the live keys of views
+            order = np.lexsort(self._sort_keys(methods, reverse, kwargs, None, image_infos=[image_info for _, image_info in items])[::-1])
+            keys = [items[i][0] for i in order.tolist()]
+        frame_cache = self._synced_frame_cache()
+        if isinstance(self._data, DatasetView) and not self._data.is_materialized:  # only reorder the keys of the view
+            self._data = self._data.reordered(keys)
+        else:  # look values up by key rather than building item tuples, which would trigger garbage collection passes over all infos
+            data = self._data
+            self._data = {image_key: data[image_key] for image_key in keys}
+        self._changed()
+        if columns is not None:
+            columns.permute(order)
+        if frame_cache is not None:
+            frame_cache.reordered()
+
+    def _sort_keys(self, methods, reverse, kwargs, columns, image_infos=None) -> List[np.ndarray]:
+        r"""
+        Get the sort keys of all images by each method as arrays in the dataset order, negated if `reverse`.
+        :param columns: Cached columns to read by methods with a column extractor, or None to call every method per image.
+        :param image_infos: Image infos in the dataset order, defaults to the values of the dataset.
+        """
+        sort_keys = []
+        for method in methods:
+            if columns is not None and hasattr(method, 'column'):
+                values = method.column(columns)
+            else:
+                method_kwargs_ = method_kwargs(method, kwargs)
+                values = [method(image_info, **method_kwargs_) for image_info in (image_infos if image_infos is not None else self._data.values())]
+                try:
+                    values = np.asarray(values, dtype=np.float64)
+                except (TypeError, ValueError):  # sort other comparable values by rank
+                    values = np.unique(np.asarray(values, dtype=object), return_inverse=True)[1]
+            sort_keys.append(-values if reverse else values)
+        return sort_keys
 
     def __iter__(self):
         return iter(self._data)
@@ -340,12 +726,66 @@ class Dataset(logu.Logger):
             toc = time.time()
             self.log(f'Dataset dumped: time_cost={toc - tic:.2f}s.')
 
-    def to_txts(self):
+    def to_parquet(self, fp, row_group_size=65536, compression='zstd', verbose=None):
+        verbose = verbose if verbose is not None else self.verbose
+        if verbose:
+            tic = time.time()
+            self.log(f'Dumping dataset to `{logu.yellow(Path(fp).absolute())}`...')
+
+        from .parquet import dump_as_parquet
+        dump_as_parquet(self, fp, row_group_size=row_group_size, compression=compression, verbose=verbose)
+
+        if verbose:
+            toc = time.time()
+            self.log(f'Dataset dumped: time_cost={toc - tic:.2f}s.')
+
+    def to_sqlite(self, fp, mode='a', verbose=None):
+        verbose = verbose if verbose is not None else self.verbose
+        if verbose:
+            tic = time.time()
+            self.log(f'Dumping dataset to `{logu.yellow(Path(fp).absolute())}`...')
+
+        from .sqlite_dataset import dump_as_sqlite
+        dump_as_sqlite(self, fp, mode=mode, verbose=verbose)
+
+        if verbose:
+            toc = time.time()
+            self.log(f'Dataset dumped: time_cost={toc - tic:.2f}s.')
+
+    def to_jsonl(self, fp, verbose=None):
+        verbose = verbose if verbose is not None else self.verbose
+        if verbose:
+            tic = time.time()
+            self.log(f'Appending dataset to `{logu.yellow(Path(fp).absolute())}`...')
+
+        from .journal import dump_as_jsonl
+        dump_as_jsonl(self, fp, verbose=verbose)
+
+        if verbose:
+            toc = time.time()
+            self.log(f'Dataset appended: time_cost={toc - tic:.2f}s.')
+
+    def to_txts(self, ask_confirm=True, max_workers=8):
         if self.verbose:
             tic = time.time()
             self.log(f'Dumping dataset to txt...')
 
-        dump_as_txts(self, verbose=self.verbose)
+        summary = dump_as_txts(self, ask_confirm=ask_confirm, max_workers=max_workers, verbose=self.verbose)
+
+        if self.verbose:
+            toc = time.time()
+            self.log(f'Dataset dumped: time_cost={toc - tic:.2f}s.')
+        return summary
+
+    def to_packs(self):
+        r"""
+        Write captions to the caption packs of the image directories instead of one txt file per image, see `CaptionPack`.
+        """
+        if self.verbose:
+            tic = time.time()
+            self.log('Dumping dataset to caption packs...')
+
+        dump_as_packs(self, verbose=self.verbose)
 
         if self.verbose:
             toc = time.time()
@@ -363,7 +803,7 @@ class Dataset(logu.Logger):
         for i in range(len(ratio)):
             start = int(r_cumsum[i] * len(keys))
             end = int(r_cumsum[i + 1] * len(keys))
-            datasets.append(Dataset({key: self[key] for key in keys[start:end]}))
+            datasets.append(Dataset(DatasetView([self._data], keys[start:end])))
         return datasets
 
     def split_n(self, n: int, shuffle: bool = True) -> List['Dataset']:
@@ -372,7 +812,7 @@ class Dataset(logu.Logger):
             import random
             random.shuffle(keys)
         stride = math.ceil(len(keys) / n)
-        datasets = [Dataset({key: self[key] for key in keys[i:i + stride]}) for i in range(0, len(keys), stride)]
+        datasets = [Dataset(DatasetView([self._data], keys[i:i + stride])) for i in range(0, len(keys), stride)]
         return datasets
 
     def batches(self, batch_size: int, shuffle: bool = True) -> List['Dataset']:
@@ -384,44 +824,55 @@ class Dataset(logu.Logger):
         return batches
 
     def __add__(self, other):
-        return Dataset({**self._data, **other._data})
+        keys = list(self._data) + [key for key in other._data if key not in self._data]
+        return Dataset(DatasetView([other._data, self._data], keys))
 
     def __iadd__(self, other):
         self._data.update(other._data)
+        self._changed()
         return self
 
     def __and__(self, other):
-        return Dataset({key: image_info for key, image_info in self.items() if key in other})
+        return Dataset(DatasetView([self._data], [key for key in self._data if key in other]))
 
     def __iand__(self, other):
         self._data = {key: image_info for key, image_info in self.items() if key in other}
+        self._changed()
         return self
 
     def __or__(self, other):
-        return Dataset({**other._data, **self._data})
+        keys = list(other._data) + [key for key in self._data if key not in other._data]
+        return Dataset(DatasetView([self._data, other._data], keys))
 
     def __ior__(self, other):
         self._data = {**other._data, **self._data}
+        self._changed()
         return self
 
     def __sub__(self, other):
-        return Dataset({key: image_info for key, image_info in self.items() if key not in other})
+        return Dataset(DatasetView([self._data], [key for key in self._data if key not in other]))
 
     def __isub__(self, other):
         self._data = {key: image_info for key, image_info in self.items() if key not in other}
+        self._changed()
         return self
 
 
 def dump_as_json(source, fp, mode='a', indent=4, sort_keys=False, verbose=False):
-    import json
+    r"""
+    Write a dataset to a json database with the json backend of `json_utils`.
+    :param indent: Indent of the human-readable layout. If None, writes the compact layout with one entry per line, which is streamed out entry by entry and is much faster to read back.
+    """
     dataset = Dataset(source) if not isinstance(source, Dataset) else source
     if mode == 'a' and Path(fp).is_file():
         dataset = Dataset(fp, verbose=verbose).update(dataset)
-    json_data = {}
-    for image_key, image_info in tqdm(dataset.items(), desc='converting to dict', smoothing=1, disable=not dataset.verbose):
-        json_data[image_key] = image_info.dict()
-    with open(fp, mode='w', encoding='utf-8') as f:
-        json.dump(json_data, f, indent=indent, sort_keys=sort_keys)
+    items = ((image_key, image_info.dict()) for image_key, image_info in tqdm(dataset.items(), desc='converting to dict', smoothing=1, disable=not dataset.verbose))
+    if indent is None and not sort_keys:
+        with open_file(fp, mode='w') as f:
+            json_utils.dump_json_items(items, f)
+    else:
+        json_utils.dump(dict(items), fp, indent=indent, sort_keys=sort_keys)
+    remove_journal(fp)  # the snapshot includes the journal, which was replayed when loading it in append mode
 
 
 def dump_as_csv(source, fp, mode='a', sep=',', verbose=False):
@@ -430,26 +881,87 @@ def dump_as_csv(source, fp, mode='a', sep=',', verbose=False):
         dataset = Dataset(fp, verbose=verbose).update(dataset)
     df = dataset.df()
     df.to_csv(fp, mode='w', sep=sep, index=False)
+    remove_journal(fp)
 
 
-def dump_as_txts(source, ask_confirm=True, verbose=False):
-    dataset = Dataset(source)
+def dump_as_txts(source, ask_confirm=True, max_workers=8, verbose=False):
+    r"""
+    Write captions to txt files next to their images.
+    Unchanged captions are skipped, changed ones are written to a temporary file which then replaces the txt file, and files are written in a thread pool.
+    :return: A summary dict `{'written': n, 'skipped': n, 'failed': n}`, or None if aborted.
+    """
+    dataset = Dataset(source) if not isinstance(source, Dataset) else source
+    groups = dataset.group_by_dir()
+
+    def list_dir(dir_id):
+        try:
+            return set(os.listdir(PATH_TABLE.dir(dir_id)))
+        except OSError:
+            return set()
+
+    with cf.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        listings = dict(zip(groups, executor.map(list_dir, groups)))
+
     if ask_confirm:
         logger = logu.FileLogger(smart_name('./logs/.tmp/%date%-%increment%.log'), name=dump_as_txts.__name__, temp=True)
-        for image_key, image_info in tqdm(dataset.items(), desc='stage 1/2: Checking', smoothing=1, disable=not verbose):
-            image_path = image_info.image_path
-            label_path = image_path.with_suffix('.txt')
-
-            if not image_path.is_file():  # if image file doesn't exist
-                logger.info(f"[{image_key:>20}] miss image file: {image_path}")
-            if label_path.exists():
-                logger.info(f"[{image_key:>20}] overwrite label file: {label_path}")
+        for dir_id, image_keys in tqdm(groups.items(), desc='stage 1/2: Checking', smoothing=1, disable=not verbose):
+            names = listings[dir_id]
+            for image_key in image_keys:
+                image_info = dataset[image_key]
+                if image_info.stem + image_info.suffix not in names:  # if image file doesn't exist
+                    logger.info(f"[{image_key:>20}] miss image file: {image_info.image_path}")
+                if image_info.stem + '.txt' in names:
+                    logger.info(f"[{image_key:>20}] overwrite label file: {image_info.label_path}")
         logu.info(f"log to `{logu.yellow(logger.fp)}`")
-
-    if not ask_confirm or input(logu.green(f"continue? ([y]/n): ")) == 'y':
-        for image_key, image_info in tqdm(dataset.items(), desc='stage 2/2: Writing to disk' if ask_confirm else 'Writing to disk', smoothing=1, disable=not verbose):
-            image_info.image_path.parent.mkdir(parents=True, exist_ok=True)
-            image_info.write_txt_caption()
-    else:
-        if verbose:
-            logu.info('Aborted.')
+        if input(logu.green(f"continue? ([y]/n): ")) != 'y':
+            if verbose:
+                logu.info('Aborted.')
+            return None
+
+    pbar = tqdm(total=len(dataset), desc='stage 2/2: Writing to disk' if ask_confirm else 'Writing to disk', smoothing=1, disable=not verbose)
+
+    def write_chunk(dir_id, image_keys):
+        directory = PATH_TABLE.dir(dir_id)
+        names = listings[dir_id]
+        pack = get_pack(directory)
+        pack_updates = {}
+        written = skipped = failed = 0
+        for image_key in image_keys:
+            image_info = dataset[image_key]
+            try:
+                if not image_info.caption:
+                    skipped += 1
+                    continue
+                caption = str(image_info.caption)
+                data = caption.encode('utf-8')
+                fp = os.path.join(directory, image_info.stem + '.txt')
+                if pack is not None and image_info.stem in pack and pack.get(image_info.stem) != caption:  # keep the pack, which shadows the txt, up to date
+                    pack_updates[image_info.stem] = caption
+                if image_info.stem + '.txt' in names and os.path.getsize(fp) == len(data):
+                    with open(fp, 'rb') as f:
+                        if f.read() == data:
+                            skipped += 1
+                            continue
+                os.makedirs(directory, exist_ok=True)
+                write_bytes_atomic(fp, data)
+                written += 1
+            except Exception as e:
+                logu.error(f"failed to write caption of `{image_key}`: {e}")
+                failed += 1
+        if pack_updates:
+            pack.update(pack_updates)
+        pbar.update(len(image_keys))
+        return written, skipped, failed
+
+    chunk_size = 256
+    chunks = [(dir_id, image_keys[i:i + chunk_size]) for dir_id, image_keys in groups.items() for i in range(0, len(image_keys), chunk_size)]
+    summary = {'written': 0, 'skipped': 0, 'failed': 0}
+    with cf.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for written, skipped, failed in executor.map(lambda chunk: write_chunk(*chunk), chunks):
+            summary['written'] += written
+            summary['skipped'] += skipped
+            summary['failed'] += failed
+    pbar.close()
+    if verbose:
+        logu.info(f"txts dumped: written={summary['written']} | skipped={summary['skipped']} | failed={summary['failed']}")
+    return summary
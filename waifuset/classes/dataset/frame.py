@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+from ..data import ImageInfo
+
+HEADERS = ['image_key'] + [name for name in ImageInfo._all_attrs]
+
+# columns kept as float64 with NaN for missing values, whatever the values are, so that patched and rebuilt frames have the same dtypes
+FLOAT_HEADERS = [header for header in HEADERS if ImageInfo.__dicttype__.get(header) is float]
+
+
+def to_frame(rows: List[tuple]) -> pd.DataFrame:
+    frame = pd.DataFrame(rows, columns=HEADERS)
+    return frame.astype({header: np.float64 for header in FLOAT_HEADERS})
+
+
+def to_column(values, dtype) -> np.ndarray:
+    r"""
+    Convert the values of a column to an array of `dtype`, where missing values of float columns are NaN.
+    """
+    if dtype == object:  # fill an object array to keep tuples such as sizes as single values
+        column = np.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            column[i] = value
+        return column
+    return np.array([np.nan if value is None else value for value in values], dtype=dtype)
+
+
+class FrameCache:
+    r"""
+    Rows of `Dataset.df` converted from image infos by `ImageInfo.dict`, cached by key, and the last full DataFrame built from them.
+    Rows are converted on first use, so a frame of a few keys only converts those. The cache follows the version of its dataset like `ColumnCache`:
+    after edits only the rows of replaced image infos are converted again and patched into the full frame, reordering the dataset keeps the rows,
+    and other changes rebuild it. In-place edits of image infos are not tracked, assign them back to the dataset to keep the cache in sync.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.version = dataset._version
+        self.rows: Dict[str, tuple] = {}
+        self.frame: Optional[pd.DataFrame] = None  # full frame in the order of the dataset
+        self.positions: Optional[Dict[str, int]] = None  # key -> position in the full frame
+
+    def sync(self) -> bool:
+        r"""
+        Apply the edits of the dataset since the cache was synced. Returns False if the cache is stale and must be rebuilt.
+        """
+        dataset = self.dataset
+        if self.version == dataset._version:
+            return True
+        if self.version < dataset._layout_version or self.version < dataset._edit_log_start:
+            return False
+        edited = [image_key for image_key in dict.fromkeys(dataset._edit_log[self.version - dataset._edit_log_start:]) if image_key in self.rows]
+        for image_key in edited:
+            del self.rows[image_key]
+        if self.frame is not None and edited:
+            rows = self.convert(edited)
+            positions = [self.positions[image_key] for image_key in edited]
+            for j, values in enumerate(zip(*rows)):  # patch column by column
+                if j == 0:  # keys are the same
+                    continue
+                self.frame.iloc[positions, j] = to_column(values, self.frame.dtypes.iloc[j])
+        self.version = dataset._version
+        return True
+
+    def reordered(self):
+        r"""
+        Follow the dataset after it was only reordered, which keeps the rows but not the full frame.
+        """
+        self.frame = self.positions = None
+        self.version = self.dataset._version
+
+    def convert(self, image_keys) -> List[tuple]:
+        r"""
+        Get the rows of `image_keys`, converting the ones that are not cached yet.
+        """
+        rows, data = self.rows, self.dataset._data
+        result = []
+        for image_key in image_keys:
+            row = rows.get(image_key)
+            if row is None:
+                info_dict = data[image_key].dict()
+                row = rows[image_key] = (image_key, *(info_dict[header] for header in HEADERS[1:]))
+            result.append(row)
+        return result
+
+    def df(self, columns: List[str] = None, image_keys: List[str] = None) -> pd.DataFrame:
+        r"""
+        Get a DataFrame of the dataset, or of `image_keys` only, projected to `columns`.
+        """
+        if columns is not None:
+            unknown = [column for column in columns if column not in HEADERS]
+            if unknown:
+                raise KeyError(f"unknown columns {unknown}, expected some of {HEADERS}")
+        if image_keys is not None:
+            frame = to_frame(self.convert(image_keys))
+            return frame if columns is None else frame[list(columns)]
+        if self.frame is None:
+            image_keys = list(self.dataset.keys())
+            self.frame = to_frame(self.convert(self.dataset.pbar(image_keys, desc='converting DataFrame', smoothing=1, disable=not self.dataset.verbose)))
+            self.positions = {image_key: i for i, image_key in enumerate(image_keys)}
+        return self.frame.copy() if columns is None else self.frame[list(columns)].copy()
@@ -0,0 +1,158 @@
+import itertools
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Tuple, Union
+from .columns import ColumnCache, Categorical, NUMERIC_COLUMNS, CATEGORICAL_COLUMNS, INDEXES
+
+AGGREGATIONS = ('count', 'sum', 'mean', 'std', 'min', 'max', 'hist')
+
+
+class GroupBy:
+    r"""
+    Groups of the images of a dataset by an attribute, aggregated over the cached columns of the dataset with `numpy.bincount`
+    instead of converting image infos to a DataFrame, e.g. `dataset.groupby('artist').mean('aesthetic_score')`.
+    The attribute is a column or an index of `ColumnCache`:
+        - categorical attributes such as `category`, `artist`, `quality` and `safe_level` group images by their values;
+        - numeric attributes such as `original_width` group images by their distinct values;
+        - multi-valued attributes `characters`, `styles` and `tags` put an image in the group of each of its values, so groups may overlap.
+    Images with a missing value, or without any value of a multi-valued attribute, are put in the group `None`.
+    Groups are taken when the `GroupBy` is made, make a new one after editing the dataset. Results are ordered by group size, largest first.
+    """
+
+    def __init__(self, columns: ColumnCache, by: str):
+        self.by = by
+        self.columns = columns
+        size = len(columns)
+        if by in INDEXES:
+            positions = [(value, rows) for value, rows in columns.index(by).positions.items() if rows]
+            self.groups = [value for value, _ in positions]
+            lengths = np.fromiter((len(rows) for _, rows in positions), dtype=np.int64, count=len(positions))
+            self.rows = np.fromiter(itertools.chain.from_iterable(rows for _, rows in positions), dtype=np.int64, count=int(lengths.sum()))
+            self.group_ids = np.repeat(np.arange(len(positions)), lengths)
+            covered = np.zeros(size, dtype=bool)
+            covered[self.rows] = True
+            if not covered.all():
+                uncovered = np.flatnonzero(~covered)
+                self.rows = np.concatenate([self.rows, uncovered])
+                self.group_ids = np.concatenate([self.group_ids, np.full(len(uncovered), len(self.groups))])
+                self.groups.append(None)
+        elif by in CATEGORICAL_COLUMNS:
+            column: Categorical = columns.column(by, by_row=True)
+            self.rows = None  # every row is in exactly one group
+            self.groups = list(column.categories) + [None]
+            self.group_ids = np.where(column.codes < 0, len(column.categories), column.codes)
+        elif by in NUMERIC_COLUMNS:
+            values = columns.column(by, by_row=True)
+            isnull = np.isnan(values)
+            distinct, inverse = np.unique(values[~isnull], return_inverse=True)
+            self.rows = None
+            self.groups = distinct.tolist() + [None]
+            self.group_ids = np.full(size, len(distinct), dtype=np.int64)
+            self.group_ids[~isnull] = inverse
+        else:
+            raise KeyError(f"cannot group by `{by}`, expected one of {list(CATEGORICAL_COLUMNS) + list(NUMERIC_COLUMNS) + list(INDEXES)}")
+        self.sizes = np.bincount(self.group_ids, minlength=len(self.groups))
+        self.order = [i for i in np.argsort(-self.sizes, kind='stable').tolist() if self.sizes[i] > 0]  # drop values that no image has anymore
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        return (self.groups[i] for i in self.order)
+
+    def _result(self, values) -> Dict[Any, Any]:
+        return {self.groups[i]: values[i] for i in self.order}
+
+    def _values(self, column) -> Tuple[np.ndarray, np.ndarray]:
+        r"""
+        Get the values of a numeric `column` that are not missing, and the groups they belong to.
+        """
+        if column not in NUMERIC_COLUMNS:
+            raise KeyError(f"cannot aggregate `{column}`, expected one of {list(NUMERIC_COLUMNS)}")
+        values = self.columns.column(column, by_row=True)
+        if self.rows is not None:
+            values = values[self.rows]
+        valid = ~np.isnan(values)
+        return values[valid], self.group_ids[valid]
+
+    def _aggregate(self, column, func) -> np.ndarray:
+        if func == 'count' and column is None:
+            return self.sizes
+        values, group_ids = self._values(column)
+        counts = np.bincount(group_ids, minlength=len(self.groups))
+        if func == 'count':
+            return counts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if func in ('sum', 'mean', 'std'):
+                sums = np.bincount(group_ids, weights=values, minlength=len(self.groups))
+                if func == 'sum':
+                    return sums
+                means = sums / counts
+                if func == 'mean':
+                    return means
+                squares = np.bincount(group_ids, weights=values * values, minlength=len(self.groups))
+                return np.sqrt(np.maximum(squares / counts - means * means, 0))
+            elif func in ('min', 'max'):
+                result = np.full(len(self.groups), np.inf if func == 'min' else -np.inf)
+                (np.minimum if func == 'min' else np.maximum).at(result, group_ids, values)
+                result[counts == 0] = np.nan
+                return result
+        raise ValueError(f"unknown aggregation `{func}`, expected one of {AGGREGATIONS}")
+
+    def count(self, column=None) -> Dict[Any, int]:
+        r"""
+        Number of images of each group, or the number of them with a value of `column`.
+        """
+        return self._result(self._aggregate(column, 'count').tolist())
+
+    def sum(self, column) -> Dict[Any, float]:
+        return self._result(self._aggregate(column, 'sum').tolist())
+
+    def mean(self, column) -> Dict[Any, float]:
+        r"""
+        Mean of `column` of each group, ignoring missing values. Groups without any value get NaN.
+        """
+        return self._result(self._aggregate(column, 'mean').tolist())
+
+    def std(self, column) -> Dict[Any, float]:
+        return self._result(self._aggregate(column, 'std').tolist())
+
+    def min(self, column) -> Dict[Any, float]:
+        return self._result(self._aggregate(column, 'min').tolist())
+
+    def max(self, column) -> Dict[Any, float]:
+        return self._result(self._aggregate(column, 'max').tolist())
+
+    def hist(self, column, bins=10, range=None) -> Tuple[Dict[Any, np.ndarray], np.ndarray]:
+        r"""
+        Histogram of `column` of each group, with the same bins for all groups, ignoring missing values.
+        :param bins: Number of bins or bin edges, the same as `numpy.histogram`.
+        :param range: Range of the bins, defaults to the range of all values.
+        :return: Counts of each group and the bin edges.
+        """
+        values, group_ids = self._values(column)
+        edges = np.histogram_bin_edges(values, bins=bins, range=range)
+        num_bins = len(edges) - 1
+        in_range = (values >= edges[0]) & (values <= edges[-1])
+        bin_ids = np.minimum(np.searchsorted(edges, values[in_range], side='right') - 1, num_bins - 1)  # the last bin includes its right edge
+        counts = np.bincount(group_ids[in_range] * num_bins + bin_ids, minlength=len(self.groups) * num_bins).reshape(len(self.groups), num_bins)
+        return self._result(counts), edges
+
+    def agg(self, *funcs: str, **named: Union[str, Tuple[str, str]]) -> pd.DataFrame:
+        r"""
+        Aggregate the groups into a DataFrame with one row per group, e.g. `dataset.groupby('quality').agg('count', score=('aesthetic_score', 'mean'))`.
+        :param funcs: `count`, the number of images of each group.
+        :param named: Column names of the result mapped to `count` or `(column, func)`, where func is one of `count`, `sum`, `mean`, `std`, `min`, `max` and `hist`.
+            Histograms have 10 bins over the range of all values, use `hist` for other bins.
+        """
+        aggregations = {func: (None, func) for func in funcs}
+        aggregations.update({name: (None, spec) if isinstance(spec, str) else tuple(spec) for name, spec in named.items()})
+        data = {}
+        for name, (column, func) in aggregations.items():
+            if column is None and func != 'count':
+                raise ValueError(f"aggregation `{name}` needs a column, e.g. `{name}=('aesthetic_score', '{func}')`")
+            if func == 'hist':
+                data[name] = list(self.hist(column)[0].values())
+            else:
+                data[name] = self._aggregate(column, func)[self.order]
+        return pd.DataFrame(data, index=pd.Index(list(self), name=self.by))
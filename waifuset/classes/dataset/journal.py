@@ -0,0 +1,108 @@
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Tuple, Optional
+from ...utils import json_utils
+from ...utils.file_utils import open_file, split_compression_suffix
+
+DELETED = '__deleted__'
+
+
+def journal_path(fp) -> Path:
+    r"""
+    Path of the append-only journal of a snapshot database, e.g. `db.json` -> `db.jsonl`.
+    Journals of compressed snapshots are not compressed so that appending stays cheap, e.g. `db.json.zst` -> `db.jsonl`.
+    """
+    fp = Path(fp)
+    if split_compression_suffix(fp)[1]:
+        fp = fp.with_suffix('')
+    return fp.with_suffix('.jsonl')
+
+
+def iter_jsonl_records(fp) -> Iterator[Tuple[str, Optional[dict]]]:
+    r"""
+    Iterate over `(image_key, info_dict)` records of a jsonl journal in writing order. `info_dict` is None for a deletion.
+    A truncated last line, e.g. left by a crash while appending, is ignored. The journal may be compressed, see `open_file`.
+    """
+    compressed = bool(split_compression_suffix(fp)[1])
+    with open_file(fp, 'r') as f:
+        lines = iter(f)
+        while True:
+            try:
+                line = next(lines)
+            except StopIteration:
+                break
+            except Exception:  # a truncated compressed stream
+                if not compressed:
+                    raise
+                break
+            if not line.strip():
+                continue
+            try:
+                record = json_utils.loads(line)
+            except ValueError:
+                continue
+            image_key = record.pop('image_key')
+            yield image_key, None if record.get(DELETED) else record
+
+
+def read_journal(fp) -> Dict[str, Optional[dict]]:
+    r"""
+    Fold a jsonl journal into `{image_key: info_dict}`, where later records override earlier ones and deleted keys map to None.
+    """
+    records = {}
+    for image_key, record in iter_jsonl_records(fp):
+        records.pop(image_key, None)  # move updated keys to the end
+        records[image_key] = record
+    return records
+
+
+def dump_as_jsonl(source, fp, deleted: Iterable[str] = None, verbose=False):
+    r"""
+    Append records of `source` and deletions of `deleted` keys to a jsonl journal, one line per record.
+    """
+    from .dataset import Dataset
+    dataset = Dataset(source) if not isinstance(source, Dataset) else source
+    Path(fp).parent.mkdir(parents=True, exist_ok=True)
+    if not split_compression_suffix(fp)[1]:  # compressed journals get a new frame per append instead
+        with open(fp, 'a+b') as f:  # terminate a truncated last line so that new records don't get merged into it
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+    with open_file(fp, 'a') as f:
+        for image_key, image_info in dataset.pbar(dataset.items(), desc='appending to journal', smoothing=1, disable=not verbose):
+            f.write(json_utils.dumps({'image_key': image_key, **image_info.dict()}) + '\n')
+        for image_key in deleted or ():
+            f.write(json_utils.dumps({'image_key': image_key, DELETED: True}) + '\n')
+
+
+def compact_journal(fp, verbose=False):
+    r"""
+    Fold the journal of snapshot `fp` into the snapshot and remove the journal. The snapshot can be a json or csv database.
+    The new snapshot is written to a temporary file first, so a crash never leaves a half-written snapshot.
+    """
+    from .dataset import Dataset, dump_as_json, dump_as_csv
+    fp = Path(fp)
+    jnl_fp = journal_path(fp)
+    if not jnl_fp.is_file():
+        return
+    dataset = Dataset(fp if fp.is_file() else jnl_fp, verbose=verbose)  # snapshot loading replays its journal
+    tmp_fp = fp.with_name('.tmp.' + fp.name)  # keep the suffixes that select the format and compression
+    if split_compression_suffix(fp)[0] == '.csv':
+        dump_as_csv(dataset, tmp_fp, mode='w', verbose=verbose)
+    else:
+        dump_as_json(dataset, tmp_fp, mode='w', verbose=verbose)
+    os.replace(tmp_fp, fp)
+    remove_journal(fp)
+
+
+def remove_journal(fp):
+    r"""
+    Remove the journal of snapshot `fp` and the offset index of the journal, e.g. after the whole snapshot was rewritten, so that its stale records are not replayed on top of the new snapshot.
+    """
+    from .jsonl_index import index_path
+    jnl_fp = journal_path(fp)
+    if jnl_fp == Path(fp):  # the database is a journal itself
+        return
+    jnl_fp.unlink(missing_ok=True)
+    index_path(jnl_fp).unlink(missing_ok=True)
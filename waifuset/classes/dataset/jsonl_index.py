@@ -0,0 +1,253 @@
+import os
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Dict, List
+from ..data import ImageInfo
+from ..data.path_table import PATH_TABLE
+from .journal import DELETED, dump_as_jsonl
+from ...utils import json_utils
+from ...utils.file_utils import split_compression_suffix
+
+
+def index_path(fp) -> Path:
+    r"""
+    Path of the offset index of a jsonl database, e.g. `db.jsonl` -> `db.jsonl.idx`.
+    """
+    fp = Path(fp)
+    return fp.with_name(fp.name + '.idx')
+
+
+class JsonlIndex:
+    r"""
+    Offset index `{image_key: (offset, length, dir_index)}` of the live records of a jsonl database, kept in a sidecar file next to it.
+    Later records override earlier ones and deletion records remove keys, the same as `read_journal`.
+    Only the records appended after the indexed size are scanned when the index is opened or refreshed.
+    The image directory of every record is kept in the index too, so records can be grouped by directory without being parsed.
+    """
+
+    def __init__(self, fp):
+        self.fp = Path(fp).absolute()
+        if split_compression_suffix(self.fp)[1]:
+            raise ValueError(f"random access needs an uncompressed jsonl database, but got `{self.fp}`")
+        self.index_fp = index_path(self.fp)
+        self._entries: Dict[str, tuple] = {}
+        self._dirs: List[str] = []
+        self._dir_indices: Dict[str, int] = {}
+        self._size = 0
+        self._indexed_identity = None  # see `_identity`
+        self._reader = None
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        if self.index_fp.is_file():
+            try:
+                data = json_utils.load(self.index_fp)
+                if data['size'] <= os.path.getsize(self.fp) and data['identity'] == self._identity(data['size']):
+                    self._dirs = data['dirs']
+                    self._dir_indices = {directory: i for i, directory in enumerate(self._dirs)}
+                    self._entries = {key: tuple(entry) for key, entry in data['entries'].items()}
+                    self._size = data['size']
+                    self._indexed_identity = data['identity']
+            except (OSError, ValueError, KeyError):
+                self._reset()
+        self.refresh()
+
+    def _reset(self):
+        self._entries, self._dirs, self._dir_indices, self._size, self._indexed_identity = {}, [], {}, 0, None
+
+    def _identity(self, size) -> list:
+        r"""
+        Identity of the database file whose first `size` bytes were indexed: its inode and a hash of up to its first 4096 bytes.
+        A database that was deleted or rewritten since then, e.g. by `compact_journal`, gets a different identity even if it grew back past `size`.
+        """
+        with open(self.fp, 'rb') as f:
+            head = f.read(min(size, 4096))
+        return [os.stat(self.fp).st_ino, hashlib.sha1(head).hexdigest()]
+
+    def refresh(self):
+        r"""
+        Index the records appended since the last scan and save the index if anything changed.
+        If the database was rewritten since the last scan, index it from the start.
+        """
+        with self._lock:
+            if not self.fp.is_file():
+                return
+            if self._size and (os.path.getsize(self.fp) < self._size or self._identity(self._size) != self._indexed_identity):
+                self._reset()
+                if self._reader is not None:  # may hold the replaced file
+                    self._reader.close()
+                    self._reader = None
+            if os.path.getsize(self.fp) <= self._size:
+                return
+            with open(self.fp, 'rb') as f:
+                f.seek(self._size)
+                offset = self._size
+                for line in f:
+                    if not line.endswith(b'\n'):  # truncated last record
+                        break
+                    try:
+                        record = json_utils.loads(line)
+                        image_key = record['image_key']
+                    except (ValueError, KeyError, TypeError):
+                        offset += len(line)
+                        continue
+                    self._entries.pop(image_key, None)  # move updated keys to the end
+                    if not record.get(DELETED):
+                        directory = os.path.dirname(os.path.abspath(record['image_path']))
+                        if (dir_index := self._dir_indices.get(directory)) is None:
+                            dir_index = self._dir_indices[directory] = len(self._dirs)
+                            self._dirs.append(directory)
+                        self._entries[image_key] = (offset, len(line), dir_index)
+                    offset += len(line)
+            self._size = offset
+            self._indexed_identity = self._identity(self._size)
+            self.save()
+
+    def save(self):
+        with self._lock:
+            tmp_fp = self.index_fp.with_name(self.index_fp.name + '.tmp')
+            json_utils.dump({'size': self._size, 'identity': self._indexed_identity, 'dirs': self._dirs, 'entries': self._entries}, tmp_fp)
+            os.replace(tmp_fp, self.index_fp)
+
+    def read(self, image_key) -> dict:
+        r"""
+        Read and parse the record of `image_key` with a single seek. Raises `KeyError` if the key is not indexed.
+        """
+        offset, length, _ = self._entries[image_key]
+        with self._lock:
+            if self._reader is None:
+                self._reader = open(self.fp, 'rb')
+            self._reader.seek(offset)
+            line = self._reader.read(length)
+        record = json_utils.loads(line)
+        record.pop('image_key', None)
+        return record
+
+    def directory(self, image_key) -> str:
+        return self._dirs[self._entries[image_key][2]]
+
+    def group_by_dir(self) -> Dict[str, List[str]]:
+        r"""
+        Group the indexed keys by image directory without parsing any record.
+        """
+        groups = {}
+        for image_key, (_, _, dir_index) in self._entries.items():
+            groups.setdefault(dir_index, []).append(image_key)
+        return {self._dirs[dir_index]: image_keys for dir_index, image_keys in groups.items()}
+
+    def __contains__(self, image_key):
+        return image_key in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+
+class LazyStorage(MutableMapping):
+    r"""
+    Mapping of image keys to `ImageInfo` objects backed by a jsonl database and its `JsonlIndex`.
+    Only keys and offsets are held in memory. A record is parsed on first access and the `cache_size` most recently used ones are kept in an LRU.
+    Assigned and deleted keys are kept in memory until `commit` appends them to the database. In-place edits of a fetched `ImageInfo`
+    are not tracked since it may be evicted, so assign it back to keep them.
+    """
+
+    def __init__(self, fp, cache_size=4096):
+        self.index = JsonlIndex(fp)
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._dirty: Dict[str, ImageInfo] = {}
+        self._deleted = set()
+        self._lock = threading.RLock()
+
+    @property
+    def fp(self):
+        return self.index.fp
+
+    def __getitem__(self, image_key) -> ImageInfo:
+        if image_key in self._dirty:
+            return self._dirty[image_key]
+        if image_key in self._deleted or image_key not in self.index:
+            raise KeyError(image_key)
+        with self._lock:
+            if (image_info := self._cache.get(image_key)) is not None:
+                self._cache.move_to_end(image_key)
+                return image_info
+        image_info = ImageInfo(**self.index.read(image_key))
+        with self._lock:
+            self._cache[image_key] = image_info
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return image_info
+
+    def __setitem__(self, image_key, image_info):
+        with self._lock:
+            self._dirty[image_key] = image_info
+            self._deleted.discard(image_key)
+            self._cache.pop(image_key, None)
+
+    def __delitem__(self, image_key):
+        if image_key not in self:
+            raise KeyError(image_key)
+        with self._lock:
+            self._dirty.pop(image_key, None)
+            self._cache.pop(image_key, None)
+            if image_key in self.index:
+                self._deleted.add(image_key)
+
+    def __contains__(self, image_key):
+        return image_key in self._dirty or (image_key in self.index and image_key not in self._deleted)
+
+    def __iter__(self):
+        for image_key in list(self.index):
+            if image_key not in self._deleted:
+                yield image_key
+        for image_key in list(self._dirty):
+            if image_key not in self.index:
+                yield image_key
+
+    def __len__(self):
+        return len(self.index) - len(self._deleted) + sum(1 for image_key in self._dirty if image_key not in self.index)
+
+    def group_by_dir(self) -> Dict[int, List[str]]:
+        r"""
+        Group keys by the `PATH_TABLE` directory id of their images, reading directories from the index instead of parsing records.
+        """
+        groups = {}
+        for directory, image_keys in self.index.group_by_dir().items():
+            image_keys = [image_key for image_key in image_keys if image_key not in self._deleted and image_key not in self._dirty]
+            if image_keys:
+                groups.setdefault(PATH_TABLE.intern(directory), []).extend(image_keys)
+        for image_key, image_info in self._dirty.items():
+            groups.setdefault(image_info.dir_id, []).append(image_key)
+        return groups
+
+    def commit(self):
+        r"""
+        Append assigned and deleted keys to the jsonl database, then index the new records.
+        """
+        with self._lock:
+            if not self._dirty and not self._deleted:
+                return
+            from .dataset import Dataset
+            dump_as_jsonl(Dataset(self._dirty), self.fp, deleted=self._deleted)
+            self._dirty, self._deleted = {}, set()
+            self.index.refresh()
+
+    def close(self):
+        self.commit()
+        self.index.close()
+
+    def __repr__(self):
+        return f"LazyStorage({self.fp})"
@@ -0,0 +1,46 @@
+from .dataset import Dataset
+from .jsonl_index import LazyStorage
+from .selection import heap_top_k
+from ...const import IMAGE_EXTS
+from ...utils import log_utils as logu
+
+
+class LazyDataset(Dataset):
+    r"""
+    Dataset backed by a jsonl database, which only keeps image keys and record offsets in memory.
+    Opening it costs a scan of the records appended since the offset index was saved, and an `ImageInfo` is only parsed when it is accessed.
+    Edits are buffered until `commit` appends them to the database. Assign edited `ImageInfo` objects back to the dataset to keep them.
+    """
+
+    def __init__(self, fp, cache_size=4096, exts=IMAGE_EXTS, verbose=False, **kwargs):
+        self.init_logger(prefix_color=logu.ANSI.BRIGHT_MAGENTA)
+        self.verbose = verbose
+        self.exts = exts
+        self._data = LazyStorage(fp, cache_size=cache_size)
+
+    @property
+    def fp(self):
+        return self._data.fp
+
+    def _subset_of_keys(self, keys, cls=None, *args, **kwargs):
+        return super()._subset_of_keys(keys, cls or Dataset, *args, **kwargs)
+
+    def commit(self):
+        self._data.commit()
+
+    def close(self):
+        self._data.close()
+
+    def copy(self):
+        return Dataset({image_key: image_info.copy() for image_key, image_info in self.items()})
+
+    def sort(self, *args, **kwargs):
+        raise TypeError(f"{type(self).__name__} keeps the record order of its database and cannot be sorted in place, use `top_k` to get the first images by sorting methods, or sort an in-memory subset made by `make_subset`.")
+
+    sort_keys = sort_by = sort
+
+    def _top_k_keys(self, methods, k, reverse, kwargs):
+        return heap_top_k(self.items(), methods, k, reverse=reverse, **kwargs)  # a single pass instead of building the column cache
+
+    def __repr__(self):
+        return repr(self._data)
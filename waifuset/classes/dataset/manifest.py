@@ -0,0 +1,196 @@
+import os
+import concurrent.futures as cf
+from pathlib import Path
+from typing import List, Tuple, Literal
+from ..data.data import ImageInfo, read_attrs, jsonize, is_lazy_reading
+from ..data.caption_pack import PACK_NAME
+from ...const import IMAGE_EXTS
+from ...utils import log_utils as logu, json_utils
+
+MANIFEST_NAME = '.waifuset_manifest.json'
+MANIFEST_VERSION = 1
+SIDECAR_EXTS = {'.txt', '.json'}
+
+
+def sidecar_names(image_name):
+    r"""
+    Names of the sidecar files that `read_attrs` may read for an image.
+    """
+    stem = os.path.splitext(image_name)[0]
+    return (f"{stem}.txt", f".{stem}_meta.json", f"{image_name}.json", PACK_NAME)
+
+
+def is_manifest(name):
+    return name == MANIFEST_NAME or name == MANIFEST_NAME + '.tmp'
+
+
+def is_sidecar(name):
+    return (os.path.splitext(name)[1] in SIDECAR_EXTS and not is_manifest(name)) or name == PACK_NAME
+
+
+class ScanManifest(logu.Logger):
+    r"""
+    On-disk record of a directory scan, stored as `MANIFEST_NAME` under the scanned root.
+    It records size, mtime and parsed attrs of every image and sidecar file, so that a later scan only lists directories whose mtime changed and only re-reads sidecars that were added, removed or modified.
+    Image files are assumed to be immutable once listed, so files in unchanged directories are not stat'd except for sidecars.
+    """
+
+    def __init__(self, root, exts=IMAGE_EXTS, recur=True, read_types: Literal['txt', 'danbooru'] = None, max_workers=None, verbose=False):
+        self.init_logger(prefix_color=logu.ANSI.BRIGHT_MAGENTA)
+        self.root = Path(root).absolute()
+        self.fp = self.root / MANIFEST_NAME
+        self.exts = set(exts)
+        self.recur = recur
+        self.read_types = [read_types] if isinstance(read_types, str) else read_types
+        self.max_workers = max_workers
+        self.verbose = verbose
+        self._dirs = {}
+        self._changed = False
+        self.load()
+
+    def _header(self):
+        return {
+            'version': MANIFEST_VERSION,
+            'exts': sorted(self.exts),
+            'recur': self.recur,
+            'read_types': self.read_types,
+        }
+
+    def load(self):
+        if not self.fp.is_file():
+            return
+        try:
+            manifest = json_utils.load(self.fp)
+        except (ValueError, OSError):
+            self.log(f"invalid manifest `{logu.yellow(self.fp)}`, rescanning.")
+            return
+        if manifest.get('header') != self._header():  # scanned with different settings
+            return
+        self._dirs = manifest.get('dirs', {})
+
+    def save(self):
+        if not self._changed:
+            return
+        manifest = {'header': self._header(), 'dirs': self._dirs}
+        tmp_fp = self.fp.with_name(self.fp.name + '.tmp')
+        json_utils.dump(manifest, tmp_fp)
+        os.replace(tmp_fp, self.fp)
+        self._changed = False
+
+    def _scan_dir(self, rel, read_attrs, lazy):
+        r"""
+        Scan one directory, reusing the old entry where possible. Return the new entry.
+        """
+        dirpath = os.path.join(self.root, rel) if rel else str(self.root)
+        mtime = os.stat(dirpath).st_mtime_ns
+        old = self._dirs.get(rel)
+        changed = False
+
+        if old is not None and old['mtime'] == mtime:  # listing unchanged
+            subdirs = old['subdirs']
+            files = dict(old['files'])
+            for name, stat in files.items():
+                if is_sidecar(name):  # sidecars may be modified in place
+                    try:
+                        st = os.stat(os.path.join(dirpath, name))
+                        files[name] = [st.st_size, st.st_mtime_ns]
+                    except OSError:
+                        files[name] = None
+                        changed = True
+            files = {name: stat for name, stat in files.items() if stat is not None}
+        else:
+            subdirs, files = [], {}
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            if self.recur and not entry.is_symlink():
+                                subdirs.append(entry.name)
+                            continue
+                        if is_manifest(entry.name):
+                            continue
+                        ext = os.path.splitext(entry.name)[1]
+                        if ext in self.exts or is_sidecar(entry.name):
+                            st = entry.stat()
+                            files[entry.name] = [st.st_size, st.st_mtime_ns]
+                    except OSError:
+                        continue
+            # saving the manifest touches the root directory, so only a different listing counts as a change
+            changed = old is None or old['subdirs'] != subdirs
+
+        old_attrs = old['attrs'] if old is not None else {}
+        attrs = {}
+        for name in files:
+            if os.path.splitext(name)[1] not in self.exts:
+                continue
+            sig = [files.get(sidecar) for sidecar in sidecar_names(name)]
+            cached = old_attrs.get(name)
+            if cached is not None and cached['sig'] == sig and (not read_attrs or (cached['attrs'] is not False and (lazy or not is_lazy(cached['attrs'])))):
+                attrs[name] = cached
+                continue
+            if read_attrs:
+                image_attrs = read_attrs_dict(os.path.join(dirpath, name), types=self.read_types, lazy=lazy)
+            else:
+                image_attrs = False  # not read yet
+            attrs[name] = {'sig': sig, 'attrs': image_attrs}
+            changed = True
+
+        if changed or old is None or old['files'] != files:
+            self._changed = True
+        return {'mtime': mtime, 'subdirs': subdirs, 'files': files, 'attrs': attrs}
+
+    def scan(self, read_attrs=False, lazy=False) -> List[Tuple[str, dict]]:
+        r"""
+        Scan the root directory incrementally and return a list of `(image_path, attrs)` in top-down order.
+        `attrs` is None if the image has no readable attributes or `read_attrs` is False.
+        :param lazy: Don't read captions of txt sidecars and caption packs that the manifest doesn't hold yet, and mark them `LAZY_READING` instead, the same as `read_attrs`.
+            Captions held by the manifest are returned as they are.
+        """
+        dirs = {}
+        with cf.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._scan_dir, '', read_attrs, lazy): ''}
+            while futures:
+                done, _ = cf.wait(futures, return_when=cf.FIRST_COMPLETED)
+                for future in done:
+                    rel = futures.pop(future)
+                    dirs[rel] = future.result()
+                    for subdir in dirs[rel]['subdirs']:
+                        subrel = os.path.join(rel, subdir) if rel else subdir
+                        futures[executor.submit(self._scan_dir, subrel, read_attrs, lazy)] = subrel
+
+        if dirs.keys() != self._dirs.keys():  # directories added or removed
+            self._changed = True
+        self._dirs = dirs
+
+        results = []
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            entry = dirs[rel]
+            dirpath = os.path.join(self.root, rel) if rel else str(self.root)
+            for name, cached in entry['attrs'].items():
+                results.append((os.path.join(dirpath, name), cached['attrs'] if read_attrs else None))
+            stack.extend(reversed([os.path.join(rel, subdir) if rel else subdir for subdir in entry['subdirs']]))
+        return results
+
+
+def is_lazy(attrs):
+    r"""
+    Whether `attrs` of the manifest has a caption that was not read.
+    """
+    return attrs is not None and attrs is not False and is_lazy_reading(attrs.get('caption'))
+
+
+def read_attrs_dict(image_path, types=None, lazy=False):
+    r"""
+    Read attrs of an image from its sidecars as a json-serializable dict, or None if there are no attrs.
+    :param lazy: Mark captions of txt sidecars and caption packs as `LAZY_READING` instead of reading them.
+    """
+    try:
+        attrs = read_attrs(ImageInfo(image_path), types=types, lazy=lazy)
+    except Exception as e:
+        print(f"failed to read attrs for {image_path}: {e}")
+        return None
+    if not attrs:
+        return None
+    return {attr: jsonize(value) for attr, value in attrs.items() if attr in ImageInfo._self_attrs and attr != 'image_path'}
@@ -0,0 +1,65 @@
+import os
+import itertools
+import concurrent.futures as cf
+from collections import deque
+from typing import Callable, Iterable, Iterator, Literal
+
+
+def _apply_chunk(func, chunk, args, kwargs):
+    return [func(image_info, *args, **kwargs) for image_info in chunk]
+
+
+def _chunked(iterable: Iterable, chunk_size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, chunk_size)):
+        yield chunk
+
+
+def iter_map(
+    func: Callable,
+    iterable: Iterable,
+    args=(),
+    kwargs=None,
+    executor: Literal['thread', 'process'] = 'thread',
+    max_workers=None,
+    chunk_size=None,
+    max_in_flight=None,
+    callback: Callable[[int], None] = None,
+) -> Iterator:
+    r"""
+    Map `func` over `iterable` in a thread or process pool and yield the results in input order.
+    Inputs are consumed lazily and at most `max_in_flight` chunks are pending at any time, so memory stays flat on large datasets.
+    :param executor: 'thread' or 'process'. With 'process', `func` and the items must be picklable, e.g. `func` must be defined at module level.
+    :param chunk_size: Number of items per task. Defaults to 1 for threads and to 256 for processes, which amortizes pickling.
+    :param max_in_flight: Max number of pending chunks. Defaults to 4 times the number of workers.
+    :param callback: Called with the number of items of each finished chunk, e.g. to update a progress bar.
+    """
+    kwargs = kwargs or {}
+    max_workers = max_workers or os.cpu_count() or 1
+    chunk_size = chunk_size or (256 if executor == 'process' else 1)
+    max_in_flight = max_in_flight or max_workers * 4
+    if executor == 'process':
+        pool = cf.ProcessPoolExecutor(max_workers=max_workers)
+    elif executor == 'thread':
+        pool = cf.ThreadPoolExecutor(max_workers=max_workers)
+    else:
+        raise ValueError(f"executor must be 'thread' or 'process', but got {executor}")
+
+    with pool:
+        pending = deque()
+        try:
+            for chunk in _chunked(iterable, chunk_size):
+                if len(pending) >= max_in_flight:
+                    results = pending.popleft().result()
+                    if callback is not None:
+                        callback(len(results))
+                    yield from results
+                pending.append(pool.submit(_apply_chunk, func, chunk, args, kwargs))
+            while pending:
+                results = pending.popleft().result()
+                if callback is not None:
+                    callback(len(results))
+                yield from results
+        finally:
+            for future in pending:
+                future.cancel()
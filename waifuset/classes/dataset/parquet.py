@@ -0,0 +1,137 @@
+from pathlib import Path
+from typing import List, Iterator
+from ..data import ImageInfo
+from ..caption import captionize
+
+PARQUET_COLUMNS = (
+    'image_key',
+    'image_path',
+    'category',
+    'caption',
+    'description',
+    'original_width',
+    'original_height',
+    'aesthetic_score',
+    'safe_level',
+    'safe_rating',
+    'perceptual_hash',
+    'artist',
+    'characters',
+    'styles',
+    'quality',
+)
+
+# columns of multiple values, stored as lists so that readers can match single values
+LIST_COLUMNS = ('characters', 'styles')
+
+
+def get_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('image_key', pa.string()),
+        ('image_path', pa.string()),
+        ('category', pa.dictionary(pa.int32(), pa.string())),
+        ('caption', pa.string()),
+        ('description', pa.string()),
+        ('original_width', pa.int32()),
+        ('original_height', pa.int32()),
+        ('aesthetic_score', pa.float64()),
+        ('safe_level', pa.dictionary(pa.int8(), pa.string())),
+        ('safe_rating', pa.float64()),
+        ('perceptual_hash', pa.string()),
+        ('artist', pa.string()),
+        ('characters', pa.list_(pa.string())),
+        ('styles', pa.list_(pa.string())),
+        ('quality', pa.dictionary(pa.int8(), pa.string())),
+    ])
+
+
+def info2record(image_key, image_info: ImageInfo):
+    info_dict = image_info.dict()
+    original_size = info_dict['original_size']
+    width, height = original_size if original_size else (None, None)
+    return {
+        'image_key': image_key,
+        'image_path': info_dict['image_path'],
+        'category': image_info.category,
+        'caption': info_dict['caption'],
+        'description': info_dict['description'],
+        'original_width': width,
+        'original_height': height,
+        'aesthetic_score': info_dict['aesthetic_score'],
+        'safe_level': info_dict['safe_level'],
+        'safe_rating': info_dict['safe_rating'],
+        'perceptual_hash': info_dict['perceptual_hash'],
+        'artist': info_dict['artist'],
+        'characters': list(image_info.characters) if info_dict['characters'] else None,
+        'styles': list(image_info.styles) if info_dict['styles'] else None,
+        'quality': info_dict['quality'],
+    }
+
+
+def record2info(record) -> ImageInfo:
+    width, height = record.pop('original_width', None), record.pop('original_height', None)
+    if width is not None and height is not None:
+        record['original_size'] = (width, height)
+    for name in LIST_COLUMNS:  # files written before list columns store strings
+        if isinstance(record.get(name), list):
+            record[name] = captionize(record[name])
+    return ImageInfo(**{k: v for k, v in record.items() if k in ImageInfo._all_attrs})
+
+
+def iter_parquet_batches(fp, columns: List[str] = None, filters=None, where=None, batch_size=65536) -> Iterator:
+    r"""
+    Iterate over `pyarrow.RecordBatch`es of a parquet database with column projection and row-group filtering.
+    :param columns: Columns to read. If None, reads all columns.
+    :param filters: Row filters in the DNF format of `pyarrow.parquet.read_table`, e.g. `[('aesthetic_score', '>=', 6)]`. Row groups whose statistics don't match are skipped without being read.
+    :param where: A `Where` filter, which is combined with `filters`.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as pads
+    import pyarrow.parquet as pq
+    dataset = pads.dataset(str(fp), format='parquet')
+    filter_expr = pq.filters_to_expression(filters) if filters else None
+    if where is not None:
+        list_fields = {field.name for field in dataset.schema if pa.types.is_list(field.type)}
+        where_expr = where.arrow_expression(list_fields=list_fields)
+        filter_expr = where_expr if filter_expr is None else filter_expr & where_expr
+    yield from dataset.to_batches(columns=list(columns) if columns is not None else None, filter=filter_expr, batch_size=batch_size)
+
+
+def read_parquet(fp, columns: List[str] = None, filters=None):
+    r"""
+    Read a parquet database as a `pyarrow.Table` without building `ImageInfo` objects, e.g. `read_parquet(fp, columns=['aesthetic_score', 'category']).to_pandas()` for statistics.
+    """
+    import pyarrow as pa
+    batches = list(iter_parquet_batches(fp, columns=columns, filters=filters))
+    if not batches:
+        schema = get_schema()
+        return pa.Table.from_batches([], schema=schema if columns is None else pa.schema([schema.field(c) for c in columns]))
+    return pa.Table.from_batches(batches)
+
+
+def dump_as_parquet(source, fp, row_group_size=65536, compression='zstd', verbose=False):
+    r"""
+    Write a dataset to a parquet file, streaming one row group at a time instead of building the full DataFrame.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from .dataset import Dataset
+    dataset = Dataset(source) if not isinstance(source, Dataset) else source
+    schema = get_schema()
+    Path(fp).parent.mkdir(parents=True, exist_ok=True)
+
+    def write_group(writer, records):
+        columns = {name: [record[name] for record in records] for name in PARQUET_COLUMNS}
+        table = pa.Table.from_pydict(columns, schema=schema)
+        writer.write_table(table, row_group_size=row_group_size)
+
+    with pq.ParquetWriter(str(fp), schema, compression=compression) as writer:
+        records = []
+        for image_key, image_info in dataset.pbar(dataset.items(), desc='dumping to parquet', smoothing=1, disable=not verbose):
+            records.append(info2record(image_key, image_info))
+            if len(records) >= row_group_size:
+                write_group(writer, records)
+                records = []
+        if records:
+            write_group(writer, records)
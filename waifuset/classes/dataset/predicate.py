@@ -0,0 +1,233 @@
+import os
+import re
+import operator
+from typing import Any, Dict, List, Tuple, Union
+from ..data import ImageInfo
+
+# fields that can be filtered on, i.e. the columns of the tabular databases
+FIELDS = (
+    'image_key',
+    'image_path',
+    'category',
+    'caption',
+    'description',
+    'original_width',
+    'original_height',
+    'aesthetic_score',
+    'safe_level',
+    'safe_rating',
+    'perceptual_hash',
+    'artist',
+    'characters',
+    'styles',
+    'quality',
+)
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda value, values: value in values,
+    'not in': lambda value, values: value not in values,
+}
+
+_SIZE_PATTERN = re.compile(r'(\d+)\D+(\d+)')
+
+
+def _parse_size(size):
+    if size is None or isinstance(size, float):  # NaN of csv
+        return None
+    if isinstance(size, str):
+        match = _SIZE_PATTERN.search(size)
+        return (int(match.group(1)), int(match.group(2))) if match else None
+    return tuple(size)
+
+
+def _category_of(image_path):
+    return os.path.basename(os.path.dirname(os.path.abspath(image_path))) if image_path else None
+
+
+def parse_condition(condition) -> Tuple[str, Any]:
+    r"""
+    Normalize a condition of a `where` dict into `(op, value)`, see `Where`.
+    """
+    if isinstance(condition, tuple) and len(condition) == 2 and isinstance(condition[0], str) and condition[0] in OPERATORS:
+        op, value = condition
+    elif isinstance(condition, (list, tuple, set, frozenset)):
+        op, value = 'in', condition
+    else:
+        op, value = '==', condition
+    if op in ('in', 'not in'):
+        value = list(value)
+    return op, value
+
+
+def test_value(value, op, target) -> bool:
+    r"""
+    Test a single value against `(op, target)`. Missing values never satisfy comparisons.
+    """
+    if value is None and op not in ('==', '!=', 'in', 'not in'):
+        return False
+    try:
+        return OPERATORS[op](value, target)
+    except TypeError:
+        return False
+
+
+class Where:
+    r"""
+    Row filter applied when loading a dataset, e.g. `Dataset(src, where={'category': ['cat_a', 'cat_b'], 'aesthetic_score': ('>=', 6)})`.
+    Each field maps to a condition, and all conditions must hold. A condition is one of
+        - `(op, value)`, where `op` is one of `==`, `!=`, `<`, `<=`, `>`, `>=`, `in` and `not in`;
+        - a list, tuple or set of values, i.e. `('in', values)`;
+        - a single value, i.e. `('==', value)`.
+    Missing values only satisfy `== None`, `!= value`, `in` values containing None and `not in` values without None, and never satisfy comparisons.
+    The filter is compiled into the native filters of the csv, parquet and sqlite readers, and matched against raw records of json and jsonl files,
+    so rows that fail it never become `ImageInfo` objects.
+    """
+
+    def __init__(self, where: Union[Dict[str, Any], 'Where']):
+        if isinstance(where, Where):
+            self.clauses = where.clauses
+            return
+        self.clauses: List[Tuple[str, str, Any]] = []
+        for field, condition in where.items():
+            if field not in FIELDS:
+                raise ValueError(f"cannot filter on `{field}`, expected one of {FIELDS}")
+            self.clauses.append((field, *parse_condition(condition)))
+
+    @property
+    def fields(self):
+        return {field for field, _, _ in self.clauses}
+
+    def match_record(self, image_key, record: dict) -> bool:
+        r"""
+        Match a raw info dict as stored in json and jsonl files.
+        """
+        for field, op, target in self.clauses:
+            if field == 'image_key':
+                value = image_key
+            elif field == 'category':
+                value = _category_of(record.get('image_path'))
+            elif field in ('original_width', 'original_height'):
+                size = _parse_size(record.get('original_size'))
+                value = size[field == 'original_height'] if size else None
+            else:
+                value = record.get(field)
+            if not test_value(value, op, target):
+                return False
+        return True
+
+    def match_info(self, image_key, image_info: ImageInfo) -> bool:
+        r"""
+        Match a loaded `ImageInfo`, with values in the same form as `ImageInfo.dict`.
+        """
+        info_dict = None
+        for field, op, target in self.clauses:
+            if field == 'image_key':
+                value = image_key
+            elif field == 'category':
+                value = image_info.category
+            elif field in ('original_width', 'original_height'):
+                size = image_info.original_size
+                value = size[field == 'original_height'] if size else None
+            else:
+                if info_dict is None:
+                    info_dict = image_info.dict()
+                value = info_dict[field]
+            if not test_value(value, op, target):
+                return False
+        return True
+
+    def csv_columns(self):
+        r"""
+        Columns of a csv database needed to evaluate the filter.
+        """
+        columns = set()
+        for field in self.fields:
+            if field == 'category':
+                columns.add('image_path')
+            elif field in ('original_width', 'original_height'):
+                columns.add('original_size')
+            else:
+                columns.add(field)
+        return columns
+
+    def pandas_mask(self, df):
+        r"""
+        Evaluate the filter on a DataFrame read from a csv database, which stores `original_size` and no category.
+        """
+        import pandas as pd
+        mask = pd.Series(True, index=df.index)
+        for field, op, target in self.clauses:
+            if field == 'category':
+                directories = df['image_path'].map(os.path.dirname, na_action='ignore')
+                column = directories.map({directory: os.path.basename(os.path.abspath(directory)) for directory in directories.dropna().unique()})
+            elif field in ('original_width', 'original_height'):
+                column = df['original_size'].astype(str).str.extract(r'(\d+)\D+(\d+)')[int(field == 'original_height')].astype(float)
+            else:
+                column = df[field]
+            isnull = column.isna()
+            if op in ('in', 'not in'):
+                values = [value for value in target if value is not None]
+                matched = column.isin(values) | (isnull if len(values) < len(target) else False)
+                mask &= matched if op == 'in' else ~matched
+            elif target is None and op in ('==', '!='):
+                mask &= isnull if op == '==' else ~isnull
+            else:
+                mask &= OPERATORS[op](column, target) & (~isnull if op != '!=' else True)
+        return mask.to_numpy(dtype=bool)
+
+    def arrow_expression(self, list_fields=()):
+        r"""
+        Compile the filter into a `pyarrow.compute.Expression` for the parquet reader.
+        :param list_fields: Fields stored as list columns, e.g. `characters`, which are joined into the strings of `ImageInfo.dict` to be matched the same as by other readers.
+        """
+        import pyarrow.compute as pc
+        expression = None
+        for field, op, target in self.clauses:
+            column = pc.binary_join(pc.field(field), ', ') if field in list_fields else pc.field(field)
+            if op in ('in', 'not in'):
+                values = [value for value in target if value is not None]
+                has_null = len(values) < len(target)
+                matched = column.isin(values)
+                if op == 'in':
+                    condition = matched | column.is_null() if has_null else matched
+                else:
+                    condition = ~matched & column.is_valid() if has_null else ~matched | column.is_null()
+            elif target is None and op in ('==', '!='):
+                condition = column.is_null() if op == '==' else column.is_valid()
+            elif op == '!=':
+                condition = (column != target) | column.is_null()
+            else:
+                condition = OPERATORS[op](column, target)
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def sql(self) -> Tuple[str, list]:
+        r"""
+        Compile the filter into a sql condition with `?` placeholders and its parameters, for the sqlite reader.
+        """
+        conditions, params = [], []
+        for field, op, target in self.clauses:
+            if op in ('in', 'not in'):
+                values = [value for value in target if value is not None]
+                has_null = len(values) < len(target)
+                matched = f"{field} IN ({', '.join('?' * len(values))})" if values else '0'
+                if op == 'in':
+                    conditions.append(f"({matched} OR {field} IS NULL)" if has_null else matched)
+                else:
+                    conditions.append(f"(NOT {matched} AND {field} IS NOT NULL)" if has_null else f"(NOT {matched} OR {field} IS NULL)")
+                params.extend(values)
+            elif target is None and op in ('==', '!='):
+                conditions.append(f"{field} IS NULL" if op == '==' else f"{field} IS NOT NULL")
+            elif op == '!=':
+                conditions.append(f"({field} != ? OR {field} IS NULL)")
+                params.append(target)
+            else:
+                conditions.append(f"{field} {'=' if op == '==' else op} ?")
+                params.append(target)
+        return ' AND '.join(conditions) or '1', params
@@ -0,0 +1,61 @@
+import math
+import heapq
+import inspect
+import random
+import itertools
+from typing import Callable, Iterable, List, Sequence, Tuple
+from ..data import ImageInfo
+
+
+def _uniform(rng) -> float:
+    r"""
+    Draw from the open interval (0, 1), so that its logarithm is finite and negative.
+    """
+    u = rng.random()
+    while u == 0.0:
+        u = rng.random()
+    return u
+
+
+def reservoir_sample(iterable: Iterable, n: int, rng: random.Random = random) -> list:
+    r"""
+    Uniformly sample `n` items from an iterable of unknown length in a single pass, keeping only `n` items in memory (Algorithm L).
+    Items between replacements are skipped in geometric jumps, so the random generator is only called about `n * log(N / n)` times.
+    The sampled items are returned in random order, the same as `random.sample`.
+    :param rng: A `random.Random` instance, or the `random` module to use its global generator.
+    """
+    it = iter(iterable)
+    reservoir = list(itertools.islice(it, n)) if n > 0 else []
+    if len(reservoir) == n > 0:
+        w = math.exp(math.log(_uniform(rng)) / n)
+        while w < 1.0:
+            skip = int(math.log(_uniform(rng)) / math.log1p(-w))
+            item = next(itertools.islice(it, skip, None), reservoir)  # the reservoir itself marks the end of the iterable
+            if item is reservoir:
+                break
+            reservoir[rng.randrange(n)] = item
+            w *= math.exp(math.log(_uniform(rng)) / n)
+    rng.shuffle(reservoir)
+    return reservoir
+
+
+def method_kwargs(method: Callable, kwargs: dict) -> dict:
+    r"""
+    Keep the arguments of `kwargs` that `method` accepts.
+    """
+    params = inspect.signature(method).parameters
+    return {k: v for k, v in kwargs.items() if k in params}
+
+
+def heap_top_k(items: Iterable[Tuple[str, ImageInfo]], methods: Sequence[Callable], k: int, reverse=True, **kwargs) -> List[str]:
+    r"""
+    Select the keys of the first `k` items sorted by `methods` in a single pass, keeping a heap of `k` items instead of sorting all of them.
+    The result is the same as the first `k` keys of `sorted(items, key=..., reverse=reverse)`, including the order of ties.
+    """
+    methods = [(method, method_kwargs(method, kwargs)) for method in methods]
+
+    def sort_key(item):
+        return tuple(method(item[1], **kwargs_) for method, kwargs_ in methods)
+
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    return [image_key for image_key, _ in select(k, items, key=sort_key)]
@@ -0,0 +1,378 @@
+import sqlite3
+import threading
+import itertools
+from pathlib import Path
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+from .dataset import Dataset
+from .selection import heap_top_k
+from ..data import ImageInfo
+from ...const import IMAGE_EXTS
+from ...utils import log_utils as logu
+
+SQLITE_EXTS = {'.db', '.sqlite', '.sqlite3'}
+
+# column name -> sql type
+COLUMNS = {
+    'image_key': 'TEXT PRIMARY KEY',
+    'image_path': 'TEXT',
+    'category': 'TEXT',
+    'caption': 'TEXT',
+    'description': 'TEXT',
+    'original_width': 'INTEGER',
+    'original_height': 'INTEGER',
+    'aesthetic_score': 'REAL',
+    'safe_level': 'TEXT',
+    'safe_rating': 'REAL',
+    'perceptual_hash': 'TEXT',
+    'artist': 'TEXT',
+    'characters': 'TEXT',
+    'styles': 'TEXT',
+    'quality': 'TEXT',
+}
+MAX_VARIABLES = 900  # max number of keys per query, below the default limit of sqlite on the parameters of a statement
+INDEXED_COLUMNS = ('category', 'original_width', 'original_height', 'aesthetic_score', 'safe_level', 'safe_rating', 'perceptual_hash', 'artist', 'quality')
+
+
+def info2row(image_key, image_info: ImageInfo):
+    info_dict = image_info.dict()
+    original_size = info_dict['original_size']
+    width, height = original_size if original_size else (None, None)
+    return (
+        image_key,
+        info_dict['image_path'],
+        image_info.category,
+        info_dict['caption'],
+        info_dict['description'],
+        width,
+        height,
+        info_dict['aesthetic_score'],
+        info_dict['safe_level'],
+        info_dict['safe_rating'],
+        info_dict['perceptual_hash'],
+        info_dict['artist'],
+        info_dict['characters'],
+        info_dict['styles'],
+        info_dict['quality'],
+    )
+
+
+def row2info(row) -> ImageInfo:
+    (_, image_path, _, caption, description, width, height, aesthetic_score, safe_level, safe_rating, perceptual_hash, artist, characters, styles, quality) = row
+    return ImageInfo(
+        image_path=image_path,
+        caption=caption,
+        description=description,
+        original_size=(width, height) if width is not None and height is not None else None,
+        aesthetic_score=aesthetic_score,
+        safe_level=safe_level,
+        safe_rating=safe_rating,
+        perceptual_hash=perceptual_hash,
+        artist=artist,
+        characters=characters,
+        styles=styles,
+        quality=quality,
+    )
+
+
+class _RowsView:
+    r"""
+    Sized iterable over the rows of a table, materialized by `func`.
+    """
+
+    def __init__(self, storage, func):
+        self._storage = storage
+        self._func = func
+
+    def __len__(self):
+        return len(self._storage)
+
+    def __iter__(self):
+        for row in self._storage._select_all():
+            yield self._func(row)
+
+
+class SQLiteStorage(MutableMapping):
+    r"""
+    Mapping from image key to `ImageInfo` stored in a SQLite table, one row per image key.
+    `ImageInfo` objects are materialized lazily on access. The `cache_size` most recently fetched by `__getitem__` or iterated by `items`, `values`, `select` and `get_many`
+    are kept in an LRU with a snapshot of their rows, so that in-place edits of them can be written back: edited objects are written when they are evicted or by `commit`,
+    and unedited ones are never rewritten. Iteration only evicts before it reads the next page of rows, so that pages never miss write-backs and the cache may hold a page more.
+    """
+
+    def __init__(self, fp, table='metadata', cache_size=4096):
+        self.fp = Path(fp).absolute()
+        self.fp.parent.mkdir(parents=True, exist_ok=True)
+        self.table = table
+        self._conn = sqlite3.connect(str(self.fp), isolation_level=None, check_same_thread=False)
+        self._lock = threading.RLock()
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()  # image_key -> (image_info, row when fetched)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ({', '.join(f'{name} {sqltype}' for name, sqltype in COLUMNS.items())})")
+            for name in INDEXED_COLUMNS:
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_{name} ON {self.table} ({name})")
+        self._upsert_sql = (
+            f"INSERT INTO {self.table} ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+            f"ON CONFLICT(image_key) DO UPDATE SET {', '.join(f'{name}=excluded.{name}' for name in COLUMNS if name != 'image_key')}"
+        )
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def _select_all(self, page_size=1024, condition='1', params=()):
+        # paginate by rowid so that no cursor or lock is held between pages
+        last_rowid = -1
+        while True:
+            self._evict()  # write back edits of the previous page before reading the next one
+            rows = self.execute(f"SELECT rowid, {', '.join(COLUMNS)} FROM {self.table} WHERE rowid > ? AND ({condition}) ORDER BY rowid LIMIT ?", (last_rowid, *params, page_size)).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+            for row in rows:
+                yield row[1:]
+
+    def _materialize(self, row):
+        r"""
+        Get the `ImageInfo` of a row, which is the cached one if the key is cached, otherwise a new one that is put into the cache. Call `_evict` to bound the cache.
+        """
+        image_key = row[0]
+        with self._lock:
+            if (cached := self._cache.get(image_key)) is not None:
+                self._cache.move_to_end(image_key)
+                return cached[0]
+            image_info = row2info(row)
+            self._cache[image_key] = (image_info, info2row(image_key, image_info))
+        return image_info
+
+    def _evict(self):
+        r"""
+        Evict the least recently used image infos that exceed `cache_size`, writing back the edited ones.
+        """
+        with self._lock:
+            if len(self._cache) > self.cache_size:
+                self._write_back([self._cache.popitem(last=False) for _ in range(len(self._cache) - self.cache_size)])
+
+    def __getitem__(self, image_key):
+        with self._lock:
+            if (cached := self._cache.get(image_key)) is not None:
+                self._cache.move_to_end(image_key)
+                return cached[0]
+        row = self.execute(f"SELECT {', '.join(COLUMNS)} FROM {self.table} WHERE image_key=?", (image_key,)).fetchone()
+        if row is None:
+            raise KeyError(image_key)
+        image_info = self._materialize(row)
+        self._evict()
+        return image_info
+
+    def _select_keys(self, columns, image_keys: Iterable[str]) -> List[tuple]:
+        r"""
+        Select `columns` of the rows of `image_keys` in batches of `MAX_VARIABLES` keys per query, in no particular order.
+        """
+        image_keys = list(image_keys)
+        rows = []
+        for i in range(0, len(image_keys), MAX_VARIABLES):
+            batch = image_keys[i:i + MAX_VARIABLES]
+            rows.extend(self.execute(f"SELECT {columns} FROM {self.table} WHERE image_key IN ({', '.join('?' * len(batch))})", batch).fetchall())
+        return rows
+
+    def contains_many(self, image_keys: Iterable[str]) -> Set[str]:
+        r"""
+        Get the keys of `image_keys` that are in the table, with one query per batch of keys instead of one per key.
+        """
+        return {row[0] for row in self._select_keys('image_key', image_keys)}
+
+    def get_many(self, image_keys: Iterable[str]) -> Dict[str, ImageInfo]:
+        r"""
+        Get the image infos of `image_keys` that are in the table, with one query per batch of keys instead of one per key.
+        All of them are kept in the cache until the next read, so that they can be edited in place.
+        """
+        self._evict()
+        return {row[0]: self._materialize(row) for row in self._select_keys(', '.join(COLUMNS), image_keys)}
+
+    def _write_back(self, cached_items):
+        r"""
+        Write the cached `(image_key, (image_info, row))` items whose image infos were edited in place since they were fetched.
+        """
+        dirty = [(image_key, image_info) for image_key, (image_info, row) in cached_items if info2row(image_key, image_info) != row]
+        if dirty:
+            self.update(dirty)
+
+    def __setitem__(self, image_key, image_info):
+        with self._lock:
+            self._conn.execute(self._upsert_sql, info2row(image_key, image_info))
+            self._cache.pop(image_key, None)
+
+    def __delitem__(self, image_key):
+        with self._lock:
+            cursor = self._conn.execute(f"DELETE FROM {self.table} WHERE image_key=?", (image_key,))
+            self._cache.pop(image_key, None)
+        if cursor.rowcount == 0:
+            raise KeyError(image_key)
+
+    def pop(self, image_key, default=None):
+        try:
+            image_info = self[image_key]
+        except KeyError:
+            return default
+        del self[image_key]
+        return image_info
+
+    def __contains__(self, image_key):
+        return self.execute(f"SELECT 1 FROM {self.table} WHERE image_key=?", (image_key,)).fetchone() is not None
+
+    def __iter__(self):
+        return iter([row[0] for row in self.execute(f"SELECT image_key FROM {self.table} ORDER BY rowid").fetchall()])
+
+    def __len__(self):
+        return self.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def items(self):
+        return _RowsView(self, lambda row: (row[0], self._materialize(row)))
+
+    def values(self):
+        return _RowsView(self, self._materialize)
+
+    def select(self, where) -> Iterator[Tuple[str, ImageInfo]]:
+        r"""
+        Iterate over the items whose rows match a `Where` filter, which is evaluated by sqlite so that other rows are never materialized.
+        """
+        condition, params = where.sql()
+        for row in self._select_all(condition=condition, params=params):
+            yield row[0], self._materialize(row)
+
+    def update(self, other=(), **kwargs):
+        items = other.items() if hasattr(other, 'items') else other
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                for image_key, image_info in itertools.chain(items, kwargs.items()):
+                    self._conn.execute(self._upsert_sql, info2row(image_key, image_info))
+                    self._cache.pop(image_key, None)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def delete(self, image_keys):
+        r"""
+        Delete several keys in a single transaction.
+        """
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(f"DELETE FROM {self.table} WHERE image_key=?", ((image_key,) for image_key in image_keys))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            for image_key in image_keys:
+                self._cache.pop(image_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._cache.clear()
+
+    def commit(self):
+        r"""
+        Write back cached `ImageInfo` objects that were edited in place, and clear the cache.
+        """
+        with self._lock:
+            cache, self._cache = self._cache, OrderedDict()
+            self._write_back(cache.items())
+
+    def close(self):
+        self.commit()
+        with self._lock:
+            self._conn.close()
+
+    def __repr__(self):
+        return f"SQLiteStorage({self.fp})"
+
+
+class SQLiteDataset(Dataset):
+    r"""
+    Dataset stored in a local SQLite file.
+    Opening it costs constant time since nothing is loaded until accessed, and `__setitem__`, `pop` and `update` are single-row SQL operations instead of rewriting the whole database.
+    Call `commit` to persist in-place edits of fetched or iterated `ImageInfo` objects, e.g. `for image_key, image_info in dataset.items(): image_info.caption = ...`.
+    Edits are kept in a cache of `cache_size` image infos, whose least recently used ones are written back when it is full.
+    An image info that leaves the cache before it is edited, e.g. one of a list of more than `cache_size` image infos, is detached and its later edits are lost, so edit image infos while iterating.
+    """
+
+    def __init__(self, fp, source=None, table='metadata', cache_size=4096, exts=IMAGE_EXTS, verbose=False, **kwargs):
+        self.init_logger(prefix_color=logu.ANSI.BRIGHT_MAGENTA)
+        self.verbose = verbose
+        self.exts = exts
+        self._data = SQLiteStorage(fp, table=table, cache_size=cache_size)
+        if source is not None:
+            self._data.update(Dataset(source, exts=exts, verbose=verbose, **kwargs).items())
+
+    @property
+    def fp(self):
+        return self._data.fp
+
+    def _subset_of_keys(self, keys, cls=None, *args, **kwargs):
+        return super()._subset_of_keys(keys, cls or Dataset, *args, **kwargs)
+
+    def update(self, other, recur=False):
+        other = Dataset(other, recur=recur)
+        self._data.update(other.items())
+        self._changed()
+        return self
+
+    def values(self):
+        return self._data.values()  # lazily, so that image infos are edited before they leave the cache
+
+    def commit(self):
+        self._data.commit()
+
+    def close(self):
+        self._data.close()
+
+    def copy(self):
+        return Dataset({image_key: image_info.copy() for image_key, image_info in self.items()})
+
+    def sort(self, *args, **kwargs):
+        raise TypeError(f"{type(self).__name__} keeps the insertion order of its table and cannot be sorted in place, use `top_k` to get the first images by sorting methods, or sort an in-memory subset made by `make_subset`.")
+
+    sort_keys = sort_by = sort
+
+    def _top_k_keys(self, methods, k, reverse, kwargs):
+        return heap_top_k(self.items(), methods, k, reverse=reverse, **kwargs)  # a single pass instead of building the column cache
+
+    def __iadd__(self, other):
+        self._data.update(other.items())
+        self._changed()
+        return self
+
+    def __iand__(self, other):
+        self._data.delete([image_key for image_key in self.keys() if image_key not in other])
+        self._changed()
+        return self
+
+    def __ior__(self, other):
+        self._data.update((image_key, image_info) for image_key, image_info in other.items() if image_key not in self)
+        self._changed()
+        return self
+
+    def __isub__(self, other):
+        self._data.delete([image_key for image_key in self.keys() if image_key in other])
+        self._changed()
+        return self
+
+    def __repr__(self):
+        return repr(self._data)
+
+
+def dump_as_sqlite(source, fp, mode='a', verbose=False):
+    dataset = Dataset(source) if not isinstance(source, Dataset) else source
+    storage = SQLiteStorage(fp)
+    if mode == 'w':
+        storage.clear()
+    storage.update(dataset.items())
+    storage.close()
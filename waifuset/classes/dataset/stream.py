@@ -0,0 +1,114 @@
+import itertools
+from collections import deque
+from pathlib import Path
+from tqdm import tqdm
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Literal, Tuple, Union
+from ..data import ImageInfo
+from .parallel import iter_map
+from ...utils.file_utils import split_compression_suffix
+
+if TYPE_CHECKING:
+    from .dataset import Dataset
+
+
+class Stream:
+    r"""
+    Lazy pipeline over the `(image_key, image_info)` items of a dataset, e.g.
+    `dataset.stream().filter(cond).map(func, max_workers=8, executor='process').batch(1000).sink('out.jsonl')`.
+    Nothing runs until the stream is iterated or sunk. Items flow through one at a time, so a transform never holds a full copy of the dataset.
+    """
+
+    def __init__(self, items: Iterable[Tuple[str, ImageInfo]], batch_size: int = None, total: int = None):
+        self._items = items
+        self._batch_size = batch_size
+        self._total = total
+
+    def filter(self, condition: Callable[[ImageInfo], bool]) -> 'Stream':
+        r"""
+        Keep the items whose image infos match `condition`. The number of items is unknown after filtering, so the progress bar of `sink` shows no total.
+        """
+        return Stream(((image_key, image_info) for image_key, image_info in self._items if condition(image_info)), batch_size=self._batch_size)
+
+    def map(self, func: Callable[[ImageInfo], ImageInfo], *args, max_workers=1, executor: Literal['thread', 'process'] = 'thread', chunk_size=None, max_in_flight=None, copy=True, **kwargs) -> 'Stream':
+        r"""
+        Map `func` over the image infos. Items whose result is None are dropped.
+        With `max_workers > 1` or `executor='process'`, `func` runs in a pool with at most `max_in_flight` pending chunks, see `iter_map`.
+        :param copy: Whether to pass a copy of each image info to `func`, see `Dataset.apply_map`.
+        """
+        return Stream(self._iter_map(func, args, kwargs, max_workers, executor, chunk_size, max_in_flight, copy), batch_size=self._batch_size, total=self._total)
+
+    def _iter_map(self, func, args, kwargs, max_workers, executor, chunk_size, max_in_flight, copy):
+        if max_workers == 1 and executor == 'thread':
+            for image_key, image_info in self._items:
+                if (image_info := func(image_info.copy() if copy else image_info, *args, **kwargs)) is not None:
+                    yield image_key, image_info
+            return
+        image_keys = deque()
+
+        def iter_infos():  # the pool consumes inputs ahead of the results, so queue up their keys
+            for image_key, image_info in self._items:
+                image_keys.append(image_key)
+                yield image_info.copy() if copy and executor == 'thread' else image_info
+
+        for image_info in iter_map(func, iter_infos(), args=args, kwargs=kwargs, executor=executor, max_workers=max_workers, chunk_size=chunk_size, max_in_flight=max_in_flight):
+            image_key = image_keys.popleft()
+            if image_info is not None:
+                yield image_key, image_info
+
+    def batch(self, batch_size: int) -> 'Stream':
+        r"""
+        Group the items into datasets of `batch_size` when iterating, and write them to sinks batch by batch.
+        """
+        return Stream(self._items, batch_size=batch_size, total=self._total)
+
+    def batches(self, batch_size: int = None) -> Iterator:
+        from .dataset import Dataset
+        batch_size = batch_size or self._batch_size or 1
+        iterator = iter(self._items)
+        while batch := dict(itertools.islice(iterator, batch_size)):
+            yield Dataset(batch)
+
+    def __iter__(self):
+        if self._batch_size is not None:
+            return self.batches()
+        return iter(self._items)
+
+    def sink(self, target: Union[str, Path, Callable, 'Dataset'], verbose=False):
+        r"""
+        Run the stream and write its items to `target` batch by batch.
+        :param target: One of
+            - a `Dataset`, which is updated with the items and returned;
+            - a path to a jsonl journal, which the items are appended to, possibly compressed, e.g. `out.jsonl.zst`, see `open_file`;
+            - 'txt', to write the captions to txt files next to the images;
+            - a function, which is called with every batch as a `Dataset`.
+        """
+        from .dataset import Dataset
+        from .journal import dump_as_jsonl
+        if isinstance(target, Dataset):
+            write = target.update
+        elif callable(target):
+            write = target
+        elif target == 'txt':
+            def write(batch):
+                for image_info in batch.values():
+                    image_info.image_path.parent.mkdir(parents=True, exist_ok=True)
+                    image_info.write_txt_caption()
+        elif split_compression_suffix(target)[0] == '.jsonl':
+            def write(batch):
+                dump_as_jsonl(batch, target)
+        else:
+            raise ValueError(f"unsupported sink: {target}")
+
+        pbar = tqdm(total=self._total, desc='sinking stream', smoothing=1, disable=not verbose)
+        for batch in self.batches(self._batch_size or 1024):
+            write(batch)
+            pbar.update(len(batch))
+        pbar.close()
+        return target if isinstance(target, Dataset) else None
+
+    def collect(self, **kwargs) -> 'Dataset':
+        r"""
+        Run the stream into a new dataset.
+        """
+        from .dataset import Dataset
+        return self.sink(Dataset(**kwargs))
@@ -0,0 +1,166 @@
+from collections.abc import MutableMapping
+from typing import List, Iterable
+
+
+class _ItemsView:
+    def __init__(self, view, with_keys=True):
+        self._view = view
+        self._with_keys = with_keys
+
+    def __len__(self):
+        return len(self._view)
+
+    def __iter__(self):
+        view = self._view
+        if view._own is not None:
+            return iter(view._own.items() if self._with_keys else view._own.values())
+        return view._iter_items() if self._with_keys else (value for _, value in view._iter_items())
+
+
+class DatasetView(MutableMapping):
+    r"""
+    Copy-on-write view of the storage of one or more datasets, used as the `_data` of subsets.
+    It only keeps references to the parent storages and a list of keys, so building a subset is just a filter pass.
+    Values are looked up in `parents` in order, i.e. the first parent that contains a key wins.
+    Reading follows the current state of the parents: edited values show through and keys removed from all parents are skipped.
+    The first write copies the live items into a private dict, after which the view is independent of its parents.
+    Parents with `contains_many` and `get_many`, e.g. `SQLiteStorage`, are looked up in batches of keys instead of key by key.
+    """
+
+    def __init__(self, parents: Iterable[MutableMapping], keys: List[str]):
+        self._parents = tuple(parent._own if isinstance(parent, DatasetView) and parent._own is not None else parent for parent in parents)
+        self._keys = keys
+        self._keyset = None
+        self._len_cache = None
+        self._own = None
+
+    def _lookup(self, key):
+        for parent in self._parents:
+            if key in parent:
+                return parent[key]
+        raise KeyError(key)
+
+    def _is_live(self, key):
+        return any(key in parent for parent in self._parents)
+
+    def _is_batched(self):
+        return any(hasattr(parent, 'get_many') for parent in self._parents)
+
+    def _count_live(self, batch_size=4096):
+        if not self._is_batched():
+            return sum(1 for key in self._keys if self._is_live(key))
+        count = 0
+        for i in range(0, len(self._keys), batch_size):
+            keys = self._keys[i:i + batch_size]
+            live = set()
+            for parent in self._parents:
+                live.update(parent.contains_many(keys) if hasattr(parent, 'contains_many') else (key for key in keys if key in parent))
+            count += len(live)
+        return count
+
+    def _iter_items_batched(self, batch_size=4096):
+        for i in range(0, len(self._keys), batch_size):
+            keys = self._keys[i:i + batch_size]
+            found = {}
+            for parent in self._parents:  # the first parent that contains a key wins
+                missing = [key for key in keys if key not in found]
+                if not missing:
+                    break
+                found.update(parent.get_many(missing) if hasattr(parent, 'get_many') else ((key, parent[key]) for key in missing if key in parent))
+            for key in keys:
+                if key in found:
+                    yield key, found[key]
+
+    def _iter_items(self):
+        parents = self._parents
+        if self._is_batched():
+            yield from self._iter_items_batched()
+        elif len(parents) == 1:
+            parent = parents[0]
+            for key in self._keys:
+                if key in parent:
+                    yield key, parent[key]
+        else:
+            for key in self._keys:
+                for parent in parents:
+                    if key in parent:
+                        yield key, parent[key]
+                        break
+
+    def _materialize(self):
+        if self._own is None:
+            self._own = dict(self._iter_items())
+            self._parents = self._keys = self._keyset = self._len_cache = None
+        return self._own
+
+    @property
+    def is_materialized(self):
+        return self._own is not None
+
+    def reordered(self, keys: List[str]) -> 'DatasetView':
+        r"""
+        Make a view of the same parents with `keys`, e.g. the keys of this view in another order. The view must not be materialized.
+        """
+        return DatasetView(self._parents, keys)
+
+    def __getitem__(self, key):
+        if self._own is not None:
+            return self._own[key]
+        if self._keyset is None:
+            self._keyset = set(self._keys)
+        if key not in self._keyset:
+            raise KeyError(key)
+        return self._lookup(key)
+
+    def __contains__(self, key):
+        if self._own is not None:
+            return key in self._own
+        if self._keyset is None:
+            self._keyset = set(self._keys)
+        return key in self._keyset and self._is_live(key)
+
+    def __iter__(self):
+        if self._own is not None:
+            return iter(self._own)
+        return (key for key, _ in self._iter_items())
+
+    def __len__(self):
+        if self._own is not None:
+            return len(self._own)
+        signature = tuple(len(parent) for parent in self._parents)  # recount only if the parents were resized
+        if self._len_cache is None or self._len_cache[0] != signature:
+            self._len_cache = (signature, self._count_live())
+        return self._len_cache[1]
+
+    def items(self):
+        return _ItemsView(self, with_keys=True)
+
+    def values(self):
+        return _ItemsView(self, with_keys=False)
+
+    # writes, copy on first write
+
+    def __setitem__(self, key, value):
+        self._materialize()[key] = value
+
+    def __delitem__(self, key):
+        del self._materialize()[key]
+
+    def pop(self, key, *default):
+        return self._materialize().pop(key, *default)
+
+    def popitem(self):
+        return self._materialize().popitem()
+
+    def clear(self):
+        self._own = {}
+        self._parents = self._keys = self._keyset = self._len_cache = None
+
+    def update(self, *args, **kwargs):
+        self._materialize().update(*args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        return self._materialize().setdefault(key, default)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
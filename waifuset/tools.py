@@ -4,6 +4,7 @@ from pathlib import Path
 from tqdm import tqdm
 from typing import Callable
 from .classes import Dataset, Caption, ImageInfo
+from .classes.dataset.journal import journal_path, dump_as_jsonl, compact_journal
 from .utils import log_utils as logu
 
 
@@ -35,6 +36,8 @@ def run_tagger(
     )
 
     pbar = tqdm(total=len(dataset), desc='Tagging')
+    jnl_path = journal_path(save_path)
+    unsaved_keys = []
 
     for i, item in enumerate(dataset.items()):
         image_key, image_info = item
@@ -55,20 +58,18 @@ def run_tagger(
             caption = transform(caption, image_info)
 
         dataset[image_key].caption = caption
+        unsaved_keys.append(image_key)
 
-        if i > 0 and i % save_every_n_steps == 0:
-            pbar.write(f'step {i} | saving to `{logu.yellow(save_path)}`...')
-            if save_path.suffix == '.csv':
-                dataset.to_csv(save_path, mode='a')
-            elif save_path.suffix == '.json':
-                dataset.to_json(save_path, mode='a')
+        if i > 0 and i % save_every_n_steps == 0:  # append only newly tagged records to the journal
+            pbar.write(f'step {i} | saving to `{logu.yellow(jnl_path)}`...')
+            dump_as_jsonl({key: dataset[key] for key in unsaved_keys}, jnl_path)
+            unsaved_keys = []
 
         pbar.update()
 
-    if save_path.suffix == '.csv':
-        dataset.to_csv(save_path, mode='a')
-    elif save_path.suffix == '.json':
-        dataset.to_json(save_path, mode='a')
+    # fold the journal into the snapshot
+    dump_as_jsonl({key: dataset[key] for key in unsaved_keys}, jnl_path)
+    compact_journal(save_path)
 
     pbar.close()
 
@@ -6,9 +6,13 @@ def parse_args():
 
     parser.add_argument('--source', type=str, default=None, nargs='+', help='Dataset source, can be a directory root, a json file or a csv file / 数据集源，可以是一个数据集文件夹，一个json文件或一个csv文件')
     parser.add_argument('--write_to_txt', action='store_true', help='Whether to write to txt caption files `{image}.txt` when saving / 是否在保存时将结果写入 `{图像}.txt` 的标注文件')
+    parser.add_argument('--caption_pack', action='store_true', help='Whether to write captions to a packed caption file per directory instead of `{image}.txt` files when saving with `--write_to_txt` / 是否在使用 `--write_to_txt` 保存时将标注写入每个文件夹的打包标注文件，而非 `{图像}.txt` 文件')
     parser.add_argument('--write_to_database', action='store_true', help='Whether to write to database when saving / 是否在保存时将结果写入数据库')
     parser.add_argument('--database_file', type=str, help='Database file output path / 数据库文件的输出路径')
 
+    parser.add_argument('--scan_manifest', action='store_true', help='Whether to cache directory scans in a manifest file under the source directory to speed up later startups / 是否在数据集文件夹下缓存扫描清单以加速之后的启动')
+    parser.add_argument('--lazy_database', action='store_true', help='Whether to open a `.jsonl` database lazily, which only parses the records of displayed images and appends edits to the database when saving / 是否惰性打开 `.jsonl` 数据库，仅解析显示中的图像记录，并在保存时将修改追加到数据库')
+
     parser.add_argument('--share', action='store_true', help='Whether to share the API / 是否共享API')
     parser.add_argument('--port', type=int, help='Port to run the API / 运行API的端口')
 
@@ -13,6 +13,7 @@ from . import custom_components as cc
 from .emoji import Emoji
 from ..classes.caption import tagging
 from ..classes.dataset import sorting
+from ..classes.data.path_table import PATH_TABLE
 from ..utils import log_utils as logu
 
 OPS = {
@@ -90,9 +91,13 @@ def prepare_dataset(
         formalize_caption=False,
         write_to_database=args.write_to_database,
         write_to_txt=args.write_to_txt,
+        caption_pack=args.caption_pack,
         database_file=args.database_file,
         chunk_size=args.chunk_size,
         read_attrs=True,
+        max_workers=args.max_workers,
+        manifest=args.scan_manifest,
+        lazy_database=args.lazy_database,
         verbose=True,
     )
 
@@ -121,7 +126,7 @@ def create_ui(
 
     def dataset_to_metadata_df(dset):
         num_images = len(dset)
-        cats = sorted(list(set(img_info.category for img_info in dset.values()))) if len(dset) > 0 else []
+        cats = sorted(set(PATH_TABLE.category(dir_id) for dir_id in dset.group_by_dir())) if len(dset) > 0 else []
         num_cats = len(cats)
         if num_cats > 5:
             cats = cats[:5] + ['...']
@@ -859,36 +864,35 @@ def create_ui(
                     chunk_index = min(max(chunk_index, 1), dset.num_chunks)
                 return chunk_index
 
+            def get_sorting_methods(sorting_methods):
+                r"""
+                Get the sorting functions of the selected `sorting_methods` and the extra arguments passed to them
+                """
+                if sorting_methods is None or len(sorting_methods) == 0:
+                    return [], {}
+                if univargs.language != 'en':
+                    sorting_methods = translate(sorting_methods, 'en')
+                sorting_methods = [method.replace(' ', '_') for method in sorting_methods]
+
+                extra_kwargs = {}
+                selected_img_key = univset.selected.image_key
+                if selected_img_key is not None:
+                    target = univset[selected_img_key]
+                    extra_kwargs['target'] = target.perceptual_hash
+                return [SORTING_METHODS[method] for method in sorting_methods], extra_kwargs
+
             def change_subset(newset, sorting_methods=None, reverse=False):
                 r"""
                 Change the current dataset to `dset`
                 """
                 nonlocal subset
 
-                # pre-sorting
-                if sorting_methods is not None and len(sorting_methods) > 0:
-                    if univargs.language != 'en':
-                        sorting_methods = translate(sorting_methods, 'en')
-                    sorting_methods = [method.replace(' ', '_') for method in sorting_methods]
-
-                    extra_kwargs = {}
-                    selected_img_key = univset.selected.image_key
-                    if selected_img_key is not None:
-                        target = univset[selected_img_key]
-                        extra_kwargs['target'] = target.perceptual_hash
-
-                    sorting_keys = []
-                    for method in sorting_methods:
-                        func = SORTING_METHODS[method]
-                        func_params = inspect.signature(func).parameters
-                        func_param_names = list(func_params.keys())
-                        sorting_keys.append((func, {k: v for k, v in extra_kwargs.items() if k in func_param_names}))
-
+                sorting_funcs, extra_kwargs = get_sorting_methods(sorting_methods)  # pre-sorting
                 subset = newset
 
                 # post-sorting
-                if sorting_methods is not None and len(sorting_methods) > 0:
-                    subset.sort(key=lambda item: tuple(func(item[1], **kwargs) for func, kwargs in sorting_keys), reverse=reverse)
+                if sorting_funcs:
+                    subset.sort_by(*sorting_funcs, reverse=reverse, **extra_kwargs)
 
             def show_dataset(showset=None, new_chunk_index=1):
                 r"""
@@ -915,7 +919,7 @@ def create_ui(
                 """
                 new_chunk_index = correct_chunk_idx(dset, new_chunk_index)
                 chunk = dset.chunk(new_chunk_index - 1) if isinstance(dset, UIChunkedDataset) else dset
-                df = chunk.df()
+                df = dset.df(keys=chunk.keys())  # rows are cached by `dset`, while chunks are made per call
                 return {
                     database: df,
                     cur_chunk_index: gr.update(value=new_chunk_index, label=f"{translate('Chunk', univargs.language)} {new_chunk_index}/{dset.num_chunks}"),
@@ -991,9 +995,31 @@ def create_ui(
                 r"""
                 Change current dataset to another dataset with category `category` and show its chunk
                 """
-                catset = univset if categories is None or len(categories) == 0 else univset.make_subset(condition=lambda img_info: img_info.category in set(categories))
+                catset = univset if categories is None or len(categories) == 0 else univset.filter_by_dir(PATH_TABLE.ids_of_category(*categories))
                 return change_to_dataset(catset, new_chunk_index=1, sorting_methods=sorting_methods, reverse=reverse)
 
+            def change_to_dataset_progressively(newset: UIChunkedDataset = None, new_chunk_index=1, sorting_methods=None, reverse=False):
+                r"""
+                Same as `change_to_dataset`, but show the first chunk of a sorted dataset by a top-k selection before the whole dataset is sorted
+                """
+                if newset is None:
+                    newset = subset
+                sorting_funcs, extra_kwargs = get_sorting_methods(sorting_methods)
+                if sorting_funcs and ui_main_tab.tab is tagging_tab and correct_chunk_idx(newset, new_chunk_index) == 1 and len(newset) > univargs.chunk_size:
+                    chunk = newset.top_k(sorting_funcs, univargs.chunk_size, reverse=reverse, **extra_kwargs)
+                    yield {
+                        showcase: dataset_to_gallery(chunk),
+                        log_box: f"sorting {len(newset)} images...",
+                    }
+                yield change_to_dataset(newset, new_chunk_index, sorting_methods=sorting_methods, reverse=reverse)
+
+            def change_to_categories_progressively(categories, sorting_methods=None, reverse=False):
+                r"""
+                Same as `change_to_categories`, but show the first chunk early, see `change_to_dataset_progressively`
+                """
+                catset = univset if categories is None or len(categories) == 0 else univset.filter_by_dir(PATH_TABLE.ids_of_category(*categories))
+                yield from change_to_dataset_progressively(catset, new_chunk_index=1, sorting_methods=sorting_methods, reverse=reverse)
+
             dataset_change_inputs = [cur_chunk_index, sorting_methods_dropdown, sorting_reverse_checkbox]
             dataset_change_listeners = [showcase, dataset_metadata_df, cur_image_key, database, cur_chunk_index, category_selector, log_box]
 
@@ -1007,7 +1033,7 @@ def create_ui(
             # )
 
             reload_category_btn.click(
-                fn=change_to_categories,
+                fn=change_to_categories_progressively,
                 inputs=[category_selector, sorting_methods_dropdown, sorting_reverse_checkbox],
                 outputs=dataset_change_listeners,
                 trigger_mode='multiple',
@@ -1033,7 +1059,7 @@ def create_ui(
             )
 
             reload_sort_btn.click(
-                fn=lambda *args: change_to_dataset(subset, *args),
+                fn=lambda *args: (yield from change_to_dataset_progressively(subset, *args)),
                 inputs=dataset_change_inputs,
                 outputs=dataset_change_listeners,
                 show_progress=True,
@@ -2106,7 +2132,7 @@ def create_ui(
                     if univargs.language != 'en':
                         quality = [translate(q, 'en') for q in quality]
                     quality = [q.lower() for q in quality]
-                resset = queryset.make_subset(condition=lambda img_info: img_info.caption is not None and img_info.caption.quality in set(quality))
+                resset = queryset.query({'quality': quality, 'caption_length': ('!=', None)})
                 return resset
 
             query_quality_btn.click(
@@ -2126,7 +2152,7 @@ def create_ui(
                     max_score = float('inf')
                 if min_score > max_score:
                     return None
-                resset = queryset.make_subset(condition=lambda img_info: img_info.aesthetic_score is not None and min_score <= img_info.aesthetic_score <= max_score)
+                resset = queryset.query(f"aesthetic_score >= {float(min_score)!r} & aesthetic_score <= {float(max_score)!r}")
                 return resset
 
             query_aes_score_btn.click(
@@ -1,7 +1,7 @@
 import re
 import math
+import itertools
 import os
-import json
 import time
 import gradio as gr
 from pathlib import Path
@@ -9,7 +9,13 @@ from typing import List, Dict
 from typing import Union, Tuple, Iterable
 from ..classes import Dataset, ImageInfo, Caption
 from ..classes.caption.caption import fmt2danbooru, tag2type
-from ..utils import log_utils as logu
+from ..classes.dataset.sqlite_dataset import SQLiteStorage, SQLITE_EXTS
+from ..classes.dataset.view import DatasetView
+from ..classes.dataset.jsonl_index import LazyStorage
+from ..classes.dataset.journal import dump_as_jsonl, compact_journal
+from ..classes.data.path_table import PATH_TABLE
+from ..classes.data.caption_pack import get_pack
+from ..utils import log_utils as logu, json_utils
 
 
 class UISelectData:
@@ -228,7 +234,7 @@ class UIChunkedDataset(Dataset):
             return self
         elif index < 0 or index >= self.num_chunks:
             return Dataset()
-        return Dataset(self.values()[index * self.chunk_size: (index + 1) * self.chunk_size])
+        return Dataset(DatasetView([self._data], list(itertools.islice(self._data, index * self.chunk_size, (index + 1) * self.chunk_size))))
 
     @property
     def num_chunks(self):
@@ -336,7 +342,7 @@ class UIDataset(UIChunkedDataset):
     selected: UISelectData
     edit_history: UIEditHistory
 
-    def __init__(self, source=None, write_to_database=False, write_to_txt=False, database_file=None, backup_dir=None, *args, **kwargs):
+    def __init__(self, source=None, write_to_database=False, write_to_txt=False, database_file=None, backup_dir=None, caption_pack=False, lazy_database=False, *args, **kwargs):
         self.init_logger(prefix_color=logu.ANSI.BRIGHT_MAGENTA)
         if write_to_database and database_file is None:
             raise ValueError("database file must be specified when write_to_database is True.")
@@ -346,17 +352,21 @@ class UIDataset(UIChunkedDataset):
 
         self.write_to_database = write_to_database
         self.write_to_txt = write_to_txt
+        self.caption_pack = caption_pack
         self.database_file = Path(database_file).absolute() if database_file else None
         self.backup_dir = Path(backup_dir or './backups').absolute()
 
         if (same_json_rw := len(source) == 1 and (write_to_database and not write_to_txt) and self.database_file.is_file() and self.database_file.samefile(source[0])):
             self.log(f"synchronous database R/W")
-            super().__init__(source, *args, **kwargs)
+            if lazy_database and self.database_file.suffix == '.jsonl' and not kwargs.get('formalize_caption', False):  # only keep keys and offsets in memory
+                super().__init__(LazyStorage(self.database_file), *args, **kwargs)
+            else:
+                super().__init__(source, *args, **kwargs)
             database = None
         elif (same_txt_rw := (write_to_txt and not write_to_database) and all(isinstance(src, (str, Path)) and os.path.isdir(src) for src in source)):
             self.log(f"synchronous txts R/W")
             super().__init__(source, *args, **kwargs)
-            database = Dataset(source, read_attrs=False, recur=True, verbose=False).make_subset(lambda x: x.image_path.with_suffix('.txt').is_file())
+            database = Dataset(source, read_attrs=False, recur=True, manifest=kwargs.get('manifest', False), verbose=False).make_subset(lambda x: x.image_path.with_suffix('.txt').is_file() or in_caption_pack(x))
         else:
             if self.write_to_database:
                 self.log(f"asynchronous R/W | overload: {logu.yellow(source[0]) if len(source) == 1 else logu.yellow(source)} -> {logu.yellow(self.database_file)}")
@@ -369,7 +379,7 @@ class UIDataset(UIChunkedDataset):
 
         # self.subsets = None
         self.buffer = Dataset()
-        self.categories = sorted(list(set(img_info.category for img_info in self.values()))) if len(self) > 0 else []
+        self.categories = sorted(set(PATH_TABLE.category(dir_id) for dir_id in self.group_by_dir())) if len(self) > 0 else []
         self.tag_table = None
         self.selected = UISelectData()
         self.edit_history = UIEditHistory()
@@ -383,9 +393,21 @@ class UIDataset(UIChunkedDataset):
                     self.buffer[img_key] = self[img_key]
         self.log(f"info: total={logu.green(len(self))} | buffer={logu.green(len(self.buffer))} | categories={logu.green(len(self.categories))}")
 
-    def make_subset(self, *args, **kwargs):
-        kwargs['cls'] = UIChunkedDataset
-        return super().make_subset(*args, **kwargs)
+    def _subset_of_keys(self, keys, cls=None, *args, **kwargs):
+        return super()._subset_of_keys(keys, UIChunkedDataset, *args, **kwargs)
+
+    def copy(self):
+        r"""
+        Copy the dataset, and deep copy the buffer, subset, selection, edit history and tag table, which are edited in place, so that editing the copy leaves the original as is.
+        Image infos of the buffer and the subset are the copies in the new dataset, as in the original.
+        """
+        from copy import deepcopy
+        dataset = super().copy()
+        memo = {id(self): dataset, id(self._data): dataset._data}
+        memo.update((id(image_info), dataset._data[image_key]) for image_key, image_info in self.items())
+        dataset.buffer, dataset.subset, dataset.selected, dataset.edit_history, dataset.tag_table = deepcopy((self.buffer, self.subset, self.selected, self.edit_history, self.tag_table), memo)
+        dataset.categories = list(self.categories)
+        return dataset
 
     def init_tag_table(self):
         if self.tag_table is not None:
@@ -528,14 +550,27 @@ class UIDataset(UIChunkedDataset):
         if self.write_to_database:
             if self.verbose:
                 tic = time.time()
-            if not self.database_file.is_file():  # dump all
+            if self.database_file.suffix in SQLITE_EXTS:  # single-row upserts and deletions
+                storage = SQLiteStorage(self.database_file)
+                storage.update((img_key, img_info) for img_key, img_info in self.buffer.items() if img_key in self)
+                storage.delete([img_key for img_key in self.buffer.keys() if img_key not in self])
+                storage.close()
+            elif isinstance(self._data, LazyStorage) and self._data.fp == self.database_file:  # edits are already buffered in the lazy storage
+                self._data.commit()
+            elif not self.database_file.is_file():  # dump all
                 self.database_file.parent.mkdir(parents=True, exist_ok=True)
-                self.to_json(self.database_file)
+                if self.database_file.suffix == '.jsonl':
+                    self.to_jsonl(self.database_file)
+                else:
+                    self.to_json(self.database_file)
+            elif self.database_file.suffix == '.jsonl':  # append history to the journal
+                records = Dataset({img_key: img_info for img_key, img_info in self.buffer.items() if img_key in self})
+                dump_as_jsonl(records, self.database_file, deleted=[img_key for img_key in self.buffer.keys() if img_key not in self])
             else:  # dump history only
+                compact_journal(self.database_file)  # fold older journal records into the snapshot, otherwise they are replayed on top of it
                 try:
-                    with open(self.database_file, 'r', encoding='utf-8') as f:
-                        json_data = json.load(f)
-                except json.JSONDecodeError:
+                    json_data = json_utils.load(self.database_file)
+                except ValueError:
                     backup(self.database_file)
                     json_data = {}
                     self.log(f"json file `{self.database_file}` is corrupted, backup to `{self.database_file}.bak`.")  # corrupted json file
@@ -544,8 +579,7 @@ class UIDataset(UIChunkedDataset):
                         json_data[img_key] = img_info.dict()
                     elif img_key in json_data:
                         del json_data[img_key]
-                with open(self.database_file, 'w', encoding='utf-8') as f:
-                    json.dump(json_data, f, indent=4, ensure_ascii=False, sort_keys=False)
+                json_utils.dump(json_data, self.database_file, indent=4)
             if self.verbose:
                 toc = time.time()
                 time_cost1 = toc - tic
@@ -553,12 +587,24 @@ class UIDataset(UIChunkedDataset):
         if self.write_to_txt:
             if self.verbose:
                 tic = time.time()
-            for img_key, img_info in self.pbar(self.buffer.items(), desc='dumping to txts', disable=not self.verbose):
-                img_info: ImageInfo
-                if img_key in self:
-                    img_info.write_txt_caption()
-                else:
-                    backup_img_info(img_info)
+            if self.caption_pack:  # one append per directory
+                captions = {}
+                for img_key, img_info in self.buffer.items():
+                    if img_key in self:
+                        if img_info.caption is not None:
+                            captions.setdefault(img_info.dir_id, {})[img_info.key] = img_info.caption
+                    else:
+                        backup_img_info(img_info)
+                        captions.setdefault(img_info.dir_id, {})[img_info.key] = None
+                for dir_id, dir_captions in self.pbar(captions.items(), desc='dumping to caption packs', disable=not self.verbose):
+                    get_pack(PATH_TABLE.dir(dir_id), create=True).update(dir_captions)
+            else:
+                for img_key, img_info in self.pbar(self.buffer.items(), desc='dumping to txts', disable=not self.verbose):
+                    img_info: ImageInfo
+                    if img_key in self:
+                        img_info.write_txt_caption()
+                    else:
+                        backup_img_info(img_info)
             if self.verbose:
                 toc = time.time()
                 time_cost2 = toc - tic
@@ -584,6 +630,11 @@ def backup(fp):
     return True
 
 
+def in_caption_pack(image_info):
+    pack = get_pack(PATH_TABLE.dir(image_info.dir_id))
+    return pack is not None and image_info.key in pack
+
+
 def backup_img_info(image_info):
     img_path = image_info.image_path
     return backup(img_path) and backup(img_path.with_suffix('.txt'))
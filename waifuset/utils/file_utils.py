@@ -65,6 +65,66 @@ def listdir(
     return files
 
 
+def scandir(
+    directory: StrPath,
+    exts: Optional[Iterable[str]] = None,
+    recur: Optional[bool] = True,
+    max_workers: Optional[int] = None,
+):
+    r"""
+    List files in a directory with `os.scandir`, scanning subdirectories in parallel.
+    File order is the same as `listdir(..., recur=True)`, i.e. top-down, parent files first.
+    :param directory: The directory to list files in.
+    :param exts: The extensions to filter by. If None, all files are returned.
+    :param recur: Whether to recursively list files in subdirectories.
+    :param max_workers: The number of scanning threads. If None, uses the default of `ThreadPoolExecutor`.
+    :return: A list of absolute file paths as str.
+    """
+    import concurrent.futures as cf
+    directory = os.path.abspath(directory)
+
+    def scan_one(dirpath):
+        files, subdirs = [], []
+        try:
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()  # use cached d_type, no extra stat
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        if recur and not entry.is_symlink():  # os.walk doesn't follow symlinks by default
+                            subdirs.append(entry.path)
+                    elif not exts or os.path.splitext(entry.name)[1] in exts:
+                        files.append(entry.path)
+        except OSError:
+            pass
+        return files, subdirs
+
+    if not recur:
+        return scan_one(directory)[0]
+
+    tree = {}
+    with cf.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(scan_one, directory): directory}
+        while futures:
+            done, _ = cf.wait(futures, return_when=cf.FIRST_COMPLETED)
+            for future in done:
+                dirpath = futures.pop(future)
+                tree[dirpath] = future.result()
+                for subdir in tree[dirpath][1]:
+                    futures[executor.submit(scan_one, subdir)] = subdir
+
+    # assemble in top-down order
+    files = []
+    stack = [directory]
+    while stack:
+        dir_files, subdirs = tree[stack.pop()]
+        files.extend(dir_files)
+        stack.extend(reversed(subdirs))
+    return files
+
+
 def smart_name(
     filename_pattern: str,
     increment_extensions: Optional[Iterable[str]] = None,
@@ -131,6 +191,52 @@ def remove_empty(root: StrPath, recur: Optional[bool] = False):
             os.rmdir(dir_p)
 
 
+COMPRESSION_EXTS = ('.gz', '.zst')
+
+
+def split_compression_suffix(fp: StrPath):
+    r"""
+    Split the suffix of a possibly compressed file into `(suffix, compression_suffix)`, e.g. `db.json.zst` -> `('.json', '.zst')` and `db.json` -> `('.json', '')`.
+    """
+    fp = Path(fp)
+    if fp.suffix in COMPRESSION_EXTS:
+        return Path(fp.stem).suffix, fp.suffix
+    return fp.suffix, ''
+
+
+def open_file(fp: StrPath, mode='r', encoding='utf-8', newline=None):
+    r"""
+    Open a text file, transparently (de)compressing it by its suffix, i.e. `.gz` with gzip and `.zst` with zstandard.
+    Compressed files are read and written as streams. Appending adds a new gzip member or zstd frame, which readers decode as one stream.
+    :param mode: 'r', 'w' or 'a'.
+    """
+    compression = split_compression_suffix(fp)[1]
+    if compression == '.gz':
+        import gzip
+        return gzip.open(fp, mode + 't', compresslevel=6, encoding=encoding, newline=newline)
+    elif compression == '.zst':
+        import zstandard
+        return zstandard.open(fp, mode + 't', encoding=encoding, newline=newline)
+    return open(fp, mode, encoding=encoding, newline=newline)
+
+
+def write_bytes_atomic(fp: StrPath, data: bytes):
+    r"""
+    Write bytes to a temporary file in the same directory and rename it to `fp`, so that `fp` is never left half-written.
+    """
+    import threading
+    fp = str(fp)
+    tmp_fp = os.path.join(os.path.dirname(fp), f".{os.path.basename(fp)}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_fp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_fp, fp)
+    except BaseException:
+        if os.path.exists(tmp_fp):
+            os.remove(tmp_fp)
+        raise
+
+
 def formalize_name(s):
     from googletrans import Translator
     # 1. split s into chinese, japanese, koran and english parts
@@ -1,7 +1,7 @@
 import cv2
 import numpy as np
-import json
 from PIL import Image
+from . import json_utils
 
 
 def load_image(
@@ -87,7 +87,7 @@ def parse_gen_info(metadata):
         elif 'Title' in metadata:  # nai style
             gen_info.update(metadata)
             params = gen_info['Comment']  # str
-            params = json.loads(params)  # dict
+            params = json_utils.loads(params)  # dict
             del gen_info['Comment']
             params = {k.capitalize(): v for k, v in params.items()}
             params['Positive prompt'] = params.pop('Prompt')
@@ -0,0 +1,223 @@
+import os
+import json
+import itertools
+from pathlib import Path
+from typing import Iterator, Tuple, Any
+from .file_utils import open_file, split_compression_suffix
+
+WHITESPACE = ' \t\n\r'
+_decoder = json.JSONDecoder()
+
+
+class JsonCodec:
+    r"""
+    Json encoder and decoder backed by `orjson`, `ujson` or the standard `json` module.
+    All backends read the same files. Decoding errors are raised as `ValueError`, the base class of `json.JSONDecodeError`.
+    `orjson` only supports an indent of 2, so any non-zero indent is written as 2 spaces with it.
+    """
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        if backend == 'orjson':
+            import orjson
+            self._orjson = orjson
+            self.loads = orjson.loads
+        elif backend == 'ujson':
+            import ujson
+            self._ujson = ujson
+            self.loads = ujson.loads
+        elif backend == 'json':
+            self.loads = json.loads
+        else:
+            raise ValueError(f"unsupported json backend: {backend}")
+
+    def dumps(self, obj, indent=None, sort_keys=False) -> str:
+        r"""
+        Serialize `obj` to a json string, without escaping non-ascii characters. `indent=None` gives the compact form.
+        """
+        if self.backend == 'orjson':
+            option = self._orjson.OPT_NON_STR_KEYS | self._orjson.OPT_SERIALIZE_NUMPY
+            if indent:
+                option |= self._orjson.OPT_INDENT_2
+            if sort_keys:
+                option |= self._orjson.OPT_SORT_KEYS
+            return self._orjson.dumps(obj, option=option).decode('utf-8')
+        elif self.backend == 'ujson':
+            return self._ujson.dumps(obj, indent=indent or 0, sort_keys=sort_keys, ensure_ascii=False, escape_forward_slashes=False)
+        return json.dumps(obj, indent=indent, sort_keys=sort_keys, ensure_ascii=False, separators=None if indent else (',', ':'))
+
+    def load(self, fp) -> Any:
+        r"""
+        Load a json file, which may be compressed, see `open_file`.
+        """
+        if self.backend == 'orjson' and not split_compression_suffix(fp)[1]:
+            with open(fp, 'rb') as f:
+                return self.loads(f.read())
+        with open_file(fp, 'r') as f:
+            return self.loads(f.read())
+
+    def dump(self, obj, fp, indent=None, sort_keys=False):
+        with open_file(fp, 'w') as f:
+            f.write(self.dumps(obj, indent=indent, sort_keys=sort_keys))
+
+
+JSON_BACKENDS = ('orjson', 'ujson', 'json')
+_codec = None
+
+
+def set_json_backend(backend: str = None) -> JsonCodec:
+    r"""
+    Select the json backend used by `loads`, `dumps`, `load` and `dump`.
+    :param backend: One of 'orjson', 'ujson' and 'json'. If None, uses the `WAIFUSET_JSON_BACKEND` environment variable if set, otherwise the first installed one of `JSON_BACKENDS`.
+    """
+    global _codec
+    backend = backend or os.environ.get('WAIFUSET_JSON_BACKEND')
+    if backend:
+        _codec = JsonCodec(backend)
+        return _codec
+    for backend in JSON_BACKENDS:
+        try:
+            _codec = JsonCodec(backend)
+            return _codec
+        except ImportError:
+            continue
+
+
+def get_codec() -> JsonCodec:
+    return _codec or set_json_backend()
+
+
+def loads(s) -> Any:
+    return get_codec().loads(s)
+
+
+def dumps(obj, indent=None, sort_keys=False) -> str:
+    return get_codec().dumps(obj, indent=indent, sort_keys=sort_keys)
+
+
+def load(fp) -> Any:
+    return get_codec().load(fp)
+
+
+def dump(obj, fp, indent=None, sort_keys=False):
+    return get_codec().dump(obj, fp, indent=indent, sort_keys=sort_keys)
+
+
+def iter_compact_json_items(f) -> Iterator[Tuple[str, Any]]:
+    r"""
+    Iterate over the entries of a json object written in the compact layout of `dump_json_items`, one `"key":value` entry per line.
+    Each entry is decoded on its own with the selected backend. Raises `ValueError` at the first line that doesn't follow the layout.
+    """
+    codec = get_codec()
+    if f.readline().strip() != '{':
+        raise ValueError("not a compact json object")
+    for line in f:
+        line = line.strip()
+        if line == '}':
+            return
+        if not line:
+            continue
+        entry = codec.loads('{' + (line[:-1] if line.endswith(',') else line) + '}')
+        if len(entry) != 1:
+            raise ValueError("not a compact json object")
+        yield from entry.items()
+    raise ValueError("unterminated json object")
+
+
+def dump_json_items(items, f):
+    r"""
+    Write `(key, value)` pairs as a json object in a compact layout with one entry per line, which `iter_json_items` reads back entry by entry with the fast backend.
+    """
+    codec = get_codec()
+    f.write('{')
+    first = True
+    for key, value in items:
+        f.write('\n' if first else ',\n')
+        f.write(codec.dumps(key))
+        f.write(':')
+        f.write(codec.dumps(value))
+        first = False
+    f.write('\n}\n')
+
+
+def iter_json_items(fp, chunk_size: int = 1 << 20) -> Iterator[Tuple[str, Any]]:
+    r"""
+    Lazily iterate over `(key, value)` pairs of a json file whose top level is an object, e.g. a database written by `dump_as_json`.
+    Only one entry is held in memory at a time besides a read buffer of about `chunk_size` characters.
+    :param fp: A file path or a text file object.
+    :param chunk_size: Number of characters to read from the file at a time.
+    """
+    if isinstance(fp, (str, Path)):  # files compressed by suffix are decompressed as streams, see `open_file`
+        num_items = 0
+        with open_file(fp, 'r') as f:
+            try:  # fast path for the compact layout of `dump_json_items`
+                for item in iter_compact_json_items(f):
+                    yield item
+                    num_items += 1
+                return
+            except ValueError:
+                pass
+        with open_file(fp, 'r') as f:
+            for item in itertools.islice(iter_json_items(f, chunk_size=chunk_size), num_items, None):  # skip entries already yielded
+                yield item
+        return
+
+    f = fp
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    def expect(*chars):
+        nonlocal pos
+        skip_ws()
+        if pos >= len(buf) or buf[pos] not in chars:
+            found = buf[pos] if pos < len(buf) else 'EOF'
+            raise json.JSONDecodeError(f"Expecting {' or '.join(repr(c) for c in chars)}, found {found!r}", buf, pos)
+        pos += 1
+        return buf[pos - 1]
+
+    def decode():
+        nonlocal pos
+        skip_ws()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(buf, pos)
+                if end < len(buf) or eof:  # a value ending exactly at the buffer end may be truncated, e.g. a number
+                    pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+
+    fill()
+    expect('{')
+    skip_ws()
+    if pos < len(buf) and buf[pos] == '}':
+        return
+    while True:
+        key = decode()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expecting property name enclosed in double quotes", buf, pos)
+        expect(':')
+        value = decode()
+        yield key, value
+        if expect(',', '}') == '}':
+            return